@@ -0,0 +1,200 @@
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+# Shortest query the trigram index can answer; shorter ones fall back to a scan
+MIN_INDEXED_QUERY_LENGTH = 3
+
+# A search that found nothing is retried after this long, since LRCLib keeps growing
+EMPTY_RESULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+SCHEMA = (
+    # One row per LRCLib record
+    """
+    CREATE TABLE IF NOT EXISTS lyrics (
+        id INTEGER PRIMARY KEY,
+        track_name TEXT NOT NULL,
+        artist_name TEXT NOT NULL,
+        album_name TEXT NOT NULL,
+        duration REAL NOT NULL,
+        plain_lyrics TEXT NOT NULL
+    )
+    """,
+    # An LRCLib search, by normalized (track, artist, album); may have no results
+    """
+    CREATE TABLE IF NOT EXISTS searches (
+        track_key TEXT PRIMARY KEY,
+        fetched_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS search_results (
+        track_key TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        lyrics_id INTEGER NOT NULL,
+        PRIMARY KEY (track_key, position),
+        FOREIGN KEY (track_key) REFERENCES searches (track_key),
+        FOREIGN KEY (lyrics_id) REFERENCES lyrics (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS spotify_tracks (
+        spotify_id TEXT PRIMARY KEY,
+        track_key TEXT NOT NULL,
+        FOREIGN KEY (track_key) REFERENCES searches (track_key)
+    )
+    """,
+    # Trigram tokens match any substring, which suits Chinese lyrics
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS lyrics_fts USING fts5 (
+        track_name, artist_name, plain_lyrics,
+        content = 'lyrics', content_rowid = 'id',
+        tokenize = 'trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS lyrics_fts_insert AFTER INSERT ON lyrics BEGIN
+        INSERT INTO lyrics_fts (rowid, track_name, artist_name, plain_lyrics)
+        VALUES (new.id, new.track_name, new.artist_name, new.plain_lyrics);
+    END
+    """,
+)
+
+def normalize_key(track_name: str, artist_name: str, album_name: str) -> str:
+    """Key a (track, artist, album) tuple so trivial spelling differences share lyrics"""
+    parts = []
+    for part in (track_name, artist_name, album_name):
+        part = unicodedata.normalize("NFKC", part).casefold()
+        parts.append(re.sub(r"\s+", " ", part).strip())
+    return "\x1f".join(parts)
+
+class LyricsStore:
+    """SQLite store of LRCLib results, looked up by Spotify id or track tuple.
+
+    Lyrics never change, so once a search has been stored it is served from
+    here instead of LRCLib. A search with no results is only served for
+    empty_result_ttl_seconds after it was fetched; then it counts as never
+    fetched, so the caller asks LRCLib again. Every stored lyric is also
+    full-text indexed.
+    """
+
+    def __init__(self, db_path: str, empty_result_ttl_seconds: float = EMPTY_RESULT_TTL_SECONDS):
+        self.db_path = db_path
+        self.empty_result_ttl_seconds = empty_result_ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA busy_timeout = 5000")
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        return {
+            "id": row["id"],
+            "trackName": row["track_name"],
+            "artistName": row["artist_name"],
+            "albumName": row["album_name"],
+            "duration": row["duration"],
+            "plainLyrics": row["plain_lyrics"],
+        }
+
+    def _results(self, track_key: str) -> Optional[List[Dict]]:
+        search = self._conn.execute(
+            "SELECT fetched_at FROM searches WHERE track_key = ?", (track_key,)
+        ).fetchone()
+        if search is None:
+            return None
+        rows = self._conn.execute("""
+            SELECT l.* FROM search_results r
+            JOIN lyrics l ON l.id = r.lyrics_id
+            WHERE r.track_key = ?
+            ORDER BY r.position
+        """, (track_key,)).fetchall()
+        if not rows and search["fetched_at"] < time.time() - self.empty_result_ttl_seconds:
+            return None
+        return [self._to_dict(row) for row in rows]
+
+    def get_by_spotify_id(self, spotify_id: str) -> Optional[List[Dict]]:
+        """Stored results for a Spotify track, or None if it was never fetched or its empty result expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT track_key FROM spotify_tracks WHERE spotify_id = ?", (spotify_id,)
+            ).fetchone()
+            return self._results(row["track_key"]) if row else None
+
+    def get_by_track(self, spotify_id: str, track_name: str, artist_name: str,
+                     album_name: str) -> Optional[List[Dict]]:
+        """Stored results for a track tuple, remembering spotify_id on a hit"""
+        track_key = normalize_key(track_name, artist_name, album_name)
+        with self._lock:
+            results = self._results(track_key)
+            if results is not None:
+                self._conn.execute("""
+                    INSERT INTO spotify_tracks (spotify_id, track_key) VALUES (?, ?)
+                    ON CONFLICT(spotify_id) DO UPDATE SET track_key = excluded.track_key
+                """, (spotify_id, track_key))
+            return results
+
+    def put(self, spotify_id: str, track_name: str, artist_name: str, album_name: str,
+            results: List[Dict]):
+        """Store the LRCLib results for a track, even when there are none"""
+        track_key = normalize_key(track_name, artist_name, album_name)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("""
+                    INSERT INTO lyrics (id, track_name, artist_name, album_name, duration, plain_lyrics)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(id) DO NOTHING
+                """, [(r["id"], r["trackName"], r["artistName"], r["albumName"], r["duration"], r["plainLyrics"])
+                      for r in results])
+                self._conn.execute("""
+                    INSERT INTO searches (track_key, fetched_at) VALUES (?, ?)
+                    ON CONFLICT(track_key) DO UPDATE SET fetched_at = excluded.fetched_at
+                """, (track_key, time.time()))
+                self._conn.execute("DELETE FROM search_results WHERE track_key = ?", (track_key,))
+                self._conn.executemany("""
+                    INSERT INTO search_results (track_key, position, lyrics_id) VALUES (?, ?, ?)
+                """, [(track_key, position, r["id"]) for position, r in enumerate(results)])
+                self._conn.execute("""
+                    INSERT INTO spotify_tracks (spotify_id, track_key) VALUES (?, ?)
+                    ON CONFLICT(spotify_id) DO UPDATE SET track_key = excluded.track_key
+                """, (spotify_id, track_key))
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def search(self, query: str, limit: int = 20) -> List[Dict]:
+        """Find stored lyrics containing query in their text, title or artist"""
+        query = query.strip()
+        if not query:
+            return []
+        with self._lock:
+            if len(query) >= MIN_INDEXED_QUERY_LENGTH:
+                rows = self._conn.execute("""
+                    SELECT l.* FROM lyrics_fts f
+                    JOIN lyrics l ON l.id = f.rowid
+                    WHERE lyrics_fts MATCH ?
+                    ORDER BY f.rank
+                    LIMIT ?
+                """, ('"' + query.replace('"', '""') + '"', limit)).fetchall()
+            else:
+                # Too short for trigrams, e.g. a two-character Chinese word
+                pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                rows = self._conn.execute("""
+                    SELECT * FROM lyrics
+                    WHERE plain_lyrics LIKE ? ESCAPE '\\' OR track_name LIKE ? ESCAPE '\\'
+                    ORDER BY id
+                    LIMIT ?
+                """, (pattern, pattern, limit)).fetchall()
+            return [self._to_dict(row) for row in rows]
+
+    def close(self):
+        self._conn.close()
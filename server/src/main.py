@@ -1,24 +1,54 @@
+import asyncio
+import json
 import os
-from fastapi import FastAPI, Path, HTTPException
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Path, Query, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List
-import requests
+from typing import Awaitable, Dict, List, Optional, Union
+import httpx
 from dotenv import load_dotenv
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+from .lyrics_store import LyricsStore
+from .metrics import METRICS
+from .study import XUEDU_METRICS, LyricsAnnotator, XueDuApp
 
 load_dotenv()
 
-app = FastAPI()
+# Local store of every LRCLib result, so repeat lookups skip the network
+LYRICS_DB_PATH = os.getenv("LYRICS_DB_PATH", "lyrics.db")
+MAX_SEARCH_RESULTS = 100
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["GET"],
-    allow_headers=["*"],
-)
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+LRCLIB_SEARCH_URL = "https://lrclib.net/api/search"
+
+# Per-upstream timeouts and limits on requests in flight
+SPOTIFY_TIMEOUT = httpx.Timeout(5.0)
+LRCLIB_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+SPOTIFY_MAX_CONCURRENCY = 50
+LRCLIB_MAX_CONCURRENCY = 20
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=40)
+
+# Spotify's multi-track endpoint accepts at most this many ids per call
+SPOTIFY_TRACKS_PER_REQUEST = 50
+# Spotify track ids are 22 base62 characters
+SPOTIFY_ID_PATTERN = re.compile(r"[0-9A-Za-z]{22}")
+MAX_BATCH_TRACKS = 500
+
+# Refresh the Spotify token this long before it actually expires
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+
+# Combined Spotify + LRCLib results, by Spotify track id
+TRACK_CACHE_TTL_SECONDS = 24 * 60 * 60
+TRACK_CACHE_MAX_ENTRIES = 10_000
+
+# Fully annotated study lines, by LRCLib id
+STUDY_CACHE_MAX_ENTRIES = 1_000
 
 class SpotifyArtist(BaseModel):
     name: str
@@ -39,34 +69,454 @@ class LRCLibResponse(BaseModel):
     duration: float
     plainLyrics: str
 
-@app.get("/track/{spotify_id}", response_model=List[LRCLibResponse])
-def get_track(spotify_id: str = Path(...)):
-    client_id = os.getenv("SPOTIFY_CLIENT_ID")
-    client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
-    if not client_id or not client_secret:
-        raise HTTPException(status_code=500, detail="SPOTIPY_CLIENT_ID and SPOTIPY_CLIENT_SECRET must be set")
-
-    auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-    sp = spotipy.Spotify(auth_manager=auth_manager)
+class TracksRequest(BaseModel):
+    ids: List[str]
+
+class TrackLyrics(BaseModel):
+    spotify_id: str
+    lyrics: List[LRCLibResponse] = []
+    error: Optional[str] = None
+
+class StudyYuKuai(BaseModel):
+    id: int
+    type: str
+    name: str
+    description: str
+    pinyin: Optional[str] = None
+
+class StudyLine(BaseModel):
+    seq: int  # Position among the non-blank lines of the lyrics
+    text: str
+    yu_kuai: List[StudyYuKuai] = []
+    # False if the line could not be parsed yet; a later request retries it
+    annotated: bool = True
+
+class StudyLyrics(BaseModel):
+    spotify_id: str
+    lyrics: LRCLibResponse
+    lines: List[StudyLine]
+
+# Lyrics for a track, or the error to report for it
+TrackOutcome = Union[List[LRCLibResponse], HTTPException]
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed time"""
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        METRICS.inc("cache_lookups_total", cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+async def upstream_request(upstream: str, request: Awaitable[httpx.Response]) -> httpx.Response:
+    # Await one upstream call, timing it and counting it by status or error
+    try:
+        with METRICS.time("upstream_request_seconds", upstream=upstream):
+            response = await request
+    except httpx.HTTPError as e:
+        METRICS.inc("upstream_requests_total", upstream=upstream, status=type(e).__name__)
+        raise
+    METRICS.inc("upstream_requests_total", upstream=upstream, status=response.status_code)
+    return response
+
+class SpotifyClient:
+    """Spotify Web API calls with a shared client-credentials token"""
+
+    def __init__(self, http: httpx.AsyncClient, client_id: str, client_secret: str):
+        self.http = http
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(SPOTIFY_MAX_CONCURRENCY)
+
+    async def _get_token(self, refresh: bool = False) -> str:
+        # One request refreshes the token while concurrent ones wait for it
+        async with self._token_lock:
+            if refresh or self._token is None or time.monotonic() >= self._token_expires_at:
+                response = await upstream_request("spotify_token", self.http.post(
+                    SPOTIFY_TOKEN_URL,
+                    data={"grant_type": "client_credentials"},
+                    auth=(self.client_id, self.client_secret),
+                    timeout=SPOTIFY_TIMEOUT,
+                ))
+                response.raise_for_status()
+                token_data = response.json()
+                self._token = token_data["access_token"]
+                self._token_expires_at = (
+                    time.monotonic() + token_data.get("expires_in", 3600) - TOKEN_EXPIRY_MARGIN_SECONDS
+                )
+            return self._token
+
+    async def get(self, path: str, params: Optional[dict] = None) -> dict:
+        async with self._semaphore:
+            token = await self._get_token()
+            response = await upstream_request("spotify", self.http.get(
+                f"{SPOTIFY_API_URL}{path}",
+                params=params,
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=SPOTIFY_TIMEOUT,
+            ))
+            if response.status_code == 401:
+                token = await self._get_token(refresh=True)
+                response = await upstream_request("spotify", self.http.get(
+                    f"{SPOTIFY_API_URL}{path}",
+                    params=params,
+                    headers={"Authorization": f"Bearer {token}"},
+                    timeout=SPOTIFY_TIMEOUT,
+                ))
+            response.raise_for_status()
+            return response.json()
+
+    async def tracks(self, spotify_ids: List[str]) -> List[Optional[dict]]:
+        # None for ids Spotify does not know
+        data = await self.get("/tracks", params={"ids": ",".join(spotify_ids)})
+        return data["tracks"]
+
+class LRCLibClient:
+    """LRCLib search calls, limited in concurrency"""
+
+    def __init__(self, http: httpx.AsyncClient):
+        self.http = http
+        self._semaphore = asyncio.Semaphore(LRCLIB_MAX_CONCURRENCY)
+
+    async def search(self, track: SpotifyTrack) -> httpx.Response:
+        async with self._semaphore:
+            return await upstream_request("lrclib", self.http.get(
+                LRCLIB_SEARCH_URL,
+                params={
+                    "track_name": track.name,
+                    "artist_name": track.artists[0].name,
+                    "album_name": track.album.name,
+                    "limit": 5,
+                },
+                timeout=LRCLIB_TIMEOUT,
+            ))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for every upstream call made by this worker
+    async with httpx.AsyncClient(limits=HTTP_LIMITS) as http:
+        app.state.http = http
+        app.state.spotify = None
+        app.state.lrclib = LRCLibClient(http)
+        app.state.lyrics_store = LyricsStore(LYRICS_DB_PATH)
+        app.state.annotator = LyricsAnnotator() if XueDuApp is not None else None
+        try:
+            yield
+        finally:
+            if app.state.annotator is not None:
+                app.state.annotator.close()
+            app.state.lyrics_store.close()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["GET", "POST"],
+    allow_headers=["*"],
+)
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    # Labelled by route template, so /track/{spotify_id} is one series; for
+    # streamed responses this is the time to the first byte
+    started = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        METRICS.observe("http_request_seconds", time.perf_counter() - started, method=request.method,
+                        route=getattr(request.scope.get("route"), "path", "unmatched"))
+
+track_cache = TTLCache("track", TRACK_CACHE_TTL_SECONDS, TRACK_CACHE_MAX_ENTRIES)
+study_cache = TTLCache("study", TRACK_CACHE_TTL_SECONDS, STUDY_CACHE_MAX_ENTRIES)
+
+# Lookups in progress, by Spotify id, so concurrent requests share one fetch
+_inflight: Dict[str, "asyncio.Task[Dict[str, TrackOutcome]]"] = {}
+
+def get_spotify() -> SpotifyClient:
+    if app.state.spotify is None:
+        client_id = os.getenv("SPOTIFY_CLIENT_ID")
+        client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
+        if not client_id or not client_secret:
+            raise HTTPException(status_code=500, detail="SPOTIPY_CLIENT_ID and SPOTIPY_CLIENT_SECRET must be set")
+        app.state.spotify = SpotifyClient(app.state.http, client_id, client_secret)
+    return app.state.spotify
+
+async def fetch_lyrics(spotify_id: str, track: SpotifyTrack) -> TrackOutcome:
+    # Store calls block on SQLite, so they run in a worker thread
+    store = app.state.lyrics_store
+    artist_name = track.artists[0].name
+    with METRICS.time("lyrics_store_seconds", op="get_by_track"):
+        stored = await asyncio.to_thread(store.get_by_track, spotify_id, track.name, artist_name, track.album.name)
+    METRICS.inc("cache_lookups_total", cache="lyrics_store", result="miss" if stored is None else "hit")
+    if stored is not None:
+        return [LRCLibResponse(**item) for item in stored]
+
     try:
-        track_data = sp.track(spotify_id)
-        track = SpotifyTrack(
-            name=track_data["name"],
-            artists=[SpotifyArtist(name=artist["name"]) for artist in track_data["artists"]],
-            album=SpotifyAlbum(name=track_data["album"]["name"])
-        )
+        lrclib_response = await app.state.lrclib.search(track)
+    except httpx.TimeoutException:
+        return HTTPException(status_code=504, detail="Timed out fetching from LRCLib")
+    except httpx.HTTPError as e:
+        return HTTPException(status_code=502, detail=f"Failed to fetch from LRCLib: {e}")
+    if not lrclib_response.is_success:
+        return HTTPException(status_code=lrclib_response.status_code, detail="Failed to fetch from LRCLib")
+    try:
+        lyrics = [LRCLibResponse(**item) for item in lrclib_response.json()]
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch or parse Spotify track: {e}")
+        return HTTPException(status_code=500, detail=f"Failed to parse LRCLib response: {e}")
+    with METRICS.time("lyrics_store_seconds", op="put"):
+        await asyncio.to_thread(store.put, spotify_id, track.name, artist_name, track.album.name,
+                                [item.model_dump() for item in lyrics])
+    return lyrics
 
-    # Get lyrics from LRCLib
-    lrclib_url = (
-        f"https://lrclib.net/api/search?track_name={track.name}&artist_name={track.artists[0].name}&album_name={track.album.name}&limit=5"
-    )
-    lrclib_response = requests.get(lrclib_url)
-    if not lrclib_response.ok:
-        raise HTTPException(status_code=lrclib_response.status_code, detail="Failed to fetch from LRCLib")
+async def fetch_spotify_chunk(sp: SpotifyClient, chunk: List[str]) -> List[Union[Optional[dict], BaseException]]:
+    # Track data, None or the error for each id of a chunk
     try:
-        results = [LRCLibResponse(**item) for item in lrclib_response.json()]
+        return await sp.tracks(chunk)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 400 or len(chunk) == 1:
+            return [e] * len(chunk)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to parse LRCLib response: {e}")
-    return results 
\ No newline at end of file
+        return [e] * len(chunk)
+    # One id Spotify rejects fails its whole chunk, so retry the ids one by one
+    singles = await asyncio.gather(*(fetch_spotify_chunk(sp, [spotify_id]) for spotify_id in chunk))
+    return [single[0] for single in singles]
+
+async def fetch_spotify_tracks(spotify_ids: List[str]) -> Dict[str, Union[SpotifyTrack, HTTPException]]:
+    sp = get_spotify()
+    chunks = [spotify_ids[i:i + SPOTIFY_TRACKS_PER_REQUEST]
+              for i in range(0, len(spotify_ids), SPOTIFY_TRACKS_PER_REQUEST)]
+    responses = await asyncio.gather(*(fetch_spotify_chunk(sp, chunk) for chunk in chunks))
+
+    tracks = {}
+    for chunk, response in zip(chunks, responses):
+        for spotify_id, track_data in zip(chunk, response):
+            if isinstance(track_data, httpx.TimeoutException):
+                tracks[spotify_id] = HTTPException(status_code=504, detail="Timed out fetching Spotify track")
+                continue
+            if isinstance(track_data, httpx.HTTPStatusError) and track_data.response.status_code == 400:
+                tracks[spotify_id] = HTTPException(status_code=400, detail="Invalid Spotify track id")
+                continue
+            try:
+                if isinstance(track_data, BaseException):
+                    raise track_data
+                if track_data is None:
+                    tracks[spotify_id] = HTTPException(status_code=404, detail="Spotify track not found")
+                    continue
+                tracks[spotify_id] = SpotifyTrack(
+                    name=track_data["name"],
+                    artists=[SpotifyArtist(name=artist["name"]) for artist in track_data["artists"]],
+                    album=SpotifyAlbum(name=track_data["album"]["name"])
+                )
+            except Exception as e:
+                tracks[spotify_id] = HTTPException(status_code=500, detail=f"Failed to fetch or parse Spotify track: {e}")
+    return tracks
+
+async def fetch_tracks(spotify_ids: List[str]) -> Dict[str, TrackOutcome]:
+    # Never raises: every id gets its lyrics or an error
+    def get_stored() -> List[Optional[List[Dict]]]:
+        # Runs in a worker thread, since store lookups block on SQLite
+        results = []
+        for spotify_id in spotify_ids:
+            with METRICS.time("lyrics_store_seconds", op="get_by_spotify_id"):
+                results.append(app.state.lyrics_store.get_by_spotify_id(spotify_id))
+        return results
+
+    outcomes = {}
+    unstored = []
+    for spotify_id, stored in zip(spotify_ids, await asyncio.to_thread(get_stored)):
+        METRICS.inc("cache_lookups_total", cache="lyrics_store", result="miss" if stored is None else "hit")
+        if stored is None:
+            unstored.append(spotify_id)
+        else:
+            outcomes[spotify_id] = [LRCLibResponse(**item) for item in stored]
+            track_cache.put(spotify_id, outcomes[spotify_id])
+    if not unstored:
+        return outcomes
+
+    try:
+        tracks = await fetch_spotify_tracks(unstored)
+    except HTTPException as e:
+        outcomes.update((spotify_id, e) for spotify_id in unstored)
+        return outcomes
+
+    found = [(spotify_id, track) for spotify_id, track in tracks.items() if isinstance(track, SpotifyTrack)]
+    lyrics = await asyncio.gather(*(fetch_lyrics(spotify_id, track) for spotify_id, track in found))
+
+    outcomes.update(tracks)
+    for (spotify_id, _), outcome in zip(found, lyrics):
+        outcomes[spotify_id] = outcome
+        if not isinstance(outcome, HTTPException):
+            track_cache.put(spotify_id, outcome)
+    return outcomes
+
+async def resolve_tracks(spotify_ids: List[str]) -> Dict[str, TrackOutcome]:
+    """Look up many tracks: cached ones directly, ids already being fetched by
+    another request by waiting for that fetch, and the rest in one batch.
+    Malformed ids fail with 400 on their own without reaching Spotify."""
+    outcomes = {}
+    pending = {}
+    missing = []
+    for spotify_id in dict.fromkeys(spotify_ids):
+        if not SPOTIFY_ID_PATTERN.fullmatch(spotify_id):
+            outcomes[spotify_id] = HTTPException(status_code=400, detail="Invalid Spotify track id")
+            continue
+        cached = track_cache.get(spotify_id)
+        if cached is not None:
+            outcomes[spotify_id] = cached
+        elif spotify_id in _inflight:
+            pending[spotify_id] = _inflight[spotify_id]
+        else:
+            missing.append(spotify_id)
+
+    if missing:
+        # A task, so a client disconnecting does not cancel work others wait on
+        task = asyncio.create_task(fetch_tracks(missing))
+        for spotify_id in missing:
+            _inflight[spotify_id] = pending[spotify_id] = task
+
+        def forget(done, spotify_ids=missing):
+            for spotify_id in spotify_ids:
+                if _inflight.get(spotify_id) is done:
+                    del _inflight[spotify_id]
+        task.add_done_callback(forget)
+
+    for spotify_id, task in pending.items():
+        outcomes[spotify_id] = (await asyncio.shield(task))[spotify_id]
+    return outcomes
+
+@app.get("/track/{spotify_id}", response_model=List[LRCLibResponse])
+async def get_track(spotify_id: str = Path(...)):
+    outcome = (await resolve_tracks([spotify_id]))[spotify_id]
+    if isinstance(outcome, HTTPException):
+        raise outcome
+    return outcome
+
+def pinyin_of(yu_kuai) -> Optional[str]:
+    # extra_metadata is whatever JSON was stored, so it may not be an object
+    metadata = yu_kuai.extra_metadata
+    pinyin = metadata.get("pinyin") if isinstance(metadata, dict) else None
+    return pinyin if isinstance(pinyin, str) else None
+
+def study_line(seq: int, text: str, yu_kuai_list: Optional[list]) -> StudyLine:
+    if yu_kuai_list is None:
+        return StudyLine(seq=seq, text=text, annotated=False)
+    return StudyLine(
+        seq=seq,
+        text=text,
+        yu_kuai=[StudyYuKuai(id=yu_kuai.id, type=yu_kuai.type, name=yu_kuai.canonical_name,
+                             description=yu_kuai.description, pinyin=pinyin_of(yu_kuai))
+                 for yu_kuai in yu_kuai_list],
+    )
+
+async def resolve_study_lyrics(spotify_id: str) -> LRCLibResponse:
+    # The best LRCLib match for a track, or the error for the request
+    if app.state.annotator is None:
+        raise HTTPException(status_code=503, detail="xuedu_poc is not available; set XUEDU_SRC")
+    outcome = (await resolve_tracks([spotify_id]))[spotify_id]
+    if isinstance(outcome, HTTPException):
+        raise outcome
+    if not outcome:
+        raise HTTPException(status_code=404, detail="No lyrics found")
+    return outcome[0]
+
+@app.get("/track/{spotify_id}/study", response_model=StudyLyrics)
+async def get_track_study(spotify_id: str = Path(...)):
+    # The best LRCLib match, split into lines annotated with YuKuai
+    lyrics = await resolve_study_lyrics(spotify_id)
+    lines = study_cache.get(lyrics.id)
+    if lines is None:
+        annotated = await app.state.annotator.annotate(lyrics.id, lyrics.plainLyrics)
+        lines = [study_line(seq, text, yu_kuai_list) for seq, (text, yu_kuai_list) in enumerate(annotated)]
+        if all(line.annotated for line in lines):
+            study_cache.put(lyrics.id, lines)
+    return StudyLyrics(spotify_id=spotify_id, lyrics=lyrics, lines=lines)
+
+def sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+@app.get("/track/{spotify_id}/study/events")
+async def stream_track_study(spotify_id: str = Path(...)):
+    """Server-sent events for /track/{spotify_id}/study, one per line as it is annotated
+
+    Events are "lyrics" (the LRCLib match and line count), then a "line"
+    per line, stored lines first and the rest as they are parsed, so lines
+    may arrive out of order. The stream ends with "completed", or "error".
+    """
+    lyrics = await resolve_study_lyrics(spotify_id)
+
+    async def stream():
+        try:
+            async for event in app.state.annotator.events(lyrics.id, lyrics.plainLyrics):
+                if event.kind == "started":
+                    yield sse("lyrics", json.dumps({"lyrics": lyrics.model_dump(),
+                                                    "line_count": event.stats["line_count"]}))
+                elif event.kind in ("sentence", "failed"):
+                    line = study_line(event.seq, event.text, event.yu_kuai if event.kind == "sentence" else None)
+                    yield sse("line", line.model_dump_json())
+                elif event.kind == "completed":
+                    yield sse("completed", json.dumps(event.stats))
+        except Exception as e:
+            yield sse("error", json.dumps({"detail": f"Failed to annotate lyrics: {e}"}))
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/lyrics/search", response_model=List[LRCLibResponse])
+async def search_lyrics(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS)):
+    # Only lyrics already fetched through /track or /tracks are searchable
+    found = await asyncio.to_thread(app.state.lyrics_store.search, q, limit)
+    return [LRCLibResponse(**item) for item in found]
+
+@app.get("/health")
+async def get_health():
+    # Lyrics lookups work without xuedu_poc; study reports whether annotation does
+    return {"status": "ok", "study": app.state.annotator is not None}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus text format: this server's metrics, then xuedu_poc's annotation pipeline
+    text = METRICS.render()
+    if XUEDU_METRICS is not None:
+        text += XUEDU_METRICS.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.post("/tracks", response_model=List[TrackLyrics])
+async def get_tracks(request: TracksRequest):
+    if len(request.ids) > MAX_BATCH_TRACKS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_TRACKS} ids per request")
+    outcomes = await resolve_tracks(request.ids)
+    return [
+        TrackLyrics(spotify_id=spotify_id, error=outcome.detail)
+        if isinstance(outcome, HTTPException)
+        else TrackLyrics(spotify_id=spotify_id, lyrics=outcome)
+        for spotify_id, outcome in ((spotify_id, outcomes[spotify_id]) for spotify_id in request.ids)
+    ]
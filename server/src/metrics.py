@@ -0,0 +1,72 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+# The registry class is xuedu_poc's, so both sides export metrics the same way;
+# importing study puts xuedu_poc's src directory on sys.path
+from . import study  # noqa: F401
+
+try:
+    from metrics import Metrics
+except ImportError:
+    # Deployed without xuedu_poc: a minimal registry with the same interface,
+    # so the server still starts and /metrics still works
+    class Metrics:
+        """Thread-safe counters and timers (count and sum only) in the Prometheus text format"""
+
+        def __init__(self, namespace: str):
+            self.namespace = namespace
+            self._counters: Dict[Tuple, float] = {}
+            self._timers: Dict[Tuple, Tuple[int, float]] = {}
+            self._lock = threading.Lock()
+
+        @staticmethod
+        def _key(name: str, labels: Dict[str, object]) -> Tuple:
+            return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+        def inc(self, name: str, value: float = 1, **labels):
+            key = self._key(name, labels)
+            with self._lock:
+                self._counters[key] = self._counters.get(key, 0) + value
+
+        def observe(self, name: str, seconds: float, **labels):
+            key = self._key(name, labels)
+            with self._lock:
+                count, total = self._timers.get(key, (0, 0.0))
+                self._timers[key] = (count + 1, total + seconds)
+
+        @contextmanager
+        def time(self, name: str, **labels):
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(name, time.perf_counter() - started, **labels)
+
+        def render(self) -> str:
+            def label_text(labels):
+                escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+                return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}" if labels else ""
+
+            with self._lock:
+                counters = sorted(self._counters.items())
+                timers = sorted(self._timers.items())
+            lines = []
+            typed = set()
+            for (name, labels), value in counters:
+                full_name = f"{self.namespace}_{name}"
+                if full_name not in typed:
+                    typed.add(full_name)
+                    lines.append(f"# TYPE {full_name} counter")
+                lines.append(f"{full_name}{label_text(labels)} {value:g}")
+            for (name, labels), (count, total) in timers:
+                full_name = f"{self.namespace}_{name}"
+                if full_name not in typed:
+                    typed.add(full_name)
+                    lines.append(f"# TYPE {full_name} summary")
+                lines.append(f"{full_name}_sum{label_text(labels)} {total:.6f}")
+                lines.append(f"{full_name}_count{label_text(labels)} {count}")
+            return "\n".join(lines) + "\n" if lines else ""
+
+METRICS = Metrics("xueba")
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+# The xuedu_poc parsing and storage code, which is not a package on PyPI
+XUEDU_SRC = os.getenv(
+    "XUEDU_SRC", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "xuedu_poc", "src")
+)
+XUEDU_DB_PATH = os.getenv("XUEDU_DB_PATH", "xuedu.db")
+XUEDU_LLM_CACHE_PATH = os.getenv("XUEDU_LLM_CACHE_PATH", "llm_cache.db")
+XUEDU_CEDICT_PATH = os.getenv("XUEDU_CEDICT_PATH")
+
+# LLM batches parsed at once while annotating one song
+ANNOTATION_CONCURRENCY = 4
+
+if XUEDU_SRC not in sys.path:
+    sys.path.append(XUEDU_SRC)
+try:
+    from app import XueDuApp
+    from metrics import METRICS as XUEDU_METRICS
+    from models import IngestEvent
+except ImportError:
+    XueDuApp = XUEDU_METRICS = IngestEvent = None
+
+# A line of lyrics with its YuKuai, or None if the line failed to parse
+AnnotatedLine = Tuple[str, Optional[list]]
+
+class LyricsAnnotator:
+    """Splits lyrics into lines annotated with YuKuai by the xuedu_poc pipeline.
+
+    Annotations are stored in the xuedu database as an ingest job per LRCLib
+    record, so each song is parsed once and later requests only read it back.
+    All work runs on one thread, which owns the XueDuApp and its connections;
+    concurrent requests for the same lyrics share one call.
+    """
+
+    def __init__(self):
+        self._app = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lyrics-annotator")
+        self._inflight: Dict[int, "asyncio.Future[List[AnnotatedLine]]"] = {}
+
+    def _get_app(self) -> "XueDuApp":
+        if self._app is None:
+            self._app = XueDuApp(cedict_path=XUEDU_CEDICT_PATH, retain_sentences=False,
+                                 db_path=XUEDU_DB_PATH, llm_cache_path=XUEDU_LLM_CACHE_PATH)
+        return self._app
+
+    def _annotate(self, lyrics_id: int, plain_lyrics: str) -> List[AnnotatedLine]:
+        return self._get_app().annotate_lines(f"lrclib:{lyrics_id}", plain_lyrics.splitlines(),
+                                              concurrency=ANNOTATION_CONCURRENCY)
+
+    async def annotate(self, lyrics_id: int, plain_lyrics: str) -> List[AnnotatedLine]:
+        future = self._inflight.get(lyrics_id)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, self._annotate, lyrics_id, plain_lyrics
+            )
+            self._inflight[lyrics_id] = future
+            future.add_done_callback(lambda done: self._inflight.pop(lyrics_id, None))
+        return await asyncio.shield(future)
+
+    async def events(self, lyrics_id: int, plain_lyrics: str) -> AsyncIterator["IngestEvent"]:
+        """Yield XueDuApp.annotate_events() for the lyrics as the worker thread produces them
+
+        Stored lines come out at once and the rest as each is parsed. The
+        work continues to the end if the consumer stops early, so nothing
+        parsed is lost.
+        """
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue[Optional[IngestEvent]]" = asyncio.Queue()
+
+        def produce():
+            try:
+                for event in self._get_app().annotate_events(f"lrclib:{lyrics_id}", plain_lyrics.splitlines(),
+                                                             concurrency=ANNOTATION_CONCURRENCY):
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, None)
+
+        work = loop.run_in_executor(self._executor, produce)
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+        # Surface any error from the worker thread
+        await work
+
+    def close(self):
+        if self._app is not None:
+            self._executor.submit(self._app.close)
+        self._executor.shutdown(wait=True)
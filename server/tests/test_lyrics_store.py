@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite store of LRCLib results
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.lyrics_store import EMPTY_RESULT_TTL_SECONDS, LyricsStore
+
+def lyric(lyrics_id: int, text: str = "我爱你") -> dict:
+    return {"id": lyrics_id, "trackName": "月亮代表我的心", "artistName": "邓丽君",
+            "albumName": "岛国之情歌", "duration": 200.0, "plainLyrics": text}
+
+def with_store(test):
+    def run():
+        with tempfile.TemporaryDirectory() as work_dir:
+            store = LyricsStore(os.path.join(work_dir, "lyrics.db"))
+            try:
+                test(store)
+            finally:
+                store.close()
+    run.__name__ = test.__name__
+    run.__doc__ = test.__doc__
+    return run
+
+@with_store
+def test_hits_and_misses(store):
+    """Test lookups by Spotify id and by track before and after a search is stored"""
+    assert store.get_by_spotify_id("a") is None
+    assert store.get_by_track("a", "月亮代表我的心", "邓丽君", "岛国之情歌") is None
+
+    store.put("a", "月亮代表我的心", "邓丽君", "岛国之情歌", [lyric(1), lyric(2, "你问我爱你有多深")])
+    assert [item["id"] for item in store.get_by_spotify_id("a")] == [1, 2]
+    assert store.get_by_spotify_id("b") is None
+
+    # Another Spotify id for the same track, spelled slightly differently, shares the results
+    assert [item["id"] for item in store.get_by_track("b", "月亮代表我的心 ", "邓丽君", "岛国之情歌")] == [1, 2]
+    assert store.get_by_spotify_id("b") == store.get_by_spotify_id("a")
+
+    assert [item["id"] for item in store.search("有多深")] == [2]
+    assert [item["id"] for item in store.search("爱你")] == [1, 2]
+
+@with_store
+def test_empty_result_expires(store):
+    """Test that a search with no results is served until its TTL, then counts as a miss"""
+    store.put("a", "Unknown", "Nobody", "Nothing", [])
+    assert store.get_by_spotify_id("a") == []
+    assert store.get_by_track("b", "Unknown", "Nobody", "Nothing") == []
+
+    # Age the search past the TTL
+    store._conn.execute("UPDATE searches SET fetched_at = ?", (time.time() - EMPTY_RESULT_TTL_SECONDS - 1,))
+    assert store.get_by_spotify_id("a") is None
+    assert store.get_by_track("b", "Unknown", "Nobody", "Nothing") is None
+
+    # A fresh search resets the clock, and results found later never expire
+    store.put("a", "Unknown", "Nobody", "Nothing", [lyric(3)])
+    store._conn.execute("UPDATE searches SET fetched_at = 0")
+    assert [item["id"] for item in store.get_by_spotify_id("a")] == [3]
+
+def main():
+    test_hits_and_misses()
+    test_empty_result_expires()
+    print("All lyrics store tests passed!")
+
+if __name__ == "__main__":
+    main()
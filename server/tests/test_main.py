@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Tests for the lyrics server's track lookups, run against mocked Spotify and LRCLib APIs
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+import httpx
+
+# Import the server as the src package, as uvicorn does
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src import main as server
+from src.lyrics_store import LyricsStore
+
+def spotify_id(n: int) -> str:
+    return f"track{n:017d}"
+
+class FakeUpstreams:
+    """Mock Spotify and LRCLib APIs that record every request"""
+
+    def __init__(self, rejected=(), latency: float = 0.0):
+        self.rejected = set(rejected)
+        self.latency = latency
+        self.track_requests = []
+        self.lrclib_requests = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host == "accounts.spotify.com":
+            return httpx.Response(200, json={"access_token": "token", "expires_in": 3600})
+        await asyncio.sleep(self.latency)
+        if request.url.host == "api.spotify.com":
+            ids = request.url.params["ids"].split(",")
+            self.track_requests.append(ids)
+            if self.rejected.intersection(ids):
+                return httpx.Response(400, json={"error": {"status": 400, "message": "invalid id"}})
+            return httpx.Response(200, json={"tracks": [
+                {"name": f"Song {i}", "artists": [{"name": "Singer"}], "album": {"name": "Album"}}
+                for i in ids
+            ]})
+        self.lrclib_requests.append(request.url.params["track_name"])
+        return httpx.Response(200, json=[{
+            "id": len(self.lrclib_requests), "trackName": request.url.params["track_name"],
+            "artistName": "Singer", "albumName": "Album", "duration": 200.0, "plainLyrics": "我爱你",
+        }])
+
+def run_with_upstreams(upstreams: FakeUpstreams, coro_factory):
+    """Run coro_factory() with the app wired to upstreams and a fresh store and caches"""
+    async def run():
+        with tempfile.TemporaryDirectory() as work_dir:
+            async with httpx.AsyncClient(transport=httpx.MockTransport(upstreams.handle)) as http:
+                server.app.state.http = http
+                server.app.state.spotify = server.SpotifyClient(http, "client", "secret")
+                server.app.state.lrclib = server.LRCLibClient(http)
+                server.app.state.lyrics_store = LyricsStore(os.path.join(work_dir, "lyrics.db"))
+                server.track_cache = server.TTLCache("track", server.TRACK_CACHE_TTL_SECONDS, server.TRACK_CACHE_MAX_ENTRIES)
+                server._inflight.clear()
+                try:
+                    return await coro_factory()
+                finally:
+                    server.app.state.lyrics_store.close()
+    return asyncio.run(run())
+
+def test_chunked_track_lookup():
+    """Test that ids are looked up 50 at a time and malformed ones never reach Spotify"""
+    upstreams = FakeUpstreams()
+    ids = [spotify_id(n) for n in range(120)]
+    outcomes = run_with_upstreams(upstreams, lambda: server.resolve_tracks(ids + ["not-an-id", ids[0]]))
+
+    assert [len(chunk) for chunk in upstreams.track_requests] == [50, 50, 20]
+    assert [i for chunk in upstreams.track_requests for i in chunk] == ids
+    assert all(outcomes[i][0].trackName == f"Song {i}" for i in ids)
+    assert outcomes["not-an-id"].status_code == 400
+
+def test_rejected_id_fails_alone():
+    """Test that a chunk Spotify rejects is retried id by id"""
+    ids = [spotify_id(n) for n in range(5)]
+    upstreams = FakeUpstreams(rejected=[ids[2]])
+    outcomes = run_with_upstreams(upstreams, lambda: server.resolve_tracks(ids))
+
+    assert upstreams.track_requests[0] == ids
+    assert sorted(upstreams.track_requests[1:]) == [[i] for i in ids]
+    assert outcomes[ids[2]].status_code == 400
+    assert all(isinstance(outcomes[i], list) for i in ids if i != ids[2])
+
+def test_single_flight():
+    """Test that concurrent requests for overlapping ids share one upstream lookup each"""
+    upstreams = FakeUpstreams(latency=0.05)
+    first = [spotify_id(n) for n in range(3)]
+    second = [spotify_id(n) for n in range(1, 5)]
+
+    async def overlapping():
+        results = await asyncio.gather(server.resolve_tracks(first), server.resolve_tracks(second))
+        # Finished lookups are served from the cache
+        again = await server.resolve_tracks(second)
+        return results, again
+
+    (a, b), again = run_with_upstreams(upstreams, overlapping)
+    requested = [i for chunk in upstreams.track_requests for i in chunk]
+    assert sorted(requested) == [spotify_id(n) for n in range(5)]
+    assert sorted(upstreams.lrclib_requests) == [f"Song {spotify_id(n)}" for n in range(5)]
+    for shared_id in second[:2]:
+        assert a[shared_id] is b[shared_id]
+    assert again == b
+    assert not server._inflight
+
+def test_empty_lyrics_are_searched_again():
+    """Test that a track LRCLib had no lyrics for is searched again once the empty result expires"""
+    ids = [spotify_id(0)]
+
+    class NoLyricsYet(FakeUpstreams):
+        async def handle(self, request):
+            if request.url.host == "lrclib.net" and not self.lrclib_requests:
+                self.lrclib_requests.append(request.url.params["track_name"])
+                return httpx.Response(200, json=[])
+            return await super().handle(request)
+
+    upstreams = NoLyricsYet()
+
+    async def lookups():
+        first = await server.resolve_tracks(ids)
+        server.track_cache = server.TTLCache("track", server.TRACK_CACHE_TTL_SECONDS, server.TRACK_CACHE_MAX_ENTRIES)
+        stored = await server.resolve_tracks(ids)
+        server.app.state.lyrics_store.empty_result_ttl_seconds = 0
+        server.track_cache = server.TTLCache("track", server.TRACK_CACHE_TTL_SECONDS, server.TRACK_CACHE_MAX_ENTRIES)
+        return first, stored, await server.resolve_tracks(ids)
+
+    first, stored, expired = run_with_upstreams(upstreams, lookups)
+    assert first[ids[0]] == [] and stored[ids[0]] == []
+    assert len(upstreams.lrclib_requests) == 2
+    assert [item.id for item in expired[ids[0]]] == [2]
+
+def test_metrics_share_one_registry_class():
+    """Test that /metrics exports the server's and xuedu_poc's metrics with one implementation"""
+    import metrics as xuedu_metrics
+
+    assert type(server.METRICS) is xuedu_metrics.Metrics
+    server.METRICS.inc("test_requests_total", route="/metrics")
+    xuedu_metrics.METRICS.inc("test_lines_total")
+    text = asyncio.run(server.get_metrics()).body.decode()
+    assert 'xueba_test_requests_total{route="/metrics"} 1' in text
+    assert 'xuedu_test_lines_total 1' in text
+
+def study_annotator(work_dir: str) -> "server.LyricsAnnotator":
+    """A LyricsAnnotator whose XueDuApp uses the fake LLM backend and databases in work_dir"""
+    from llm_backend import FakeBackend
+
+    annotator = server.LyricsAnnotator()
+
+    def get_app():
+        # Created on the annotator's thread, which owns its connections
+        if annotator._app is None:
+            annotator._app = server.XueDuApp(db_path=os.path.join(work_dir, "xuedu.db"),
+                                             llm_cache_path=os.path.join(work_dir, "llm_cache.db"),
+                                             retain_sentences=False, llm_backend=FakeBackend())
+        return annotator._app
+
+    annotator._get_app = get_app
+    return annotator
+
+def test_study_routes():
+    """Test /track/{id}/study and its event stream against the fake LLM backend"""
+    upstreams = FakeUpstreams()
+    track_id = spotify_id(0)
+
+    async def requests():
+        with tempfile.TemporaryDirectory() as work_dir:
+            server.app.state.annotator = study_annotator(work_dir)
+            server.study_cache = server.TTLCache("study", server.TRACK_CACHE_TTL_SECONDS, server.STUDY_CACHE_MAX_ENTRIES)
+            try:
+                transport = httpx.ASGITransport(app=server.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    study = await client.get(f"/track/{track_id}/study")
+                    events = await client.get(f"/track/{track_id}/study/events")
+                    server.app.state.annotator.close()
+                    server.app.state.annotator = None
+                    unavailable = await client.get(f"/track/{track_id}/study")
+                return study, events, unavailable
+            finally:
+                if server.app.state.annotator is not None:
+                    server.app.state.annotator.close()
+
+    study, events, unavailable = run_with_upstreams(upstreams, requests)
+
+    assert study.status_code == 200
+    body = study.json()
+    assert body["spotify_id"] == track_id and body["lyrics"]["plainLyrics"] == "我爱你"
+    assert body["lines"] == [{"seq": 0, "text": "我爱你", "annotated": True, "yu_kuai": [
+        {"id": yu_kuai["id"], "type": "vocab", "name": name, "description": f"fake definition of {name}", "pinyin": None}
+        for yu_kuai, name in zip(body["lines"][0]["yu_kuai"], ["我爱", "爱你"])
+    ]}]
+
+    assert events.status_code == 200 and events.headers["content-type"].startswith("text/event-stream")
+    messages = [block.split("\n") for block in events.text.strip().split("\n\n")]
+    assert [lines[0] for lines in messages] == ["event: lyrics", "event: line", "event: completed"]
+    payloads = [json.loads(lines[1][len("data: "):]) for lines in messages]
+    assert payloads[0]["line_count"] == 1
+    assert payloads[1] == body["lines"][0]  # The stored line, read back without the LLM
+    assert payloads[2]["skipped_count"] == 1
+
+    assert unavailable.status_code == 503
+
+def test_study_line_metadata():
+    """Test that pinyin is only read from object metadata holding a string"""
+    from models import YuKuaiRecord
+
+    def pinyin(extra_metadata_json: str):
+        record = YuKuaiRecord(1, "vocab", "你好", "nihao", "hello", extra_metadata_json)
+        return server.study_line(0, "你好", [record]).yu_kuai[0].pinyin
+
+    assert pinyin('{"pinyin": "nǐ hǎo"}') == "nǐ hǎo"
+    assert pinyin('["nǐ hǎo"]') is None
+    assert pinyin('null') is None
+    assert pinyin('{"pinyin": 3}') is None
+
+def test_runs_without_xuedu_poc():
+    """Test that the server starts, and /health and /metrics work, when xuedu_poc cannot be imported"""
+    import subprocess
+
+    script = """
+import sys
+from fastapi.testclient import TestClient
+from src import main as server
+assert server.XueDuApp is None and server.XUEDU_METRICS is None
+with TestClient(server.app) as client:
+    assert client.get("/health").json() == {"status": "ok", "study": False}
+    assert client.get("/track/%s/study" % ("0" * 22)).status_code == 503
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert 'xueba_http_request_seconds_count{method="GET",route="/health"} 1' in metrics.text
+"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = dict(os.environ, XUEDU_SRC=os.path.join(work_dir, "missing"),
+                   LYRICS_DB_PATH=os.path.join(work_dir, "lyrics.db"))
+        result = subprocess.run([sys.executable, "-c", script], cwd=os.path.join(os.path.dirname(__file__), '..'),
+                                env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def main():
+    test_chunked_track_lookup()
+    test_rejected_id_fails_alone()
+    test_single_flight()
+    test_empty_lyrics_are_searched_again()
+    test_metrics_share_one_registry_class()
+    test_study_routes()
+    test_study_line_metadata()
+    test_runs_without_xuedu_poc()
+    print("All server tests passed!")
+
+if __name__ == "__main__":
+    main()
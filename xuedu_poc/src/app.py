@@ -2,102 +2,414 @@
 Main application logic for the XueDu Chinese Learning App
 """
 
-import re
-from typing import List
-from models import YuKuai, Sentence
-from database import XueDuDB
-from llm_parser import LLMParser
+import asyncio
+import hashlib
+import json
+import os
+from typing import Iterator, List, Optional, Tuple
+from models import IngestEvent, YuKuaiRecord, SentenceRecord
+from database import XueDuDB, DEFAULT_USER_ID
+from llm_backend import LLMBackend
+from llm_parser import LLMParser, ParseOutcome
+from llm_cache import LLMCache
+from metrics import METRICS
+from rate_limiter import LimitedRunner, RateLimiter
+import srs
+from question_pool import QuestionPool
+from segmenter import CJK_CHAR, Segmenter
+from text_stream import SentenceSpan, growing_batches, iter_sentences
 
 # Configuration
 DATABASE_PATH = "xuedu.db"
+LLM_CACHE_PATH = "llm_cache.db"
+LLM_TOKENS_PER_MINUTE = 200_000
+INGEST_WINDOW_SIZE = 500
+FIRST_INGEST_WINDOW_SIZE = 1  # Windows double from here up to INGEST_WINDOW_SIZE
+QUIZ_PREFILL_COUNT = 20  # Upcoming quiz items given questions after ingestion
 
 class XueDuApp:
     """Main application class"""
     
-    def __init__(self):
-        self.db = XueDuDB(DATABASE_PATH)
-        self.llm_parser = LLMParser()
-        self.sentences: List[Sentence] = []
-        self.sentence_counter = 0
+    def __init__(self, cedict_path: Optional[str] = None, retain_sentences: bool = True,
+                 db_path: Optional[str] = None, llm_cache_path: Optional[str] = None,
+                 user_id: int = DEFAULT_USER_ID, user_db_dir: Optional[str] = None,
+                 llm_backend: Optional[LLMBackend] = None):
+        self.db = XueDuDB(db_path or DATABASE_PATH, user_db_dir=user_db_dir)
+        self.user_id = user_id
+        self.llm_parser = LLMParser(cache=LLMCache(llm_cache_path or LLM_CACHE_PATH), backend=llm_backend)
+        self.tokens_per_minute = LLM_TOKENS_PER_MINUTE
+        self.segmenter = Segmenter(self.db, cedict_path=cedict_path)
+        self.question_pool = QuestionPool(self.db, self.llm_parser)
+        # Keep processed sentences for the dashboard; batch runs can turn
+        # this off so memory does not grow with the size of the input
+        self.retain_sentences = retain_sentences
+        self.sentences: List[SentenceRecord] = []
         self.results = []
+        self._runner: Optional[LimitedRunner] = None
     
-    def process_file(self, file_path: str):
-        """Process a Chinese text file and extract YuKuai"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-        except Exception as e:
-            print(f"❌ Error reading file: {e}")
-            return
+    def close(self):
+        """Stop question generation and close the database and LLM cache connections"""
+        self._close_runner()
+        self.question_pool.close()
+        self.db.close()
+        if self.llm_parser.cache:
+            self.llm_parser.cache.close()
+    
+    def process_file(self, file_path: str, concurrency: int = 1):
+        """Process a Chinese text file and extract YuKuai, printing progress
+        
+        See ingest_events() for how the file is read, parsed and stored.
+        """
+        file_results = None
+        resume_seq = None
+        for event in self.ingest_events(file_path, concurrency):
+            if event.kind == 'started':
+                resume_seq = event.stats['resume_seq']
+                if resume_seq:
+                    print(f"↩️  Resuming {file_path} after sentence {resume_seq}")
+                print(f"📖 Reading {file_path} ({event.stats['size']:,} bytes)")
+            elif event.kind == 'progress':
+                print(f"  Processed {event.stats['sentence_count']} sentences ({event.stats['percent']}%)...", end='\r')
+            elif event.kind == 'error':
+                if resume_seq is not None:
+                    print()  # Clear the progress line
+                print(f"❌ Error reading file: {event.error}")
+                return
+            elif event.kind == 'completed':
+                file_results = event.stats
+        print()  # Clear the progress line
         
-        if not text.strip():
-            print("❌ File is empty or contains no text.")
+        processed = file_results['sentence_count'] + file_results['failed_count']
+        if not processed and not file_results['skipped_count']:
+            if resume_seq:
+                print(f"✅ {file_path} was already fully processed")
+            else:
+                print("❌ File is empty or contains no text.")
             return
         
-        # Split into sentences
-        sentences = re.split(r'[。！？!?]', text)
-        sentences = [s.strip() for s in sentences if s.strip()]
+        self.results.append(file_results)
+        print(f"✅ Completed processing {file_path}")
+        print(f"   📊 Sentences: {file_results['sentence_count']}")
+        print(f"   🧩 YuKuai: {file_results['yu_kuai_count']}")
+        print(f"   ⚡ Resolved offline: {file_results['offline_count']} sentences")
+        if file_results['skipped_count']:
+            print(f"   ⏭️  Skipped (already done): {file_results['skipped_count']} sentences")
+        if file_results['failed_count']:
+            print(f"   ❌ Failed: {file_results['failed_count']} sentences (rerun to retry)")
+        
+        self.prefill_quiz_questions()
+    
+    def ingest_events(self, file_path: str, concurrency: int = 1) -> Iterator[IngestEvent]:
+        """Process a Chinese text file, yielding an IngestEvent as work completes
+        
+        The file is streamed in windows of sentences, so memory stays bounded
+        regardless of file size. Windows start at FIRST_INGEST_WINDOW_SIZE
+        sentences and double up to INGEST_WINDOW_SIZE, so the first results
+        arrive after the first sentence rather than the first full window.
+        Sequentially each LLM batch of a window is committed before the next
+        is parsed; with concurrency > 1 the whole window is parsed
+        concurrently through the async LLM client, then written in file
+        order. No transaction is open during an LLM call.
         
-        print(f"📖 Found {len(sentences)} sentences in {file_path}")
+        Yields "started", then a "sentence" or "failed" event per sentence
+        once it has been committed and a "progress" event per window, then
+        "completed" with the totals, or "error" if the file cannot be read.
         
+        Progress is checkpointed with every commit: rerunning on an unchanged file
+        resumes after the last fully processed sentence, skips sentences that
+        were already parsed and retries only the failed ones. Stopping the
+        generator early loses nothing that has been yielded.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            yield IngestEvent('error', file_path, error=str(e))
+            return
+        
+        job = self.db.get_or_create_ingest_job(os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
         file_results = {
             'file': file_path,
-            'sentences': [],
-            'yu_kuai_count': 0
+            'sentence_count': 0,
+            'failed_count': 0,
+            'skipped_count': 0,
+            'yu_kuai_count': 0,
+            'offline_count': 0
         }
+        yield IngestEvent('started', file_path, stats={'size': stat.st_size, 'resume_seq': job.resume_seq})
         
-        # Parse each sentence
-        for i, sentence_text in enumerate(sentences, 1):
-            print(f"  Processing sentence {i}/{len(sentences)}...", end='\r')
-            
-            try:
-                yu_kuai_list = self.llm_parser.parse_sentence(sentence_text)
+        try:
+            spans = METRICS.time_iter(iter_sentences(file_path, start_offset=job.resume_offset, start_seq=job.resume_seq),
+                                      'sentence_split_seconds')
+            for window in growing_batches(spans, FIRST_INGEST_WINDOW_SIZE, INGEST_WINDOW_SIZE):
+                done = self.db.get_done_sentence_seqs(job.id, window[0].seq, window[-1].seq)
+                pending = [span for span in window if span.seq not in done]
+                file_results['skipped_count'] += len(window) - len(pending)
+                if pending:
+                    yield from self._ingest_window(job.id, file_path, pending, concurrency, file_results)
+                
+                percent = window[-1].end_offset * 100 // max(stat.st_size, 1)
+                yield IngestEvent('progress', file_path, seq=window[-1].seq, stats=dict(file_results, percent=percent))
+        except (OSError, UnicodeDecodeError) as e:
+            yield IngestEvent('error', file_path, error=str(e))
+            return
+        finally:
+            self._close_runner()
+        
+        self.db.complete_ingest_job(job.id)
+        yield IngestEvent('completed', file_path, stats=dict(file_results))
+    
+    def annotate_lines(self, source: str, lines: List[str],
+                       concurrency: int = 1) -> List[Tuple[str, Optional[List[YuKuaiRecord]]]]:
+        """Parse lines of text as one stored job and return each line with its YuKuai
+        
+        Like process_file, but for text that is not in a file, such as song
+        lyrics. Lines that failed to parse come back with None. See
+        annotate_events() for how the lines are parsed and stored.
+        """
+        annotated = {}
+        for event in self.annotate_events(source, lines, concurrency):
+            if event.kind == 'sentence':
+                annotated[event.seq] = (event.text, event.yu_kuai)
+            elif event.kind == 'failed':
+                annotated[event.seq] = (event.text, None)
+        return [annotated[seq] for seq in sorted(annotated)]
+    
+    def annotate_events(self, source: str, lines: List[str], concurrency: int = 1) -> Iterator[IngestEvent]:
+        """Parse lines of text as one stored job, yielding an IngestEvent per line
+        
+        The job is identified by source and a hash of the lines, so the same
+        text is parsed once and edited text starts a fresh job: lines stored by an earlier call are yielded
+        first, straight from the database, and only lines not yet parsed or
+        that failed are sent on. Lines with no Chinese characters are stored
+        without YuKuai instead of going to the LLM. Blank lines are dropped,
+        and seq counts the remaining lines.
+        
+        Yields "started" with the line count, a "sentence" or "failed"
+        event per line, then "completed" with the totals.
+        """
+        lines = [line.strip() for line in lines if line.strip()]
+        spans = []
+        offset = 0
+        digest = hashlib.sha256()
+        for seq, line in enumerate(lines):
+            encoded = line.encode('utf-8') + b'\n'
+            digest.update(encoded)
+            offset += len(encoded)
+            spans.append(SentenceSpan(seq=seq, text=line, end_offset=offset))
+        
+        # Text has no mtime, so the content hash names this version of it
+        job = self.db.get_or_create_ingest_job(f"{source}#sha256={digest.hexdigest()}", offset, 0)
+        file_results = {'sentence_count': 0, 'failed_count': 0, 'skipped_count': 0,
+                        'yu_kuai_count': 0, 'offline_count': 0}
+        yield IngestEvent('started', source, stats={'line_count': len(spans)})
+        
+        stored = [(seq, text, yu_kuai_ids) for seq, text, yu_kuai_ids in self.db.get_job_sentences(job.id)
+                  if yu_kuai_ids is not None]
+        records = self.db.get_yu_kuai_with_scores_by_ids(
+            (yu_kuai_id for _, _, yu_kuai_ids in stored for yu_kuai_id in yu_kuai_ids),
+            user_id=self.user_id
+        )
+        for seq, text, yu_kuai_ids in stored:
+            yield IngestEvent('sentence', source, seq=seq, text=text,
+                              yu_kuai=[records[yu_kuai_id][0] for yu_kuai_id in yu_kuai_ids])
+        file_results['skipped_count'] = len(stored)
+        
+        done = {seq for seq, _, _ in stored}
+        pending = [span for span in spans if span.seq not in done]
+        try:
+            for window in growing_batches(pending, FIRST_INGEST_WINDOW_SIZE, INGEST_WINDOW_SIZE):
+                for group in self._commit_groups(window, concurrency):
+                    outcomes = self._annotate_window(group, concurrency, file_results)
+                    yield from self.store_window(job.id, source, group, outcomes, file_results)
+        finally:
+            self._close_runner()
+        self.db.complete_ingest_job(job.id)
+        yield IngestEvent('completed', source, stats=dict(file_results))
+    
+    def _annotate_window(self, spans: List[SentenceSpan], concurrency: int,
+                         file_results: dict) -> List[ParseOutcome]:
+        """Parse the lines of a window that contain Chinese; the rest have no YuKuai"""
+        chinese = [span.text for span in spans if CJK_CHAR.search(span.text)]
+        parsed = iter(self.parse_window(chinese, concurrency, file_results) if chinese else [])
+        return [next(parsed) if CJK_CHAR.search(span.text) else [] for span in spans]
+    
+    def prefill_quiz_questions(self):
+        """Start generating questions for the next YuKuai the quiz will ask about"""
+        scored = (self.db.get_due_yu_kuai(limit=QUIZ_PREFILL_COUNT, user_id=self.user_id) +
+                  self.db.get_least_learned_yu_kuai(limit=QUIZ_PREFILL_COUNT, user_id=self.user_id))
+        self.question_pool.prefill([yu_kuai for yu_kuai, _ in scored])
+    
+    def _ingest_window(self, job_id: int, source: str, spans: List[SentenceSpan], concurrency: int,
+                       file_results: dict) -> Iterator[IngestEvent]:
+        """Parse a window of sentences and store the results and checkpoint, yielding their events"""
+        for group in self._commit_groups(spans, concurrency):
+            outcomes = self.parse_window([span.text for span in group], concurrency, file_results)
+            yield from self.store_window(job_id, source, group, outcomes, file_results)
+    
+    def _commit_groups(self, spans: List[SentenceSpan], concurrency: int) -> List[List[SentenceSpan]]:
+        """Split a window into groups that are each parsed, then committed
+        
+        Parsing always finishes before the group's transaction opens, so the
+        write lock is never held during an LLM call. Sequentially each LLM
+        batch is its own group, so vocab committed from one batch already
+        counts as known when the next is resolved offline; concurrent
+        parsing takes the whole window as one group.
+        """
+        if concurrency > 1:
+            return [spans]
+        return [[spans[i] for i in batch] for batch in self.llm_parser.plan_batches([span.text for span in spans])]
+    
+    def parse_window(self, sentences: List[str], concurrency: int, file_results: dict) -> List[ParseOutcome]:
+        """Parse sentences, resolving known vocab offline, returning an outcome per sentence
+        
+        Sentences with unresolved spans are parsed whole by the LLM. Those
+        whose vocab is all known only have the LLM detect their grammar
+        patterns, a much shorter reply; if that fails the sentence fails.
+        Nothing is written, so a process that only reads can parse windows
+        for another to store with store_window(); the count of sentences
+        resolved offline is added to file_results['offline_count'].
+        """
+        outcomes, pending = self._resolve_offline(sentences)
+        known = [i for i, outcome in enumerate(outcomes) if outcome is not None]
+        file_results['offline_count'] += len(known)
+        pending_texts = [sentences[i] for i in pending]
+        known_texts = [sentences[i] for i in known]
+        if concurrency > 1:
+            runner = self._get_runner(concurrency)
+            parsed, grammar = runner.run(self._parse_sentences_async(pending_texts, known_texts, runner.limiter))
+        else:
+            parsed = self.llm_parser.parse_sentences(pending_texts) if pending else []
+            grammar = self.llm_parser.detect_grammar(known_texts) if known else []
+        
+        for i, outcome in zip(pending, parsed):
+            outcomes[i] = outcome
+        for i, found in zip(known, grammar):
+            outcomes[i] = found if isinstance(found, RuntimeError) else outcomes[i] + found
+        return outcomes
+    
+    def store_window(self, job_id: int, source: str, spans: List[SentenceSpan],
+                     outcomes: List[ParseOutcome], file_results: dict) -> List[IngestEvent]:
+        """Write a window's outcomes and advance the job checkpoint in one transaction
+        
+        outcomes must already be parsed, since the write lock is held while
+        they are stored. Returns a "sentence" or "failed" event per span, to
+        be yielded once the transaction has committed.
+        """
+        events = []
+        with self.db.transaction():
+            for span, yu_kuai_list in zip(spans, outcomes):
+                if isinstance(yu_kuai_list, RuntimeError):
+                    print(f"  ❌ Failed to parse sentence: {yu_kuai_list}")
+                    self.db.record_sentence(job_id, span.seq, span.text, span.end_offset, error=str(yu_kuai_list))
+                    file_results['failed_count'] += 1
+                    events.append(IngestEvent('failed', source, seq=span.seq, text=span.text,
+                                              error=str(yu_kuai_list)))
+                    continue
                 
                 # Store YuKuai and get IDs
-                yu_kuai_ids = []
-                for yu_kuai in yu_kuai_list:
-                    yu_kuai_id = self.db.get_or_create_yu_kuai(yu_kuai)
-                    yu_kuai_ids.append(yu_kuai_id)
+                yu_kuai_ids = self.db.get_or_create_many(yu_kuai_list)
+                records = []
+                for yu_kuai_id, yu_kuai in zip(yu_kuai_ids, yu_kuai_list):
+                    if isinstance(yu_kuai, YuKuaiRecord):
+                        records.append(yu_kuai)
+                        continue
+                    record = YuKuaiRecord(yu_kuai_id, yu_kuai.type, yu_kuai.canonical_name,
+                                          yu_kuai.slug, yu_kuai.description,
+                                          json.dumps(yu_kuai.extra_metadata))
+                    records.append(record)
+                    # Let later sentences resolve this vocab without the LLM
+                    if yu_kuai.id is None:
+                        self.segmenter.add(record)
                 
                 # Store sentence
-                self.sentence_counter += 1
-                sentence = Sentence(
-                    id=self.sentence_counter,
-                    text=sentence_text,
-                    yu_kuai_ids=yu_kuai_ids
-                )
-                self.sentences.append(sentence)
+                sentence_id = self.db.record_sentence(job_id, span.seq, span.text, span.end_offset, yu_kuai_ids)
+                if self.retain_sentences:
+                    self.sentences.append(SentenceRecord.create(
+                        id=sentence_id,
+                        text=span.text,
+                        yu_kuai_ids=yu_kuai_ids
+                    ))
+                events.append(IngestEvent('sentence', source, seq=span.seq, text=span.text, yu_kuai=records))
                 
-                # Add to file results
-                sentence_result = {
-                    'text': sentence_text,
-                    'yu_kuai': [
-                        {
-                            'id': yu_kuai_id,
-                            'canonical_name': yu_kuai.canonical_name,
-                            'type': yu_kuai.type,
-                            'description': yu_kuai.description,
-                            'slug': yu_kuai.slug
-                        }
-                        for yu_kuai in yu_kuai_list
-                    ]
-                }
-                file_results['sentences'].append(sentence_result)
+                file_results['sentence_count'] += 1
                 file_results['yu_kuai_count'] += len(yu_kuai_ids)
-                
-            except RuntimeError as e:
-                error_msg = f"Failed to parse sentence: {e}"
-                print(f"  ❌ {error_msg}")
-                continue
+            
+            self.db.advance_ingest_job(job_id)
         
-        print()  # Clear the progress line
+        failed = sum(event.kind == 'failed' for event in events)
+        METRICS.inc('sentences_total', len(events) - failed, outcome='done')
+        METRICS.inc('sentences_total', failed, outcome='failed')
+        return events
+    
+    @METRICS.timed('offline_segment_seconds')
+    def _resolve_offline(self, sentences: List[str]) -> Tuple[List[Optional[ParseOutcome]], List[int]]:
+        """Resolve sentences made only of known vocab locally.
         
-        self.results.append(file_results)
-        print(f"✅ Completed processing {file_path}")
-        print(f"   📊 Sentences: {len(file_results['sentences'])}")
-        print(f"   🧩 YuKuai: {file_results['yu_kuai_count']}")
+        Returns the outcome list (the known vocab, or None where the sentence
+        has unresolved spans) and the indices of the unresolved sentences.
+        Those go to the LLM whole, so context-dependent senses are still
+        detected for them.
+        """
+        outcomes: List[Optional[ParseOutcome]] = [None] * len(sentences)
+        pending = []
+        for i, sentence_text in enumerate(sentences):
+            segmentation = self.segmenter.segment(sentence_text)
+            if segmentation.unresolved or not segmentation.yu_kuai:
+                pending.append(i)
+            else:
+                outcomes[i] = segmentation.yu_kuai
+        return outcomes, pending
     
-
+    def _get_runner(self, concurrency: int) -> LimitedRunner:
+        """The event loop and rate limiter for concurrent parsing, created on first use
+        
+        They are kept until _close_runner(), so the token bucket and any
+        429 backoff carry over from one window to the next.
+        """
+        if self._runner is not None and self._runner.max_concurrency != concurrency:
+            self._close_runner()
+        if self._runner is None:
+            self._runner = LimitedRunner(max_concurrency=concurrency, tokens_per_minute=self.tokens_per_minute)
+        return self._runner
+    
+    def _close_runner(self):
+        """Close the async LLM client and its event loop, reporting rate-limit backoff"""
+        if self._runner is None:
+            return
+        runner, self._runner = self._runner, None
+        runner.close(self.llm_parser.aclose)
+        if runner.limiter.rate_limited_count:
+            print(f"\n  ⏳ Backed off {runner.limiter.rate_limited_count} times on rate limits")
+    
+    async def _parse_sentences_async(self, sentences: List[str], grammar_sentences: List[str],
+                                     limiter: RateLimiter) -> Tuple[List[ParseOutcome], List[ParseOutcome]]:
+        """Parse batches concurrently under rate limits, returning outcomes in input order
+        
+        sentences are parsed whole; grammar_sentences only have their
+        grammar detected. Both share one limiter.
+        """
+        async def parse_batch(batch_texts: List[str], grammar_only: bool) -> List[ParseOutcome]:
+            if grammar_only:
+                call = lambda: self.llm_parser.detect_grammar_async(batch_texts)
+                tokens = self.llm_parser.estimate_grammar_tokens(batch_texts)
+            else:
+                call = lambda: self.llm_parser.parse_sentences_async(batch_texts)
+                tokens = self.llm_parser.estimate_batch_tokens(batch_texts)
+            try:
+                outcomes = await limiter.run(call, tokens)
+            except Exception as e:
+                outcomes = [RuntimeError(f"LLM parsing failed: {e}")] * len(batch_texts)
+            return outcomes
+        
+        def batches(texts: List[str]) -> List[List[str]]:
+            return [[texts[i] for i in batch] for batch in self.llm_parser.plan_batches(texts)]
+        
+        full = batches(sentences)
+        grammar = batches(grammar_sentences)
+        results = await asyncio.gather(*(parse_batch(batch, False) for batch in full),
+                                       *(parse_batch(batch, True) for batch in grammar))
+        return ([outcome for outcomes in results[:len(full)] for outcome in outcomes],
+                [outcome for outcomes in results[len(full):] for outcome in outcomes])
     
     def display_summary(self):
         """Display a summary of all processing results"""
@@ -114,20 +426,22 @@ class XueDuApp:
         
         for result in self.results:
             print(f"\n📁 File: {result['file']}")
-            print(f"   📖 Sentences: {len(result['sentences'])}")
+            print(f"   📖 Sentences: {result['sentence_count']}")
             print(f"   🧩 YuKuai: {result['yu_kuai_count']}")
-            total_sentences += len(result['sentences'])
+            total_sentences += result['sentence_count']
             total_yu_kuai += result['yu_kuai_count']
         
         print(f"\n{'='*50}")
         print(f"📈 TOTAL: {len(self.results)} files, {total_sentences} sentences, {total_yu_kuai} YuKuai")
+        slug_stats = self.db.cache_stats()['slug']
+        if slug_stats['hits'] + slug_stats['misses']:
+            print(f"🗄️  Slug lookups served from memory: {slug_stats['hit_rate']:.0%}")
         print(f"{'='*50}")
         
         # Show some YuKuai examples
-        if self.sentences:
+        if total_yu_kuai:
             print(f"\n🔍 Sample YuKuai found:")
-            yu_kuai_with_scores = self.db.get_all_yu_kuai_with_scores()
-            for yu_kuai, score in yu_kuai_with_scores[:5]:
+            for yu_kuai, score in self.db.get_all_yu_kuai_with_scores_page(limit=5, user_id=self.user_id):
                 print(f"   • {yu_kuai.canonical_name} ({yu_kuai.type}) - {score} points")
     
     def display_sentences_with_scores(self):
@@ -141,6 +455,12 @@ class XueDuApp:
             print("💡 Process a text file first to see your learning progress!")
             return
         
+        # One bulk fetch for every YuKuai on the dashboard
+        yu_kuai_by_id = self.db.get_yu_kuai_with_scores_by_ids(
+            (yu_kuai_id for sentence in self.sentences for yu_kuai_id in sentence.yu_kuai_ids),
+            user_id=self.user_id
+        )
+        
         total_text_score = 0
         
         for sentence in self.sentences:
@@ -149,9 +469,8 @@ class XueDuApp:
             
             sentence_score = 0
             for yu_kuai_id in sentence.yu_kuai_ids:
-                yu_kuai = self.db.get_yu_kuai_by_id(yu_kuai_id)
-                if yu_kuai:
-                    score = self.db.get_yu_kuai_score(yu_kuai_id)
+                if yu_kuai_id in yu_kuai_by_id:
+                    yu_kuai, score = yu_kuai_by_id[yu_kuai_id]
                     sentence_score += score
                     
                     # Color-coded score display
@@ -178,22 +497,30 @@ class XueDuApp:
         """Interactive quiz mode"""
         print("\n=== Quiz Mode ===")
         
-        # Get least learned YuKuai
-        least_learned = self.db.get_least_learned_yu_kuai(limit=5)
+        # Review what is due first, then fall back to the least learned YuKuai
+        to_review = self.db.get_due_yu_kuai(limit=5, user_id=self.user_id)
         
-        if not least_learned:
-            print("No YuKuai found for quiz.")
-            return
+        if to_review:
+            print("Let's review the YuKuai that are due!")
+        else:
+            to_review = self.db.get_least_learned_yu_kuai(limit=5, user_id=self.user_id)
+            if not to_review:
+                print("No YuKuai found for quiz.")
+                return
+            print("Nothing is due, let's practice the least learned YuKuai!")
         
-        print("Let's practice the least learned YuKuai!")
+        # Questions for later items are generated while earlier ones are answered
+        self.question_pool.prefill([yu_kuai for yu_kuai, _ in to_review])
         
-        for yu_kuai, current_score in least_learned:
+        for yu_kuai, current_score in to_review:
             print(f"\n--- {yu_kuai.canonical_name} ({yu_kuai.type}) ---")
             print(f"Description: {yu_kuai.description}")
             
-            # Generate quiz question
+            # Take a pre-generated question, generating one only if the pool is empty
             try:
-                question = self.llm_parser.generate_quiz_question(yu_kuai)
+                question = self.question_pool.take(yu_kuai)
+                if question is None:
+                    question = self.llm_parser.generate_quiz_question(yu_kuai)
                 print(f"Question: {question}")
             except RuntimeError as e:
                 print(f"❌ Failed to generate quiz question: {e}")
@@ -209,11 +536,11 @@ class XueDuApp:
             choice = input("Your choice (1, 2, or 3): ").strip()
             
             if choice == "1":
-                self.db.update_score(yu_kuai.id, 1)
-                print("Great! +1 point")
+                state = self.db.review_yu_kuai(yu_kuai.id, srs.QUALITY_GOOD, user_id=self.user_id)
+                print(f"Great! +1 point (next review in {state.interval_days:.0f} days)")
             elif choice == "2":
-                self.db.update_score(yu_kuai.id, -1)
-                print("Keep practicing! -1 point")
+                self.db.review_yu_kuai(yu_kuai.id, srs.QUALITY_UNSURE, user_id=self.user_id)
+                print("Keep practicing! -1 point (you'll see this again soon)")
             elif choice == "3":
                 print("Skipped.")
             else:
@@ -0,0 +1,201 @@
+"""
+Multi-file batch ingestion with a process pool for the XueDu Chinese Learning App
+"""
+
+import glob
+import multiprocessing
+import os
+import queue
+import time
+from typing import List, Optional
+
+from llm_backend import LLMBackend
+
+from app import XueDuApp, INGEST_WINDOW_SIZE
+from text_stream import batched, iter_sentences
+
+# Extensions picked up when a directory is given
+TEXT_EXTENSIONS = ('.txt',)
+
+# Windows of parsed results buffered per worker before workers block
+RESULT_QUEUE_WINDOWS_PER_WORKER = 4
+
+def expand_inputs(inputs: List[str]) -> List[str]:
+    """Expand files, directories and glob patterns into a sorted list of files"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in files
+                             if name.lower().endswith(TEXT_EXTENSIONS))
+        elif glob.has_magic(item):
+            paths.extend(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+        else:
+            paths.append(item)
+
+    # Keep the first occurrence of each file
+    seen = set()
+    unique = []
+    for path in sorted(paths):
+        real_path = os.path.realpath(path)
+        if real_path not in seen:
+            seen.add(real_path)
+            unique.append(path)
+    return unique
+
+def _worker_main(task_queue, result_queue, db_path: Optional[str], llm_cache_path: Optional[str],
+                 cedict_path: Optional[str], concurrency: int, tokens_per_minute: int,
+                 llm_backend: Optional[LLMBackend]):
+    """Parse files from task_queue and send each window's outcomes to the writer.
+
+    Workers only read from SQLite (to skip sentences that are already done,
+    and to learn the vocab the parent has stored since the last window);
+    every write happens in the parent process.
+    """
+    app = XueDuApp(cedict_path=cedict_path, retain_sentences=False,
+                   db_path=db_path, llm_cache_path=llm_cache_path, llm_backend=llm_backend)
+    app.tokens_per_minute = tokens_per_minute
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            job_id, file_path, resume_offset, resume_seq = task
+
+            try:
+                spans = iter_sentences(file_path, start_offset=resume_offset, start_seq=resume_seq)
+                for window in batched(spans, INGEST_WINDOW_SIZE):
+                    done = app.db.get_done_sentence_seqs(job_id, window[0].seq, window[-1].seq)
+                    pending = [span for span in window if span.seq not in done]
+                    app.segmenter.refresh(app.db)
+                    counts = {'offline_count': 0}
+                    outcomes = app.parse_window([span.text for span in pending], concurrency, counts) if pending else []
+                    result_queue.put(('window', job_id, pending, outcomes,
+                                      len(window) - len(pending), counts['offline_count'],
+                                      window[-1].end_offset))
+                result_queue.put(('file_done', job_id, None))
+            except Exception as e:
+                result_queue.put(('file_error', job_id, str(e)))
+    finally:
+        app.close()
+
+class BatchIngestor:
+    """Ingests many files with parsing spread over worker processes.
+
+    Each worker streams whole files and parses them (reading, segmentation
+    and LLM calls); the parent process is the single SQLite writer, storing
+    windows as they arrive over a queue and printing aggregate progress.
+    Workers use llm_backend if given (it is sent to each worker, so it must
+    be picklable), otherwise the default OpenAI backend.
+    """
+
+    def __init__(self, app: XueDuApp, workers: int, concurrency: int = 1,
+                 cedict_path: Optional[str] = None, llm_backend: Optional[LLMBackend] = None):
+        self.app = app
+        self.workers = workers
+        self.concurrency = concurrency
+        self.cedict_path = cedict_path
+        self.llm_backend = llm_backend
+
+    def run(self, paths: List[str]):
+        """Ingest every file in paths"""
+        context = multiprocessing.get_context()
+        task_queue = context.Queue()
+        result_queue = context.Queue(maxsize=self.workers * RESULT_QUEUE_WINDOWS_PER_WORKER)
+
+        file_results = {}
+        file_sizes = {}
+        resume_offsets = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                print(f"❌ Error reading file {path}: {e}")
+                continue
+            job = self.app.db.get_or_create_ingest_job(os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+            file_results[job.id] = {
+                'file': path,
+                'sentence_count': 0,
+                'failed_count': 0,
+                'skipped_count': 0,
+                'yu_kuai_count': 0,
+                'offline_count': 0
+            }
+            file_sizes[job.id] = stat.st_size - job.resume_offset
+            resume_offsets[job.id] = job.resume_offset
+            task_queue.put((job.id, path, job.resume_offset, job.resume_seq))
+
+        worker_count = min(self.workers, len(file_results))
+        if not worker_count:
+            print("❌ No files to process.")
+            return
+        for _ in range(worker_count):
+            task_queue.put(None)
+
+        # Split the token budget so all workers together stay under it
+        tokens_per_minute = max(1, self.app.tokens_per_minute // worker_count)
+        processes = [
+            context.Process(
+                target=_worker_main,
+                args=(task_queue, result_queue, self.app.db.db_path, self.app.llm_parser.cache.db_path,
+                      self.cedict_path, self.concurrency, tokens_per_minute, self.llm_backend),
+                daemon=True
+            )
+            for _ in range(worker_count)
+        ]
+        for process in processes:
+            process.start()
+
+        total_bytes = sum(file_sizes.values())
+        print(f"📚 Ingesting {len(file_results)} files ({total_bytes:,} bytes) with {worker_count} workers")
+
+        started = time.monotonic()
+        bytes_done = {job_id: 0 for job_id in file_results}
+        remaining = set(file_results)
+        while remaining:
+            try:
+                message = result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    print(f"\n❌ Workers exited with {len(remaining)} files unfinished")
+                    break
+                continue
+
+            kind, job_id = message[0], message[1]
+            results = file_results[job_id]
+            if kind == 'window':
+                _, _, spans, outcomes, skipped, offline, end_offset = message
+                if spans:
+                    self.app.store_window(job_id, results['file'], spans, outcomes, results)
+                results['skipped_count'] += skipped
+                results['offline_count'] += offline
+                bytes_done[job_id] = end_offset - resume_offsets[job_id]
+            elif kind == 'file_done':
+                self.app.db.complete_ingest_job(job_id)
+                remaining.discard(job_id)
+                self.app.results.append(results)
+            else:
+                print(f"\n❌ Error reading file {results['file']}: {message[2]}")
+                remaining.discard(job_id)
+
+            elapsed = max(time.monotonic() - started, 1e-9)
+            sentences = sum(r['sentence_count'] + r['failed_count'] for r in file_results.values())
+            done_bytes = sum(bytes_done.values())
+            print(f"  Files {len(file_results) - len(remaining)}/{len(file_results)} | "
+                  f"{sentences} sentences | {sentences / elapsed:.1f} sentences/s | "
+                  f"{done_bytes / elapsed / 1024:.1f} KiB/s", end='\r')
+
+        for process in processes:
+            process.join(timeout=5)
+        print()  # Clear the progress line
+
+        elapsed = time.monotonic() - started
+        sentences = sum(r['sentence_count'] for r in file_results.values())
+        failed = sum(r['failed_count'] for r in file_results.values())
+        print(f"✅ Processed {len(file_results) - len(remaining)} files in {elapsed:.1f}s")
+        print(f"   📊 Sentences: {sentences} ({sentences / max(elapsed, 1e-9):.1f}/s)")
+        if failed:
+            print(f"   ❌ Failed: {failed} sentences (rerun to retry)")
+
+        self.app.prefill_quiz_questions()
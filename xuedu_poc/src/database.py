@@ -3,172 +3,945 @@ Database operations for the XueDu Chinese Learning App
 """
 
 import sqlite3
+import heapq
+import itertools
 import json
-from typing import List, Tuple, Optional
-from models import YuKuai
+import os
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Set, Tuple, Optional
+from models import YuKuai, YuKuaiRecord, IngestJob
+from lru_cache import LRUCache
+from metrics import METRICS
+from search_index import build_match_query, search_fields
+import srs
 
 # Configuration
 DEFAULT_USER_ID = 1
 
+# In-memory LRU caches in front of hot lookups. yu_kuai rows never change
+# once written, so those entries only go stale if a transaction rolls back;
+# cached scores are written through by this process's updates only.
+YU_KUAI_CACHE_SIZE = 10_000
+SLUG_CACHE_SIZE = 50_000
+SCORE_CACHE_SIZE = 10_000
+
+# Per-user score databases kept open by each thread when scores are sharded;
+# the least recently used one is closed beyond this
+MAX_USER_CONNECTIONS_PER_THREAD = 8
+
+# Pragmas applied to every pooled connection. WAL lets readers proceed while
+# a writer holds the lock, and NORMAL sync is durable across app crashes in
+# WAL mode while avoiding an fsync per commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -20000",
+    "PRAGMA busy_timeout = 5000",
+)
+
+class _PooledConnection(sqlite3.Connection):
+    """A pooled connection that tracks how deeply transaction() is nested"""
+    depth = 0
+
+# Stay well under SQLite's limit on bound parameters per statement
+MAX_SQL_VARIABLES = 900
+
+def _chunked(items: list, size: int):
+    """Yield successive slices of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _index_for_search(conn: sqlite3.Connection, rows: Iterable[tuple]):
+    """Add (id, canonical_name, description, extra_metadata JSON) rows to yu_kuai_fts"""
+    conn.executemany("""
+        INSERT INTO yu_kuai_fts (rowid, name, description, pinyin)
+        VALUES (?, ?, ?, ?)
+    """, [(row[0], *search_fields(row[1], row[2], json.loads(row[3]))) for row in rows])
+
+def _backfill_search_index(conn: sqlite3.Connection):
+    """Index every YuKuai stored before the search index existed"""
+    cursor = conn.execute("SELECT id, canonical_name, description, extra_metadata FROM yu_kuai")
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        _index_for_search(conn, rows)
+
+# Schema migrations, applied in order. PRAGMA user_version records how many
+# have run; append new entries and never edit ones that have shipped. An
+# entry is a SQL statement, or a function of the connection for data changes
+# that need Python.
+MIGRATIONS = [
+    # 1: YuKuai and scores
+    (
+        # yu_kuai table
+        """
+        CREATE TABLE IF NOT EXISTS yu_kuai (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL CHECK (type IN ('vocab', 'grammar')),
+            canonical_name TEXT NOT NULL,
+            slug TEXT UNIQUE NOT NULL,
+            description TEXT NOT NULL,
+            extra_metadata TEXT NOT NULL
+        )
+        """,
+        # user_scores table
+        """
+        CREATE TABLE IF NOT EXISTS user_scores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL DEFAULT 1,
+            yu_kuai_id INTEGER NOT NULL,
+            score INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (yu_kuai_id) REFERENCES yu_kuai (id),
+            UNIQUE(user_id, yu_kuai_id)
+        )
+        """,
+    ),
+    # 2: Persisted sentences and resumable ingest jobs
+    (
+        # ingest_jobs table; a job identifies one version of a file
+        """
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_path TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            file_mtime_ns INTEGER NOT NULL,
+            resume_offset INTEGER NOT NULL DEFAULT 0,
+            resume_seq INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'completed')),
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            UNIQUE(file_path, file_size, file_mtime_ns)
+        )
+        """,
+        # sentences table
+        """
+        CREATE TABLE IF NOT EXISTS sentences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            end_offset INTEGER NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('done', 'failed')),
+            error TEXT,
+            FOREIGN KEY (job_id) REFERENCES ingest_jobs (id),
+            UNIQUE(job_id, seq)
+        )
+        """,
+        # sentence_yu_kuai table linking sentences to their YuKuai
+        """
+        CREATE TABLE IF NOT EXISTS sentence_yu_kuai (
+            sentence_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            yu_kuai_id INTEGER NOT NULL,
+            FOREIGN KEY (sentence_id) REFERENCES sentences (id),
+            FOREIGN KEY (yu_kuai_id) REFERENCES yu_kuai (id),
+            PRIMARY KEY (sentence_id, position)
+        )
+        """,
+    ),
+    # 3: Access paths for score-ordered quiz selection and ingest bookkeeping
+    (
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_scores_user_score
+        ON user_scores (user_id, score, yu_kuai_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_yu_kuai_type ON yu_kuai (type, id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_sentences_job_status ON sentences (job_id, status, seq)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_sentence_yu_kuai_yu_kuai ON sentence_yu_kuai (yu_kuai_id)
+        """,
+    ),
+    # 4: Spaced-repetition state and the due queue
+    (
+        "ALTER TABLE user_scores ADD COLUMN ease REAL NOT NULL DEFAULT 2.5",
+        "ALTER TABLE user_scores ADD COLUMN interval_days REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE user_scores ADD COLUMN repetitions INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE user_scores ADD COLUMN due_at REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE user_scores ADD COLUMN last_reviewed_at REAL",
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_scores_due
+        ON user_scores (user_id, due_at, yu_kuai_id)
+        """,
+    ),
+    # 5: Pre-generated quiz questions, consumed oldest first
+    (
+        """
+        CREATE TABLE IF NOT EXISTS quiz_questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            yu_kuai_id INTEGER NOT NULL,
+            question TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            FOREIGN KEY (yu_kuai_id) REFERENCES yu_kuai (id)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_quiz_questions_yu_kuai ON quiz_questions (yu_kuai_id, id)
+        """,
+    ),
+    # 6: Full-text search over names, descriptions and toneless pinyin.
+    # rowid is the yu_kuai id; names are indexed one character per token.
+    (
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS yu_kuai_fts USING fts5 (
+            name, description, pinyin,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """,
+        _backfill_search_index,
+    ),
+]
+
+# Schema of a per-user score database, versioned the same way as MIGRATIONS.
+# yu_kuai lives in the shared database, so there is no foreign key.
+USER_MIGRATIONS = [
+    # 1: Scores and spaced-repetition state
+    (
+        """
+        CREATE TABLE IF NOT EXISTS user_scores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            yu_kuai_id INTEGER NOT NULL,
+            score INTEGER NOT NULL DEFAULT 0,
+            ease REAL NOT NULL DEFAULT 2.5,
+            interval_days REAL NOT NULL DEFAULT 0,
+            repetitions INTEGER NOT NULL DEFAULT 0,
+            due_at REAL NOT NULL DEFAULT 0,
+            last_reviewed_at REAL,
+            UNIQUE(user_id, yu_kuai_id)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_scores_user_score
+        ON user_scores (user_id, score, yu_kuai_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_user_scores_due
+        ON user_scores (user_id, due_at, yu_kuai_id)
+        """,
+    ),
+]
+
 class XueDuDB:
-    """Database manager for the XueDu Chinese learning app"""
+    """Database manager for the XueDu Chinese learning app
     
-    def __init__(self, db_path: str):
+    YuKuai, sentences and ingest jobs are shared by every learner. Scores
+    are per user: by default they live in the shared user_scores table,
+    and with user_db_dir set each user gets their own score database
+    (user_<id>.db) so one learner's writes never wait on another's, or on
+    ingestion.
+    """
+    
+    def __init__(self, db_path: str, user_db_dir: Optional[str] = None):
         self.db_path = db_path
+        self.user_db_dir = user_db_dir
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._migrated_user_dbs: Set[int] = set()
+        self._yu_kuai_cache: LRUCache[YuKuaiRecord] = LRUCache(YU_KUAI_CACHE_SIZE)
+        self._slug_cache: LRUCache[int] = LRUCache(SLUG_CACHE_SIZE)
+        self._score_cache: LRUCache[int] = LRUCache(SCORE_CACHE_SIZE)
+        if user_db_dir:
+            os.makedirs(user_db_dir, exist_ok=True)
         self.init_database()
     
+    def _open_connection(self, database: str, uri: bool = False) -> sqlite3.Connection:
+        """Open a pooled connection in autocommit mode with the standard pragmas"""
+        # Autocommit mode: transactions are opened explicitly by transaction()
+        conn = sqlite3.connect(database, isolation_level=None, check_same_thread=False,
+                               uri=uri, factory=_PooledConnection)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
+    def _get_connection(self, user_id: Optional[int] = None) -> sqlite3.Connection:
+        """Return the long-lived connection owned by the calling thread
+        
+        With a user_id and sharded scores this is the connection to that
+        user's score database; otherwise it is the shared database's.
+        """
+        if user_id is not None and self.user_db_dir:
+            return self._get_user_connection(user_id)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._open_connection(self.db_path)
+        return conn
+    
+    def _get_user_connection(self, user_id: int) -> sqlite3.Connection:
+        """Return the calling thread's connection to a user's score database
+        
+        The shared database is attached read-only as "catalog", so the same
+        joins against yu_kuai work unchanged while BEGIN IMMEDIATE only
+        locks the user's own file.
+        """
+        user_conns = getattr(self._local, 'user_conns', None)
+        if user_conns is None:
+            user_conns = self._local.user_conns = OrderedDict()
+        
+        conn = user_conns.get(user_id)
+        if conn is not None:
+            user_conns.move_to_end(user_id)
+            return conn
+        
+        path = os.path.abspath(os.path.join(self.user_db_dir, f"user_{user_id}.db"))
+        conn = self._open_connection(f"file:{urllib.parse.quote(path)}", uri=True)
+        conn.execute("ATTACH DATABASE ? AS catalog",
+                     (f"file:{urllib.parse.quote(os.path.abspath(self.db_path))}?mode=ro",))
+        user_conns[user_id] = conn
+        if user_id not in self._migrated_user_dbs:
+            self._migrate(conn, USER_MIGRATIONS)
+            self._migrated_user_dbs.add(user_id)
+        
+        # Close the least recently used connections that are not mid-transaction
+        for stale_id in list(user_conns):
+            if len(user_conns) <= MAX_USER_CONNECTIONS_PER_THREAD:
+                break
+            stale = user_conns[stale_id]
+            if stale_id != user_id and stale.depth == 0:
+                del user_conns[stale_id]
+                with self._connections_lock:
+                    self._connections.remove(stale)
+                stale.close()
+        return conn
+    
+    @contextmanager
+    def transaction(self, user_id: Optional[int] = None):
+        """Group writes into a single commit.
+        
+        Nested calls join the outermost transaction, so callers can wrap a
+        whole file's worth of inserts while individual methods still commit
+        on their own when used standalone. Pass user_id for writes to a
+        user's scores, which may live in their own database.
+        """
+        conn = self._get_connection(user_id)
+        if conn.depth > 0:
+            conn.depth += 1
+            try:
+                yield conn
+            finally:
+                conn.depth -= 1
+            return
+        
+        # Time spent waiting here is time another writer held the lock
+        with METRICS.time('db_seconds', op='begin'):
+            conn.execute("BEGIN IMMEDIATE")
+        conn.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.depth = 0
+            conn.execute("ROLLBACK")
+            # Entries cached inside the transaction may name rows that no longer exist
+            self._clear_caches()
+            raise
+        conn.depth = 0
+        with METRICS.time('db_seconds', op='commit'):
+            conn.execute("COMMIT")
+    
+    def _clear_caches(self):
+        """Drop every cached lookup"""
+        self._yu_kuai_cache.clear()
+        self._slug_cache.clear()
+        self._score_cache.clear()
+    
+    def cache_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return hit/miss counters of the lookup caches, by cache"""
+        return {
+            'yu_kuai': self._yu_kuai_cache.stats(),
+            'slug': self._slug_cache.stats(),
+            'score': self._score_cache.stats(),
+        }
+    
+    def close(self):
+        """Close every pooled connection"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        # Newest first, so the shared database's own connection closes after
+        # the read-only attachments and can clean up its WAL files
+        for conn in reversed(connections):
+            conn.close()
+        self._local = threading.local()
+    
     def init_database(self):
-        """Initialize the database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Create yu_kuai table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS yu_kuai (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    type TEXT NOT NULL CHECK (type IN ('vocab', 'grammar')),
-                    canonical_name TEXT NOT NULL,
-                    slug TEXT UNIQUE NOT NULL,
-                    description TEXT NOT NULL,
-                    extra_metadata TEXT NOT NULL
-                )
-            """)
-            
-            # Create user_scores table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_scores (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL DEFAULT 1,
-                    yu_kuai_id INTEGER NOT NULL,
-                    score INTEGER NOT NULL DEFAULT 0,
-                    FOREIGN KEY (yu_kuai_id) REFERENCES yu_kuai (id),
-                    UNIQUE(user_id, yu_kuai_id)
-                )
-            """)
-            
-            conn.commit()
+        """Create or upgrade the schema by applying pending migrations"""
+        self._migrate(self._get_connection(), MIGRATIONS)
+    
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection, migrations: list):
+        """Apply the migrations conn's database has not run yet
+        
+        Each migration runs in its own write transaction together with the
+        user_version bump, and the version is re-read under the write lock
+        so concurrent processes opening the same file never apply one twice.
+        """
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA main.user_version").fetchone()[0]
+                if version < len(migrations):
+                    for statement in migrations[version]:
+                        if callable(statement):
+                            statement(conn)
+                        else:
+                            conn.execute(statement)
+                    conn.execute(f"PRAGMA main.user_version = {version + 1}")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            if version >= len(migrations):
+                break
     
     def get_or_create_yu_kuai(self, yu_kuai: YuKuai) -> int:
         """Get existing YuKuai ID or create new one, returns the ID"""
-        with sqlite3.connect(self.db_path) as conn:
+        return self.get_or_create_many([yu_kuai])[0]
+    
+    @METRICS.timed('db_seconds', op='upsert_yu_kuai')
+    def get_or_create_many(self, yu_kuai_list: List[YuKuai]) -> List[int]:
+        """Get or create a batch of YuKuai, returns IDs in input order.
+        
+        Duplicates are collapsed by slug in memory (first occurrence wins)
+        and slugs already in the slug cache are resolved without touching
+        SQLite. The rest are resolved with chunked IN lookups, and those
+        still missing are inserted with executemany and added to the search
+        index. Score rows are not created here; a user gets one
+        on their first review of the YuKuai.
+        """
+        if not yu_kuai_list:
+            return []
+        
+        slug_to_id = {}
+        unique = {}
+        for yu_kuai in yu_kuai_list:
+            if yu_kuai.slug in slug_to_id or yu_kuai.slug in unique:
+                continue
+            cached_id = self._slug_cache.get(yu_kuai.slug)
+            if cached_id is not None:
+                slug_to_id[yu_kuai.slug] = cached_id
+            else:
+                unique[yu_kuai.slug] = yu_kuai
+        
+        if not unique:
+            return [slug_to_id[yu_kuai.slug] for yu_kuai in yu_kuai_list]
+        
+        with self.transaction() as conn:
             cursor = conn.cursor()
             
-            # Check if exists by slug
-            cursor.execute("SELECT id FROM yu_kuai WHERE slug = ?", (yu_kuai.slug,))
-            result = cursor.fetchone()
+            def resolve(slugs: List[str]):
+                for chunk in _chunked(slugs, MAX_SQL_VARIABLES):
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor.execute(f"SELECT slug, id FROM yu_kuai WHERE slug IN ({placeholders})", chunk)
+                    for slug, yu_kuai_id in cursor.fetchall():
+                        slug_to_id[slug] = yu_kuai_id
+                        self._slug_cache.put(slug, yu_kuai_id)
             
-            if result:
-                return result[0]
-            else:
-                # Insert new YuKuai
-                cursor.execute("""
+            resolve(list(unique))
+            new = [yu_kuai for slug, yu_kuai in unique.items() if slug not in slug_to_id]
+            
+            if new:
+                # The write lock is held, so no one else can insert these slugs first
+                rows = [(y.type, y.canonical_name, y.slug, y.description, json.dumps(y.extra_metadata))
+                        for y in new]
+                cursor.executemany("""
                     INSERT INTO yu_kuai (type, canonical_name, slug, description, extra_metadata)
                     VALUES (?, ?, ?, ?, ?)
-                """, (yu_kuai.type, yu_kuai.canonical_name, yu_kuai.slug, 
-                      yu_kuai.description, json.dumps(yu_kuai.extra_metadata)))
-                
-                # Initialize user score
-                yu_kuai_id = cursor.lastrowid
-                cursor.execute("""
-                    INSERT INTO user_scores (user_id, yu_kuai_id, score)
-                    VALUES (?, ?, 0)
-                """, (DEFAULT_USER_ID, yu_kuai_id))
-                
-                conn.commit()
-                return yu_kuai_id
-    
-    def get_yu_kuai_by_id(self, yu_kuai_id: int) -> Optional[YuKuai]:
-        """Get YuKuai by ID"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, type, canonical_name, slug, description, extra_metadata
-                FROM yu_kuai WHERE id = ?
-            """, (yu_kuai_id,))
+                """, rows)
+                resolve([yu_kuai.slug for yu_kuai in new])
+                _index_for_search(conn, [(slug_to_id[row[2]], row[1], row[3], row[4]) for row in rows])
+        
+        return [slug_to_id[yu_kuai.slug] for yu_kuai in yu_kuai_list]
+    
+    def get_yu_kuai_with_scores_by_ids(self, yu_kuai_ids: Iterable[int],
+                                       user_id: int = DEFAULT_USER_ID) -> Dict[int, Tuple[YuKuaiRecord, int]]:
+        """Get many YuKuai with a user's scores in one joined query, keyed by ID"""
+        ids = list(set(yu_kuai_ids))
+        conn = self._get_connection(user_id)
+        cursor = conn.cursor()
+        
+        results = {}
+        for chunk in _chunked(ids, MAX_SQL_VARIABLES):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"""
+                SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata,
+                       COALESCE(us.score, 0)
+                FROM yu_kuai y
+                LEFT JOIN user_scores us ON us.yu_kuai_id = y.id AND us.user_id = ?
+                WHERE y.id IN ({placeholders})
+            """, (user_id, *chunk))
             
-            result = cursor.fetchone()
-            if result:
-                return YuKuai(
-                    id=result[0],
-                    type=result[1],
-                    canonical_name=result[2],
-                    slug=result[3],
-                    description=result[4],
-                    extra_metadata=json.loads(result[5])
-                )
+            for row in cursor.fetchall():
+                results[row[0]] = (self._yu_kuai_from_row(row), row[6])
+        
+        return results
+    
+    def get_yu_kuai_by_id(self, yu_kuai_id: int) -> Optional[YuKuaiRecord]:
+        """Get YuKuai by ID"""
+        yu_kuai = self._yu_kuai_cache.get(yu_kuai_id)
+        if yu_kuai is not None:
+            return yu_kuai
+        
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, type, canonical_name, slug, description, extra_metadata
+            FROM yu_kuai WHERE id = ?
+        """, (yu_kuai_id,))
+        
+        result = cursor.fetchone()
+        if result is None:
             return None
+        yu_kuai = self._yu_kuai_from_row(result)
+        self._yu_kuai_cache.put(yu_kuai_id, yu_kuai)
+        return yu_kuai
+    
+    def get_vocab_index(self, after_id: int = 0) -> List[Tuple[int, str, str, str]]:
+        """Get (id, canonical_name, slug, description) for every vocab YuKuai with an ID above after_id"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, canonical_name, slug, description
+            FROM yu_kuai WHERE type = 'vocab' AND id > ?
+            ORDER BY id
+        """, (after_id,))
+        return cursor.fetchall()
     
-    def get_least_learned_yu_kuai(self, limit: int = 5) -> List[Tuple[YuKuai, int]]:
+    def get_least_learned_yu_kuai(self, limit: int = 5,
+                                  user_id: int = DEFAULT_USER_ID) -> List[Tuple[YuKuaiRecord, int]]:
         """Get YuKuai with lowest scores for quiz mode"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        return self.get_least_learned_yu_kuai_page(limit, user_id=user_id)
+    
+    def get_least_learned_yu_kuai_page(self, limit: int, after: Optional[Tuple[int, int]] = None,
+                                       user_id: int = DEFAULT_USER_ID) -> List[Tuple[YuKuaiRecord, int]]:
+        """Get a page of YuKuai ordered by score ascending, then ID
+        
+        Keyset pagination: pass the (score, id) of the last item of the
+        previous page as after. Reviewed items are a range scan of the
+        (user_id, score, yu_kuai_id) index, so their cost does not grow with
+        the table or the page number. YuKuai the user has never reviewed
+        have no score row and are merged in with a score of 0, at the cost
+        described in _get_unseen_rows.
+        """
+        conn = self._get_connection(user_id)
+        cursor = conn.cursor()
+        after_score, after_id = after if after else (-1, -1)
+        cursor.execute("""
+            SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata, us.score
+            FROM user_scores us
+            JOIN yu_kuai y ON y.id = us.yu_kuai_id
+            WHERE us.user_id = ? AND (us.score, us.yu_kuai_id) > (?, ?)
+            ORDER BY us.score ASC, us.yu_kuai_id ASC
+            LIMIT ?
+        """, (user_id, after_score, after_id, limit))
+        seen = cursor.fetchall()
+        
+        if after_score < 0:
+            unseen = self._get_unseen_rows(conn, user_id, limit)
+        elif after_score == 0:
+            unseen = self._get_unseen_rows(conn, user_id, limit, after_id=after_id)
+        else:
+            unseen = []
+        
+        rows = heapq.merge(seen, unseen, key=lambda row: (row[6], row[0]))
+        return [(self._yu_kuai_from_row(row), row[6]) for row in itertools.islice(rows, limit)]
+    
+    def get_all_yu_kuai_with_scores_page(self, limit: int, after: Optional[Tuple[int, int]] = None,
+                                         user_id: int = DEFAULT_USER_ID) -> List[Tuple[YuKuaiRecord, int]]:
+        """Get a page of YuKuai ordered by score descending, then ID descending
+        
+        Keyset pagination like get_least_learned_yu_kuai_page, walking the
+        same index backwards.
+        """
+        conn = self._get_connection(user_id)
+        cursor = conn.cursor()
+        if after:
             cursor.execute("""
                 SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata, us.score
-                FROM yu_kuai y
-                JOIN user_scores us ON y.id = us.yu_kuai_id
+                FROM user_scores us
+                JOIN yu_kuai y ON y.id = us.yu_kuai_id
+                WHERE us.user_id = ? AND (us.score, us.yu_kuai_id) < (?, ?)
+                ORDER BY us.score DESC, us.yu_kuai_id DESC
+                LIMIT ?
+            """, (user_id, after[0], after[1], limit))
+        else:
+            cursor.execute("""
+                SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata, us.score
+                FROM user_scores us
+                JOIN yu_kuai y ON y.id = us.yu_kuai_id
                 WHERE us.user_id = ?
-                ORDER BY us.score ASC
+                ORDER BY us.score DESC, us.yu_kuai_id DESC
                 LIMIT ?
-            """, (DEFAULT_USER_ID, limit))
-            
-            results = []
-            for row in cursor.fetchall():
-                yu_kuai = YuKuai(
-                    id=row[0],
-                    type=row[1],
-                    canonical_name=row[2],
-                    slug=row[3],
-                    description=row[4],
-                    extra_metadata=json.loads(row[5])
-                )
-                results.append((yu_kuai, row[6]))
-            
-            return results
+            """, (user_id, limit))
+        seen = cursor.fetchall()
+        
+        if not after or after[0] > 0:
+            unseen = self._get_unseen_rows(conn, user_id, limit, descending=True)
+        elif after[0] == 0:
+            unseen = self._get_unseen_rows(conn, user_id, limit, after_id=after[1], descending=True)
+        else:
+            unseen = []
+        
+        rows = heapq.merge(seen, unseen, key=lambda row: (row[6], row[0]), reverse=True)
+        return [(self._yu_kuai_from_row(row), row[6]) for row in itertools.islice(rows, limit)]
+    
+    @staticmethod
+    def _get_unseen_rows(conn: sqlite3.Connection, user_id: int, limit: int,
+                         after_id: Optional[int] = None, descending: bool = False) -> List[tuple]:
+        """Get yu_kuai rows the user has no score row for, in ID order
+        
+        Rows carry a score of 0 and a due time of 0 after the yu_kuai
+        columns, matching the score queries they are merged with.
+        
+        The anti-join walks yu_kuai in ID order and probes the user_scores
+        primary key for each row, so it also steps over every reviewed
+        YuKuai before the limit-th unreviewed one: O((reviewed + limit) log n)
+        in the worst case, not O(limit). No index can skip reviewed rows,
+        since "no score row yet" is not stored anywhere.
+        """
+        where = ""
+        params = [user_id]
+        if after_id is not None:
+            where = "AND y.id < ?" if descending else "AND y.id > ?"
+            params.append(after_id)
+        params.append(limit)
+        
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata, 0, 0
+            FROM yu_kuai y
+            WHERE NOT EXISTS (
+                SELECT 1 FROM user_scores us WHERE us.user_id = ? AND us.yu_kuai_id = y.id
+            ) {where}
+            ORDER BY y.id {"DESC" if descending else "ASC"}
+            LIMIT ?
+        """, params)
+        return cursor.fetchall()
     
-    def update_score(self, yu_kuai_id: int, score_change: int):
-        """Update user score for a YuKuai"""
-        with sqlite3.connect(self.db_path) as conn:
+    @METRICS.timed('db_seconds', op='search')
+    def search(self, query: str, limit: int = 20,
+               user_id: int = DEFAULT_USER_ID) -> List[Tuple[YuKuaiRecord, int]]:
+        """Find YuKuai by Chinese text, English description or pinyin, best match first
+        
+        Chinese in the query matches anywhere in a name; other words match
+        by prefix, with or without tone marks or numbers ("xue", "xué",
+        "xue2", "xuexi"). Every term must match.
+        """
+        match_query = build_match_query(query)
+        if match_query is None:
+            return []
+        
+        conn = self._get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata,
+                   COALESCE(us.score, 0)
+            FROM yu_kuai_fts f
+            JOIN yu_kuai y ON y.id = f.rowid
+            LEFT JOIN user_scores us ON us.yu_kuai_id = y.id AND us.user_id = ?
+            WHERE yu_kuai_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ?
+        """, (user_id, match_query, limit))
+        
+        return [(self._yu_kuai_from_row(row), row[6]) for row in cursor.fetchall()]
+    
+    @staticmethod
+    def _yu_kuai_from_row(row: tuple) -> YuKuaiRecord:
+        """Build a YuKuaiRecord from the first six columns of a yu_kuai row
+        
+        extra_metadata stays as JSON text until someone reads it.
+        """
+        return YuKuaiRecord(row[0], row[1], row[2], row[3], row[4], row[5])
+    
+    @METRICS.timed('db_seconds', op='update_score')
+    def update_score(self, yu_kuai_id: int, score_change: int, user_id: int = DEFAULT_USER_ID):
+        """Update a user's score for a YuKuai, creating the score row if needed"""
+        with self.transaction(user_id) as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                UPDATE user_scores 
-                SET score = MAX(0, score + ?)
-                WHERE user_id = ? AND yu_kuai_id = ?
-            """, (score_change, DEFAULT_USER_ID, yu_kuai_id))
-            conn.commit()
+                INSERT INTO user_scores (user_id, yu_kuai_id, score)
+                VALUES (?, ?, MAX(0, ?))
+                ON CONFLICT(user_id, yu_kuai_id) DO UPDATE SET
+                    score = MAX(0, score + ?)
+                RETURNING score
+            """, (user_id, yu_kuai_id, score_change, score_change))
+            self._score_cache.put((user_id, yu_kuai_id), cursor.fetchone()[0])
     
-    def get_all_yu_kuai_with_scores(self) -> List[Tuple[YuKuai, int]]:
-        """Get all YuKuai with their scores"""
-        with sqlite3.connect(self.db_path) as conn:
+    @METRICS.timed('db_seconds', op='review')
+    def review_yu_kuai(self, yu_kuai_id: int, quality: int, now: Optional[float] = None,
+                       user_id: int = DEFAULT_USER_ID) -> srs.ReviewState:
+        """Record a quiz review and reschedule the YuKuai with SM-2
+        
+        quality is on SM-2's 0-5 scale. The integer score moves +1 for a
+        passing review and -1 otherwise, as update_score does.
+        """
+        now = time.time() if now is None else now
+        with self.transaction(user_id) as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata, us.score
-                FROM yu_kuai y
-                JOIN user_scores us ON y.id = us.yu_kuai_id
-                WHERE us.user_id = ?
-                ORDER BY us.score DESC
-            """, (DEFAULT_USER_ID,))
+                SELECT ease, interval_days, repetitions, due_at FROM user_scores
+                WHERE user_id = ? AND yu_kuai_id = ?
+            """, (user_id, yu_kuai_id))
+            row = cursor.fetchone()
+            state = srs.review(srs.ReviewState(*row) if row else srs.ReviewState(), quality, now)
             
-            results = []
-            for row in cursor.fetchall():
-                yu_kuai = YuKuai(
-                    id=row[0],
-                    type=row[1],
-                    canonical_name=row[2],
-                    slug=row[3],
-                    description=row[4],
-                    extra_metadata=json.loads(row[5])
+            score_change = 1 if quality >= srs.PASSING_QUALITY else -1
+            cursor.execute("""
+                INSERT INTO user_scores (user_id, yu_kuai_id, score, ease, interval_days,
+                                         repetitions, due_at, last_reviewed_at)
+                VALUES (?, ?, MAX(0, ?), ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, yu_kuai_id) DO UPDATE SET
+                    score = MAX(0, score + ?),
+                    ease = excluded.ease,
+                    interval_days = excluded.interval_days,
+                    repetitions = excluded.repetitions,
+                    due_at = excluded.due_at,
+                    last_reviewed_at = excluded.last_reviewed_at
+                RETURNING score
+            """, (user_id, yu_kuai_id, score_change, state.ease, state.interval_days,
+                  state.repetitions, state.due_at, now, score_change))
+            self._score_cache.put((user_id, yu_kuai_id), cursor.fetchone()[0])
+            return state
+    
+    def get_due_yu_kuai(self, limit: int = 5, now: Optional[float] = None,
+                        user_id: int = DEFAULT_USER_ID) -> List[Tuple[YuKuaiRecord, int]]:
+        """Get the next YuKuai due for review, most overdue first
+        
+        Reviewed items that are due come first, so an item the user missed
+        comes back before any new one; YuKuai the user has never reviewed
+        fill the rest of the limit. Reviewed items come from a range scan of
+        the (user_id, due_at, yu_kuai_id) index, costing O(log n + limit).
+        Finding new items is not bounded by limit (see _get_unseen_rows), so
+        with few new items left the cost grows with the number of reviewed
+        items; it is skipped when enough reviews are due.
+        """
+        now = time.time() if now is None else now
+        conn = self._get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata,
+                   us.score, us.due_at
+            FROM user_scores us
+            JOIN yu_kuai y ON y.id = us.yu_kuai_id
+            WHERE us.user_id = ? AND us.due_at <= ?
+            ORDER BY us.due_at ASC, us.yu_kuai_id ASC
+            LIMIT ?
+        """, (user_id, now, limit))
+        rows = cursor.fetchall()
+        if len(rows) < limit:
+            rows += self._get_unseen_rows(conn, user_id, limit - len(rows))
+        return [(self._yu_kuai_from_row(row), row[6]) for row in rows]
+    
+    def get_all_yu_kuai_with_scores(self, user_id: int = DEFAULT_USER_ID) -> List[Tuple[YuKuaiRecord, int]]:
+        """Get all YuKuai with a user's scores"""
+        conn = self._get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT y.id, y.type, y.canonical_name, y.slug, y.description, y.extra_metadata,
+                   COALESCE(us.score, 0) AS score
+            FROM yu_kuai y
+            LEFT JOIN user_scores us ON y.id = us.yu_kuai_id AND us.user_id = ?
+            ORDER BY score DESC
+        """, (user_id,))
+        
+        return [(self._yu_kuai_from_row(row), row[6]) for row in cursor.fetchall()]
+    
+    def add_quiz_questions(self, questions: List[Tuple[int, str]]):
+        """Add (yu_kuai_id, question) pairs to the question pool"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO quiz_questions (yu_kuai_id, question, created_at)
+                VALUES (?, ?, ?)
+            """, [(yu_kuai_id, question, now) for yu_kuai_id, question in questions])
+    
+    def take_quiz_question(self, yu_kuai_id: int) -> Optional[str]:
+        """Remove and return the oldest pooled question for a YuKuai, if any"""
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                DELETE FROM quiz_questions
+                WHERE id = (
+                    SELECT id FROM quiz_questions WHERE yu_kuai_id = ? ORDER BY id LIMIT 1
                 )
-                results.append((yu_kuai, row[6]))
+                RETURNING question
+            """, (yu_kuai_id,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+    
+    def count_quiz_questions(self, yu_kuai_ids: Iterable[int]) -> Dict[int, int]:
+        """Get the number of pooled questions for each YuKuai ID"""
+        ids = list(set(yu_kuai_ids))
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        
+        counts = {yu_kuai_id: 0 for yu_kuai_id in ids}
+        for chunk in _chunked(ids, MAX_SQL_VARIABLES):
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"""
+                SELECT yu_kuai_id, COUNT(*) FROM quiz_questions
+                WHERE yu_kuai_id IN ({placeholders})
+                GROUP BY yu_kuai_id
+            """, chunk)
+            counts.update(cursor.fetchall())
+        return counts
+    
+    def get_or_create_ingest_job(self, file_path: str, file_size: int, file_mtime_ns: int) -> IngestJob:
+        """Get the ingest job for this version of a file, creating it if needed"""
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO ingest_jobs (file_path, file_size, file_mtime_ns, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(file_path, file_size, file_mtime_ns) DO NOTHING
+            """, (file_path, file_size, file_mtime_ns, now, now))
+            cursor.execute("""
+                SELECT id, file_path, resume_offset, resume_seq, status
+                FROM ingest_jobs
+                WHERE file_path = ? AND file_size = ? AND file_mtime_ns = ?
+            """, (file_path, file_size, file_mtime_ns))
+            return IngestJob(*cursor.fetchone())
+    
+    def get_done_sentence_seqs(self, job_id: int, first_seq: int, last_seq: int) -> Set[int]:
+        """Get sequence numbers in [first_seq, last_seq] already parsed successfully"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT seq FROM sentences
+            WHERE job_id = ? AND seq BETWEEN ? AND ? AND status = 'done'
+        """, (job_id, first_seq, last_seq))
+        return {row[0] for row in cursor.fetchall()}
+    
+    @METRICS.timed('db_seconds', op='record_sentence')
+    def record_sentence(self, job_id: int, seq: int, text: str, end_offset: int,
+                        yu_kuai_ids: Optional[List[int]] = None, error: Optional[str] = None) -> int:
+        """Store a sentence outcome for a job, returns the sentence ID
+        
+        Pass yu_kuai_ids for a parsed sentence or error for a failed one.
+        Recording the same seq again (a retry) replaces the earlier outcome.
+        """
+        status = 'failed' if error is not None else 'done'
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO sentences (job_id, seq, text, end_offset, status, error)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(job_id, seq) DO UPDATE SET
+                    text = excluded.text,
+                    end_offset = excluded.end_offset,
+                    status = excluded.status,
+                    error = excluded.error
+                RETURNING id
+            """, (job_id, seq, text, end_offset, status, error))
+            sentence_id = cursor.fetchone()[0]
             
-            return results
+            cursor.execute("DELETE FROM sentence_yu_kuai WHERE sentence_id = ?", (sentence_id,))
+            cursor.executemany("""
+                INSERT INTO sentence_yu_kuai (sentence_id, position, yu_kuai_id)
+                VALUES (?, ?, ?)
+            """, [(sentence_id, position, yu_kuai_id)
+                  for position, yu_kuai_id in enumerate(yu_kuai_ids or [])])
+            return sentence_id
     
-    def get_yu_kuai_score(self, yu_kuai_id: int) -> int:
-        """Get the score for a specific YuKuai"""
-        with sqlite3.connect(self.db_path) as conn:
+    def get_job_sentences(self, job_id: int) -> List[Tuple[int, str, Optional[List[int]]]]:
+        """Get (seq, text, yu_kuai_ids) for every sentence of a job, in order
+        
+        yu_kuai_ids is None for sentences that failed to parse.
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT s.id, sy.yu_kuai_id
+            FROM sentences s
+            JOIN sentence_yu_kuai sy ON sy.sentence_id = s.id
+            WHERE s.job_id = ?
+            ORDER BY s.id, sy.position
+        """, (job_id,))
+        yu_kuai_ids: Dict[int, List[int]] = {}
+        for sentence_id, yu_kuai_id in cursor.fetchall():
+            yu_kuai_ids.setdefault(sentence_id, []).append(yu_kuai_id)
+        
+        cursor.execute("""
+            SELECT id, seq, text, status FROM sentences
+            WHERE job_id = ? ORDER BY seq
+        """, (job_id,))
+        return [(seq, text, yu_kuai_ids.get(sentence_id, []) if status == 'done' else None)
+                for sentence_id, seq, text, status in cursor.fetchall()]
+
+    @METRICS.timed('db_seconds', op='checkpoint')
+    def advance_ingest_job(self, job_id: int):
+        """Move the job's resume point past every sentence that is done
+        
+        The resume point stops just before the first failed sentence, so a
+        rerun re-reads from there and retries it.
+        """
+        with self.transaction() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT score FROM user_scores 
-                WHERE user_id = ? AND yu_kuai_id = ?
-            """, (DEFAULT_USER_ID, yu_kuai_id))
-            result = cursor.fetchone()
-            return result[0] if result else 0
+                SELECT resume_seq FROM ingest_jobs WHERE id = ?
+            """, (job_id,))
+            resume_seq = cursor.fetchone()[0]
+            
+            cursor.execute("""
+                SELECT MIN(seq) FROM sentences
+                WHERE job_id = ? AND seq >= ? AND status = 'failed'
+            """, (job_id, resume_seq))
+            first_failed = cursor.fetchone()[0]
+            
+            if first_failed is None:
+                cursor.execute("""
+                    SELECT seq, end_offset FROM sentences
+                    WHERE job_id = ? ORDER BY seq DESC LIMIT 1
+                """, (job_id,))
+            else:
+                cursor.execute("""
+                    SELECT seq, end_offset FROM sentences
+                    WHERE job_id = ? AND seq < ? ORDER BY seq DESC LIMIT 1
+                """, (job_id, first_failed))
+            row = cursor.fetchone()
+            if row is None or row[0] < resume_seq:
+                return
+            
+            cursor.execute("""
+                UPDATE ingest_jobs
+                SET resume_seq = ?, resume_offset = ?, updated_at = ?
+                WHERE id = ?
+            """, (row[0] + 1, row[1], time.time(), job_id))
+    
+    def complete_ingest_job(self, job_id: int):
+        """Mark a job as having read its whole file"""
+        with self.transaction() as conn:
+            conn.execute("""
+                UPDATE ingest_jobs SET status = 'completed', updated_at = ? WHERE id = ?
+            """, (time.time(), job_id))
+    
+    def get_yu_kuai_score(self, yu_kuai_id: int, user_id: int = DEFAULT_USER_ID) -> int:
+        """Get a user's score for a specific YuKuai, 0 if they never reviewed it"""
+        score = self._score_cache.get((user_id, yu_kuai_id))
+        if score is not None:
+            return score
+        
+        conn = self._get_connection(user_id)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT score FROM user_scores 
+            WHERE user_id = ? AND yu_kuai_id = ?
+        """, (user_id, yu_kuai_id))
+        result = cursor.fetchone()
+        score = result[0] if result else 0
+        self._score_cache.put((user_id, yu_kuai_id), score)
+        return score
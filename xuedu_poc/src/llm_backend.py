@@ -0,0 +1,130 @@
+"""
+Chat completion backends for the XueDu Chinese Learning App
+"""
+
+import abc
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Dict, List
+
+# Numbered lines of the batch parse and batch quiz prompts, e.g. "0: 你好"
+NUMBERED_LINE = re.compile(r'^(\d+): (.*)$', re.MULTILINE)
+SINGLE_SENTENCE = re.compile(r'^Sentence: "(.*)"$', re.MULTILINE)
+QUESTION_COUNT = re.compile(r'^Generate (\d+) different', re.MULTILINE)
+YU_KUAI_NAME = re.compile(r'^YuKuai: (.*) \(', re.MULTILINE)
+CJK_CHAR = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+class LLMBackend(abc.ABC):
+    """A chat completion service that LLMParser sends its requests to.
+
+    A request is a dict of OpenAI-style chat completion arguments: model,
+    messages, temperature, max_tokens and optionally response_format.
+    Implementations return the text of the reply and raise on failure.
+    """
+
+    @abc.abstractmethod
+    def complete(self, request: Dict) -> str:
+        """Send request and return the text of the reply"""
+
+    async def complete_async(self, request: Dict) -> str:
+        """Async counterpart of complete; blocks the event loop unless overridden"""
+        return self.complete(request)
+
+    async def aclose(self):
+        """Release anything bound to the running event loop"""
+
+class OpenAIBackend(LLMBackend):
+    """The OpenAI API, through the official client; raises ImportError without it"""
+
+    def __init__(self, api_key: str):
+        import openai
+        self._openai = openai
+        self.api_key = api_key
+        self.client = openai.OpenAI(api_key=api_key)
+        self.async_client = None
+
+    def complete(self, request: Dict) -> str:
+        response = self.client.chat.completions.create(**request)
+        return response.choices[0].message.content
+
+    async def complete_async(self, request: Dict) -> str:
+        if self.async_client is None:
+            self.async_client = self._openai.AsyncOpenAI(api_key=self.api_key)
+        response = await self.async_client.chat.completions.create(**request)
+        return response.choices[0].message.content
+
+    async def aclose(self):
+        """Close the async client; it is bound to the event loop that created it"""
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = None
+
+class FakeBackend(LLMBackend):
+    """Deterministic local stand-in for the LLM, for benchmarks and offline runs.
+
+    Replies are derived from the prompt alone: each sentence yields up to
+    yu_kuai_per_sentence vocab YuKuai, one per distinct pair of adjacent
+    Chinese characters, so a corpus reuses vocab the way real text does.
+    Grammar-only requests find nothing.
+    Every request sleeps for latency seconds, and fails with probability
+    error_rate; whether a given prompt fails depends only on it and seed.
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0,
+                 yu_kuai_per_sentence: int = 3, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.yu_kuai_per_sentence = yu_kuai_per_sentence
+        self.seed = seed
+        self.request_count = 0
+        self.error_count = 0
+
+    def complete(self, request: Dict) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._reply(request)
+
+    async def complete_async(self, request: Dict) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._reply(request)
+
+    def _reply(self, request: Dict) -> str:
+        prompt = request["messages"][0]["content"]
+        self.request_count += 1
+        if random.Random(f"{self.seed}:{prompt}").random() < self.error_rate:
+            self.error_count += 1
+            raise RuntimeError("Fake LLM error")
+
+        if "comprehension question" in prompt:
+            count = QUESTION_COUNT.search(prompt)
+            if count is None:
+                return f"「{YU_KUAI_NAME.search(prompt).group(1)}」是什么意思？"
+            return json.dumps({
+                number: [f"「{line.split(' (')[0]}」是什么意思？({k + 1})" for k in range(int(count.group(1)))]
+                for number, line in NUMBERED_LINE.findall(prompt)
+            }, ensure_ascii=False)
+
+        if "do not list vocabulary" in prompt:
+            # Vocab is all the fake backend knows, so there is no grammar to find
+            return json.dumps({number: [] for number, _ in NUMBERED_LINE.findall(prompt)})
+        
+        single = SINGLE_SENTENCE.search(prompt)
+        if single:
+            return json.dumps(self._yu_kuai_items(single.group(1)), ensure_ascii=False)
+        return json.dumps({number: self._yu_kuai_items(sentence)
+                           for number, sentence in NUMBERED_LINE.findall(prompt)}, ensure_ascii=False)
+
+    def _yu_kuai_items(self, sentence: str) -> List[Dict]:
+        chars = [ch for ch in sentence if CJK_CHAR.match(ch)]
+        words = list(dict.fromkeys(a + b for a, b in zip(chars, chars[1:])))
+        return [{
+            "type": "vocab",
+            "canonical_name": word,
+            "slug": "fake_" + "_".join(f"{ord(ch):x}" for ch in word),
+            "description": f"fake definition of {word}",
+            "extra_metadata": {"source": "fake"}
+        } for word in words[:self.yu_kuai_per_sentence]]
@@ -0,0 +1,124 @@
+"""
+On-disk cache of LLM responses for the XueDu Chinese Learning App
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+# Eviction defaults
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_MAX_AGE_SECONDS = 90 * 24 * 60 * 60
+EVICT_EVERY_N_PUTS = 500
+
+class LLMCache:
+    """Content-addressed SQLite cache for LLM completions.
+
+    Entries are keyed by a hash of the model, the prompt template version and
+    the input text, so changing either the model or the prompt naturally
+    misses instead of serving stale output.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA busy_timeout = 5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used_at)"
+        )
+
+    @staticmethod
+    def make_key(model: str, prompt_version: str, text: str) -> str:
+        """Build the cache key for a model, prompt template version and input"""
+        payload = "\0".join((model, prompt_version, text)).encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE llm_cache SET last_used_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """Store a response, evicting old entries periodically"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO llm_cache (key, value, created_at, last_used_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    value = excluded.value,
+                    created_at = excluded.created_at,
+                    last_used_at = excluded.last_used_at
+            """, (key, value, now, now))
+
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= EVICT_EVERY_N_PUTS:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the least recently used beyond max_entries"""
+        self._puts_since_evict = 0
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (now - self.max_age_seconds,)
+        )
+        self._conn.execute("""
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache
+                ORDER BY last_used_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def evict(self):
+        """Run eviction immediately"""
+        with self._lock:
+            self._evict(time.time())
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current entry count"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+        }
+
+    def close(self):
+        """Close the cache database"""
+        self._conn.close()
@@ -4,87 +4,535 @@ LLM integration and parsing for the XueDu Chinese Learning App
 
 import json
 import os
-from typing import List
+from typing import Dict, List, Optional, Union
 from models import YuKuai
+from llm_backend import LLMBackend, OpenAIBackend
+from llm_cache import LLMCache
+from metrics import METRICS
+from rate_limiter import find_rate_limit_error
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
 load_dotenv()
 
+# Model and prompt template version; bump the version whenever the parse
+# prompt changes so cached responses from the old prompt are not reused
+MODEL = "gpt-4o-mini"
+PARSE_PROMPT_VERSION = "parse-v1"
+PARSE_MAX_TOKENS = 1000
+
+# Multi-sentence batches: sentences are packed into one request until either
+# the input budget or the expected output would overflow a single completion
+BATCH_PARSE_PROMPT_VERSION = "batch-parse-v1"
+BATCH_INPUT_TOKEN_BUDGET = 2000
+BATCH_OUTPUT_TOKENS_PER_SENTENCE = 600
+BATCH_MAX_OUTPUT_TOKENS = 16000
+BATCH_MAX_SENTENCES = BATCH_MAX_OUTPUT_TOKENS // BATCH_OUTPUT_TOKENS_PER_SENTENCE
+
+# Grammar-only batches, for sentences whose vocab is all known already; the
+# reply lists only grammar patterns, so it is much shorter than a full parse
+GRAMMAR_PROMPT_VERSION = "grammar-v1"
+GRAMMAR_OUTPUT_TOKENS_PER_SENTENCE = 150
+
+# Quiz questions generated per request when filling the question pool
+QUIZ_BATCH_TOKENS_PER_QUESTION = 80
+
+YU_KUAI_FIELDS = """- type: "vocab" or "grammar"
+- canonical_name: Chinese name with disambiguation if needed (e.g., "闻 (古义)")
+- slug: ASCII-only unique identifier (e.g., "wen_ancient")
+- description: learner-friendly explanation in English
+- extra_metadata: JSON object with pinyin, HSK level, examples, etc."""
+
+# YuKuai types the LLM may return; the prompts only ask for these
+YU_KUAI_TYPES = ('vocab', 'grammar')
+
+# A parsed sentence, or the error that prevented parsing it
+ParseOutcome = Union[List[YuKuai], RuntimeError]
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: ~4 ASCII characters or ~1 CJK character per token"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
 class LLMParser:
-    """Handles LLM integration for parsing Chinese text into YuKuai"""
+    """Handles LLM integration for parsing Chinese text into YuKuai
     
-    def __init__(self):
+    Requests go to backend, which defaults to the OpenAI API when
+    OPENAI_API_KEY is set; without a backend every request fails.
+    """
+    
+    def __init__(self, cache: Optional[LLMCache] = None, backend: Optional[LLMBackend] = None):
+        self.cache = cache
+        self.backend = backend
+        if backend is not None:
+            return
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             print("Warning: OPENAI_API_KEY not found in environment variables.")
             print("LLM parsing will not work. Please set your OpenAI API key.")
-            self.client = None
         else:
             try:
-                import openai
-                self.client = openai.OpenAI(api_key=api_key)
+                self.backend = OpenAIBackend(api_key)
             except ImportError:
                 print("Warning: openai package not installed. LLM parsing will not work.")
-                self.client = None
     
     def parse_sentence(self, sentence: str) -> List[YuKuai]:
         """Parse a Chinese sentence into YuKuai using LLM"""
-        if not self.client:
+        cache_key = LLMCache.make_key(MODEL, PARSE_PROMPT_VERSION, sentence)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
+        if not self.backend:
             raise RuntimeError("LLM client not available. Please set OPENAI_API_KEY in your .env file or as an environment variable.")
         
         try:
-            prompt = f"""You are a Chinese learning assistant.
+            content = self._complete(self._parse_request(sentence), 'parse')
+            return self._handle_parse_response(content, cache_key)
+                
+        except Exception as e:
+            raise RuntimeError(f"LLM parsing failed: {e}") from e
+    
+    async def parse_sentence_async(self, sentence: str) -> List[YuKuai]:
+        """Parse a Chinese sentence into YuKuai using the async LLM client"""
+        cache_key = LLMCache.make_key(MODEL, PARSE_PROMPT_VERSION, sentence)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
+        if not self.backend:
+            raise RuntimeError("LLM client not available. Please set OPENAI_API_KEY in your .env file or as an environment variable.")
+        
+        try:
+            content = await self._complete_async(self._parse_request(sentence), 'parse')
+            return self._handle_parse_response(content, cache_key)
+        
+        except Exception as e:
+            raise RuntimeError(f"LLM parsing failed: {e}") from e
+    
+    def _complete(self, request: dict, kind: str) -> str:
+        """Send a request to the backend, timing it and counting failures by kind"""
+        try:
+            with METRICS.time('llm_request_seconds', kind=kind):
+                return self.backend.complete(request)
+        except Exception:
+            METRICS.inc('llm_errors_total', kind=kind)
+            raise
+    
+    async def _complete_async(self, request: dict, kind: str) -> str:
+        """Async counterpart of _complete"""
+        try:
+            with METRICS.time('llm_request_seconds', kind=kind):
+                return await self.backend.complete_async(request)
+        except Exception:
+            METRICS.inc('llm_errors_total', kind=kind)
+            raise
+    
+    async def aclose(self):
+        """Release the backend's async resources; they are bound to the event loop that created them"""
+        if self.backend is not None:
+            await self.backend.aclose()
+    
+    @classmethod
+    def _parse_request(cls, sentence: str) -> dict:
+        """Chat completion arguments for parsing a single sentence"""
+        return dict(
+            model=MODEL,
+            messages=[{"role": "user", "content": cls._build_parse_prompt(sentence)}],
+            temperature=0.3,
+            max_tokens=PARSE_MAX_TOKENS
+        )
+    
+    def parse_sentences(self, sentences: List[str]) -> List[ParseOutcome]:
+        """Parse many sentences with as few LLM requests as possible.
+        
+        Sentences are served from the cache where possible and the rest are
+        packed into token-budgeted batches. A batch whose response is not
+        valid JSON (or misses sentences) is split in half and retried, down
+        to single-sentence requests. Returns one outcome per input sentence.
+        """
+        outcomes, batches = self._start_batches(sentences)
+        for batch in batches:
+            self._parse_batch(sentences, batch, outcomes)
+        return outcomes
+    
+    async def parse_sentences_async(self, sentences: List[str]) -> List[ParseOutcome]:
+        """Async counterpart of parse_sentences"""
+        outcomes, batches = self._start_batches(sentences)
+        for batch in batches:
+            await self._parse_batch_async(sentences, batch, outcomes)
+        return outcomes
+    
+    def detect_grammar(self, sentences: List[str]) -> List[ParseOutcome]:
+        """Find only the grammar YuKuai of sentences whose vocab is already known
+        
+        Sentences are cached and batched like parse_sentences, but with a
+        prompt that skips vocab. A sentence missing from a malformed reply is
+        not retried; it fails, so a rerun tries it again. Returns one outcome
+        per input sentence.
+        """
+        outcomes, batches = self._start_batches(sentences, GRAMMAR_PROMPT_VERSION)
+        for batch in batches:
+            if not self.backend:
+                content = RuntimeError("LLM client not available. Please set OPENAI_API_KEY in your .env file or as an environment variable.")
+            else:
+                try:
+                    content = self._complete(self._grammar_request(sentences, batch), 'grammar')
+                except Exception as e:
+                    content = RuntimeError(f"LLM grammar detection failed: {e}")
+            self._apply_grammar_response(content, sentences, batch, outcomes)
+        return outcomes
+    
+    async def detect_grammar_async(self, sentences: List[str]) -> List[ParseOutcome]:
+        """Async counterpart of detect_grammar"""
+        outcomes, batches = self._start_batches(sentences, GRAMMAR_PROMPT_VERSION)
+        for batch in batches:
+            if not self.backend:
+                content = RuntimeError("LLM client not available. Please set OPENAI_API_KEY in your .env file or as an environment variable.")
+            else:
+                try:
+                    content = await self._complete_async(self._grammar_request(sentences, batch), 'grammar')
+                except Exception as e:
+                    # Let rate limits reach the scheduler so the whole batch is retried
+                    if find_rate_limit_error(e):
+                        raise
+                    content = RuntimeError(f"LLM grammar detection failed: {e}")
+            self._apply_grammar_response(content, sentences, batch, outcomes)
+        return outcomes
+    
+    @staticmethod
+    def plan_batches(sentences: List[str]) -> List[List[int]]:
+        """Greedily group sentence indices under the batch token budgets"""
+        batches = []
+        current: List[int] = []
+        current_tokens = 0
+        for i, sentence in enumerate(sentences):
+            tokens = estimate_tokens(sentence)
+            if current and (current_tokens + tokens > BATCH_INPUT_TOKEN_BUDGET
+                            or len(current) >= BATCH_MAX_SENTENCES):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    def estimate_batch_tokens(self, sentences: List[str]) -> int:
+        """Estimate the rate-limit cost of parsing sentences as one batch"""
+        return (estimate_tokens(self._build_batch_prompt(sentences))
+                + self._batch_max_tokens(len(sentences)))
+    
+    def estimate_grammar_tokens(self, sentences: List[str]) -> int:
+        """Estimate the rate-limit cost of detecting grammar in sentences as one batch"""
+        return (estimate_tokens(self._build_grammar_prompt(sentences))
+                + self._grammar_max_tokens(len(sentences)))
+    
+    @staticmethod
+    def _batch_max_tokens(count: int) -> int:
+        """Output token allowance for a batch of count sentences"""
+        return min(BATCH_MAX_OUTPUT_TOKENS, PARSE_MAX_TOKENS + count * BATCH_OUTPUT_TOKENS_PER_SENTENCE)
+    
+    @staticmethod
+    def _grammar_max_tokens(count: int) -> int:
+        """Output token allowance for a grammar-only batch of count sentences"""
+        return min(BATCH_MAX_OUTPUT_TOKENS, PARSE_MAX_TOKENS + count * GRAMMAR_OUTPUT_TOKENS_PER_SENTENCE)
+    
+    def _start_batches(self, sentences: List[str], prompt_version: str = BATCH_PARSE_PROMPT_VERSION):
+        """Fill outcomes from the cache and plan batches for the misses"""
+        outcomes: List[Optional[ParseOutcome]] = [None] * len(sentences)
+        misses = []
+        for i, sentence in enumerate(sentences):
+            cached = self._get_cached(LLMCache.make_key(MODEL, prompt_version, sentence))
+            if cached is not None:
+                outcomes[i] = cached
+            else:
+                misses.append(i)
+        
+        batches = [[misses[j] for j in batch]
+                   for batch in self.plan_batches([sentences[i] for i in misses])]
+        return outcomes, batches
+    
+    def _batch_request(self, sentences: List[str], batch: List[int]) -> dict:
+        """Chat completion arguments for a batch of sentence indices"""
+        return dict(
+            model=MODEL,
+            messages=[{"role": "user", "content": self._build_batch_prompt([sentences[i] for i in batch])}],
+            temperature=0.3,
+            max_tokens=self._batch_max_tokens(len(batch)),
+            response_format={"type": "json_object"}
+        )
+    
+    def _grammar_request(self, sentences: List[str], batch: List[int]) -> dict:
+        """Chat completion arguments for detecting grammar in a batch of sentence indices"""
+        return dict(
+            model=MODEL,
+            messages=[{"role": "user", "content": self._build_grammar_prompt([sentences[i] for i in batch])}],
+            temperature=0.3,
+            max_tokens=self._grammar_max_tokens(len(batch)),
+            response_format={"type": "json_object"}
+        )
+    
+    def _parse_batch(self, sentences: List[str], batch: List[int], outcomes: List[Optional[ParseOutcome]]):
+        """Parse one batch, splitting it on malformed output"""
+        if len(batch) == 1:
+            outcomes[batch[0]] = self._parse_single(sentences[batch[0]])
+            return
+        
+        if not self.backend:
+            error = RuntimeError("LLM client not available. Please set OPENAI_API_KEY in your .env file or as an environment variable.")
+            for i in batch:
+                outcomes[i] = error
+            return
+        
+        try:
+            content = self._complete(self._batch_request(sentences, batch), 'batch')
+        except Exception as e:
+            error = RuntimeError(f"LLM parsing failed: {e}")
+            for i in batch:
+                outcomes[i] = error
+            return
+        
+        missing = self._apply_batch_response(content, sentences, batch, outcomes)
+        if missing:
+            middle = len(missing) // 2
+            for half in (missing[:middle], missing[middle:]):
+                if half:
+                    self._parse_batch(sentences, half, outcomes)
+    
+    async def _parse_batch_async(self, sentences: List[str], batch: List[int], outcomes: List[Optional[ParseOutcome]]):
+        """Async counterpart of _parse_batch"""
+        if len(batch) == 1:
+            try:
+                outcomes[batch[0]] = await self.parse_sentence_async(sentences[batch[0]])
+            except RuntimeError as e:
+                if find_rate_limit_error(e):
+                    raise
+                outcomes[batch[0]] = e
+            return
+        
+        if not self.backend:
+            error = RuntimeError("LLM client not available. Please set OPENAI_API_KEY in your .env file or as an environment variable.")
+            for i in batch:
+                outcomes[i] = error
+            return
+        
+        try:
+            content = await self._complete_async(self._batch_request(sentences, batch), 'batch')
+        except Exception as e:
+            # Let rate limits reach the scheduler so the whole batch is retried
+            if find_rate_limit_error(e):
+                raise
+            error = RuntimeError(f"LLM parsing failed: {e}")
+            for i in batch:
+                outcomes[i] = error
+            return
+        
+        missing = self._apply_batch_response(content, sentences, batch, outcomes)
+        if missing:
+            middle = len(missing) // 2
+            for half in (missing[:middle], missing[middle:]):
+                if half:
+                    await self._parse_batch_async(sentences, half, outcomes)
+    
+    def _parse_single(self, sentence: str) -> ParseOutcome:
+        """Parse one sentence with the single-sentence prompt, capturing errors"""
+        try:
+            return self.parse_sentence(sentence)
+        except RuntimeError as e:
+            return e
+    
+    def _apply_batch_response(self, content: str, sentences: List[str], batch: List[int],
+                              outcomes: List[Optional[ParseOutcome]]) -> List[int]:
+        """Store every well-formed per-sentence result, returning the indices still missing"""
+        by_number = self._decode_numbered(content, 'batch')
+        missing = []
+        for position, i in enumerate(batch):
+            try:
+                items = self._clean_items(by_number.get(str(position)))
+            except ValueError:
+                # Retried in a smaller batch, and failed if it stays invalid
+                missing.append(i)
+                continue
+            outcomes[i] = self._yu_kuai_from_items(items)
+            if self.cache:
+                key = LLMCache.make_key(MODEL, BATCH_PARSE_PROMPT_VERSION, sentences[i])
+                self.cache.put(key, json.dumps(items, ensure_ascii=False))
+        return missing
+    
+    def _apply_grammar_response(self, content: Union[str, RuntimeError], sentences: List[str], batch: List[int],
+                                outcomes: List[Optional[ParseOutcome]]):
+        """Store the grammar YuKuai of every sentence in a reply, failing the ones it misses"""
+        if isinstance(content, RuntimeError):
+            for i in batch:
+                outcomes[i] = content
+            return
+        
+        by_number = self._decode_numbered(content, 'grammar')
+        for position, i in enumerate(batch):
+            items = by_number.get(str(position))
+            if not isinstance(items, list):
+                outcomes[i] = RuntimeError(f"LLM grammar detection returned no result for: {sentences[i]}")
+                continue
+            try:
+                # The vocab is known already; keep only what the prompt asked for
+                items = self._clean_items([item for item in items
+                                           if isinstance(item, dict) and item.get('type') == 'grammar'])
+            except ValueError as e:
+                outcomes[i] = RuntimeError(f"LLM grammar detection returned an invalid result for {sentences[i]}: {e}")
+                continue
+            outcomes[i] = self._yu_kuai_from_items(items)
+            if self.cache:
+                key = LLMCache.make_key(MODEL, GRAMMAR_PROMPT_VERSION, sentences[i])
+                self.cache.put(key, json.dumps(items, ensure_ascii=False))
+    
+    @staticmethod
+    def _decode_numbered(content: str, kind: str) -> Dict[str, list]:
+        """Decode a reply mapping sentence numbers to YuKuai, empty if it is malformed"""
+        if not isinstance(content, str):
+            return {}
+        try:
+            with METRICS.time('json_parse_seconds', kind=kind):
+                by_number = json.loads(content.strip())
+        except json.JSONDecodeError:
+            return {}
+        return by_number if isinstance(by_number, dict) else {}
+    
+    def estimate_parse_tokens(self, sentence: str) -> int:
+        """Estimate the rate-limit cost of parsing a sentence"""
+        return estimate_tokens(self._build_parse_prompt(sentence)) + PARSE_MAX_TOKENS
+    
+    def _get_cached(self, cache_key: str) -> Optional[List[YuKuai]]:
+        """Return cached YuKuai for a prompt key, if any
+        
+        Entries cached before replies were checked may be invalid; those
+        count as misses so the sentence is parsed again.
+        """
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                try:
+                    return self._parse_yu_kuai_json(cached)
+                except ValueError:
+                    return None
+        return None
+    
+    def _handle_parse_response(self, content: str, cache_key: str) -> List[YuKuai]:
+        """Decode a parse completion, caching it only if every item is valid"""
+        if not isinstance(content, str):
+            raise RuntimeError(f"LLM returned no content: {content!r}")
+        content = content.strip()
+        
+        try:
+            with METRICS.time('json_parse_seconds', kind='parse'):
+                items = self._clean_items(json.loads(content))
+        except json.JSONDecodeError:
+            raise RuntimeError(f"Failed to parse LLM response as JSON: {content}")
+        except ValueError as e:
+            raise RuntimeError(f"LLM response has an invalid YuKuai: {e}")
+        
+        if self.cache:
+            self.cache.put(cache_key, json.dumps(items, ensure_ascii=False))
+        return self._yu_kuai_from_items(items)
+    
+    @staticmethod
+    def _build_parse_prompt(sentence: str) -> str:
+        """Build the YuKuai extraction prompt for a sentence"""
+        return f"""You are a Chinese learning assistant.
 Given a Chinese sentence, extract vocabulary and grammar YuKuai.
 For each YuKuai, return a JSON array with objects containing:
-- type: "vocab" or "grammar"
-- canonical_name: Chinese name with disambiguation if needed (e.g., "闻 (古义)")
-- slug: ASCII-only unique identifier (e.g., "wen_ancient")
-- description: learner-friendly explanation in English
-- extra_metadata: JSON object with pinyin, HSK level, examples, etc.
+{YU_KUAI_FIELDS}
 
 Sentence: "{sentence}"
 
 Return only valid JSON array."""
+    
+    @staticmethod
+    def _build_batch_prompt(sentences: List[str]) -> str:
+        """Build the YuKuai extraction prompt for several numbered sentences"""
+        numbered = "\n".join(f"{i}: {sentence}" for i, sentence in enumerate(sentences))
+        return f"""You are a Chinese learning assistant.
+Given numbered Chinese sentences, extract vocabulary and grammar YuKuai from each one.
+Describe each YuKuai with an object containing:
+{YU_KUAI_FIELDS}
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-                max_tokens=1000
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Try to parse JSON response
-            try:
-                yu_kuai_data = json.loads(content)
-                yu_kuai_list = []
-                
-                for item in yu_kuai_data:
-                    yu_kuai = YuKuai(
-                        id=None,
-                        type=item.get('type', 'vocab'),
-                        canonical_name=item.get('canonical_name', ''),
-                        slug=item.get('slug', ''),
-                        description=item.get('description', ''),
-                        extra_metadata=item.get('extra_metadata', {})
-                    )
-                    yu_kuai_list.append(yu_kuai)
-                
-                return yu_kuai_list
-                
-            except json.JSONDecodeError:
-                raise RuntimeError(f"Failed to parse LLM response as JSON: {content}")
-                
-        except Exception as e:
-            raise RuntimeError(f"LLM parsing failed: {e}")
+Sentences:
+{numbered}
+
+Return only a valid JSON object mapping every sentence number (as a string) to
+the JSON array of YuKuai for that sentence, e.g. {{"0": [...], "1": [...]}}."""
     
+    @staticmethod
+    def _build_grammar_prompt(sentences: List[str]) -> str:
+        """Build the grammar-only extraction prompt for several numbered sentences"""
+        numbered = "\n".join(f"{i}: {sentence}" for i, sentence in enumerate(sentences))
+        return f"""You are a Chinese learning assistant.
+Given numbered Chinese sentences whose vocabulary is already known, find only the
+grammar patterns used in each one; do not list vocabulary.
+Describe each grammar YuKuai with an object containing:
+{YU_KUAI_FIELDS}
 
+Sentences:
+{numbered}
+
+Return only a valid JSON object mapping every sentence number (as a string) to
+the JSON array of grammar YuKuai for that sentence, empty if it has none,
+e.g. {{"0": [...], "1": []}}."""
+    
+    @staticmethod
+    def _parse_yu_kuai_json(content: str) -> List[YuKuai]:
+        """Convert a JSON array of YuKuai objects into YuKuai instances
+        
+        Raises ValueError (a JSONDecodeError if it is not JSON) if content
+        is not a valid list of YuKuai.
+        """
+        with METRICS.time('json_parse_seconds', kind='parse'):
+            yu_kuai_data = json.loads(content)
+        return LLMParser._yu_kuai_from_items(LLMParser._clean_items(yu_kuai_data))
+    
+    @staticmethod
+    def _clean_items(items) -> List[dict]:
+        """Check decoded YuKuai objects, returning them with only the known fields
+        
+        Raises ValueError unless items is a list of objects whose type is
+        one of YU_KUAI_TYPES, whose canonical_name, slug and description
+        are non-empty strings and whose extra_metadata, if given, is an
+        object. Such items would otherwise be cached and then fail every
+        time they are stored.
+        """
+        if not isinstance(items, list):
+            raise ValueError(f"expected a list of YuKuai, got {type(items).__name__}")
+        cleaned = []
+        for item in items:
+            if not isinstance(item, dict):
+                raise ValueError(f"expected a YuKuai object, got {item!r}")
+            if item.get('type') not in YU_KUAI_TYPES:
+                raise ValueError(f"unknown YuKuai type {item.get('type')!r}")
+            fields = {}
+            for field in ('canonical_name', 'slug', 'description'):
+                value = item.get(field)
+                if not isinstance(value, str) or not value.strip():
+                    raise ValueError(f"YuKuai {field} must be a non-empty string, got {value!r}")
+                fields[field] = value.strip()
+            extra_metadata = item.get('extra_metadata')
+            if extra_metadata is None:
+                extra_metadata = {}
+            if not isinstance(extra_metadata, dict):
+                raise ValueError(f"YuKuai extra_metadata must be an object, got {extra_metadata!r}")
+            cleaned.append(dict(type=item['type'], extra_metadata=extra_metadata, **fields))
+        return cleaned
+    
+    @staticmethod
+    def _yu_kuai_from_items(items: List[dict]) -> List[YuKuai]:
+        """Build YuKuai instances from items checked by _clean_items"""
+        return [YuKuai(id=None, type=item['type'], canonical_name=item['canonical_name'],
+                       slug=item['slug'], description=item['description'],
+                       extra_metadata=item['extra_metadata'])
+                for item in items]
     
     def generate_quiz_question(self, yu_kuai: YuKuai) -> str:
         """Generate a quiz question for a YuKuai using LLM"""
-        if not self.client:
+        if not self.backend:
             raise RuntimeError("LLM client not available. Please set OPENAI_API_KEY in your .env file or as an environment variable.")
         
         try:
@@ -96,14 +544,57 @@ Description: {yu_kuai.description}
 
 Return just the question string in Chinese."""
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
+            content = self._complete(dict(
+                model=MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.7,
                 max_tokens=200
-            )
+            ), 'quiz')
             
-            return response.choices[0].message.content.strip()
+            return content.strip()
             
         except Exception as e:
             raise RuntimeError(f"Quiz generation failed: {e}")
+    
+    def generate_quiz_questions(self, yu_kuai_list: List[YuKuai], per_yu_kuai: int) -> List[List[str]]:
+        """Generate several quiz questions for each of many YuKuai in one request
+        
+        Returns the questions for each YuKuai in input order; a YuKuai the
+        model skipped gets an empty list.
+        """
+        if not self.backend:
+            raise RuntimeError("LLM client not available. Please set OPENAI_API_KEY in your .env file or as an environment variable.")
+        if not yu_kuai_list:
+            return []
+        
+        numbered = "\n".join(
+            f"{i}: {yu_kuai.canonical_name} ({yu_kuai.type}) - {yu_kuai.description}"
+            for i, yu_kuai in enumerate(yu_kuai_list)
+        )
+        prompt = f"""Generate {per_yu_kuai} different simple comprehension questions in Chinese
+for each numbered YuKuai below, each testing understanding of that YuKuai:
+
+{numbered}
+
+Return only a valid JSON object mapping every YuKuai number (as a string) to
+a JSON array of question strings, e.g. {{"0": ["...", "..."], "1": ["...", "..."]}}."""
+        
+        try:
+            content = self._complete(dict(
+                model=MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=QUIZ_BATCH_TOKENS_PER_QUESTION * per_yu_kuai * len(yu_kuai_list),
+                response_format={"type": "json_object"}
+            ), 'quiz_batch')
+            with METRICS.time('json_parse_seconds', kind='quiz_batch'):
+                questions = json.loads(content)
+        except Exception as e:
+            raise RuntimeError(f"Quiz generation failed: {e}")
+        
+        results = []
+        for i in range(len(yu_kuai_list)):
+            items = questions.get(str(i)) if isinstance(questions, dict) else None
+            results.append([q.strip() for q in items if isinstance(q, str) and q.strip()]
+                           if isinstance(items, list) else [])
+        return results
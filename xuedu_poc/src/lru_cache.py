@@ -0,0 +1,65 @@
+"""
+In-memory LRU cache for hot database lookups in the XueDu Chinese Learning App
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar('V')
+
+class LRUCache(Generic[V]):
+    """Thread-safe, size-bounded least-recently-used cache with hit/miss counters.
+
+    Used in front of SQLite for lookups whose answers rarely or never change,
+    such as YuKuai rows and slug to ID mappings. Callers are responsible for
+    invalidating entries when the underlying rows change.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Hashable, V]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: V):
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """Drop key if it is cached"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry, keeping the counters"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current entry count"""
+        with self._lock:
+            entries = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+        }
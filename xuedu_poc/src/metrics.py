@@ -0,0 +1,173 @@
+"""
+In-process timers and counters for the XueDu Chinese Learning App
+"""
+
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar('T')
+F = TypeVar('F', bound=Callable)
+
+# Most recent durations kept per timer for percentiles; count and sum are exact
+TIMER_SAMPLE_SIZE = 1024
+EXPORTED_QUANTILES = (0.5, 0.9, 0.99)
+
+# A metric name with its sorted label pairs
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+def _key(name: str, labels: Dict[str, object]) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+def _quantile(ordered: List[float], q: float) -> float:
+    """Nearest-rank quantile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+def _label_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    """Format label pairs as {a="1",b="2"}, escaped for the text format"""
+    if not labels:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+class _Timer:
+    __slots__ = ('count', 'total', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples: Deque[float] = deque(maxlen=TIMER_SAMPLE_SIZE)
+
+class Metrics:
+    """Thread-safe registry of counters and timers, exported in Prometheus text format.
+
+    Cheap enough to leave on: recording is a lock and a few additions.
+    Timers keep an exact count and sum plus a window of recent durations
+    for percentiles. Names are prefixed with namespace on export.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._counters: Dict[MetricKey, float] = {}
+        self._timers: Dict[MetricKey, _Timer] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add value to a counter"""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Record one duration for a timer"""
+        key = _key(name, labels)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                timer = self._timers[key] = _Timer()
+            timer.count += 1
+            timer.total += seconds
+            timer.samples.append(seconds)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Time the body of a with block, whether or not it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels) -> Callable[[F], F]:
+        """Decorator timing every call of a function"""
+        def decorate(fn: F) -> F:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.time(name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def time_iter(self, items: Iterable[T], name: str, **labels) -> Iterator[T]:
+        """Yield from items, timing how long each item takes to produce"""
+        iterator = iter(items)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(name, time.perf_counter() - started, **labels)
+            yield item
+
+    def timer_stats(self) -> List[Dict]:
+        """Return name, labels, count, total and p50/p99 seconds for every timer"""
+        with self._lock:
+            timers = [(key, timer.count, timer.total, sorted(timer.samples))
+                      for key, timer in self._timers.items()]
+        return [{
+            'name': name,
+            'labels': dict(labels),
+            'count': count,
+            'total': total,
+            'p50': _quantile(samples, 0.5),
+            'p99': _quantile(samples, 0.99),
+        } for (name, labels), count, total, samples in sorted(timers)]
+
+    def reset(self):
+        """Drop every recorded value"""
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def render(self) -> str:
+        """Export every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted((key, timer.count, timer.total, sorted(timer.samples))
+                            for key, timer in self._timers.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            full_name = f"{self.namespace}_{name}"
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{full_name}{_label_text(labels)} {value:g}")
+        for (name, labels), count, total, samples in timers:
+            full_name = f"{self.namespace}_{name}"
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append(f"# TYPE {full_name} summary")
+            for q in EXPORTED_QUANTILES:
+                lines.append(f"{full_name}{_label_text(labels + (('quantile', str(q)),))} {_quantile(samples, q):.6f}")
+            lines.append(f"{full_name}_sum{_label_text(labels)} {total:.6f}")
+            lines.append(f"{full_name}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def format_profile(self, wall_seconds: float) -> str:
+        """Summarize every timer as a table, busiest first
+
+        share is each timer's total over wall_seconds; timers nest and run
+        concurrently, so shares need not add up to 100%.
+        """
+        stats = sorted(self.timer_stats(), key=lambda stat: stat['total'], reverse=True)
+        if not stats:
+            return "No timings recorded."
+        rows = [f"{'stage':<34}{'calls':>8}{'total s':>10}{'share':>8}{'p50 ms':>10}{'p99 ms':>10}"]
+        for stat in stats:
+            label = ",".join(stat['labels'].values())
+            stage = f"{stat['name']}{f' [{label}]' if label else ''}"
+            share = stat['total'] / wall_seconds if wall_seconds > 0 else 0.0
+            rows.append(f"{stage:<34}{stat['count']:>8}{stat['total']:>10.3f}{share:>8.1%}"
+                        f"{stat['p50'] * 1000:>10.3f}{stat['p99'] * 1000:>10.3f}")
+        return "\n".join(rows)
+
+# The registry used throughout the app
+METRICS = Metrics("xuedu")
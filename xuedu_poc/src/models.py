@@ -2,7 +2,9 @@
 Data models and structures for the XueDu Chinese Learning App
 """
 
-from dataclasses import dataclass
+import json
+from array import array
+from dataclasses import dataclass, field
 from typing import List, Dict, Optional
 
 @dataclass
@@ -21,3 +23,55 @@ class Sentence:
     id: int
     text: str
     yu_kuai_ids: List[int]
+
+@dataclass(frozen=True, slots=True)
+class YuKuaiRecord:
+    """A stored YuKuai as read from the database
+    
+    Slotted and immutable, with extra_metadata kept as its JSON text and
+    only decoded the first time it is accessed.
+    """
+    id: int
+    type: str
+    canonical_name: str
+    slug: str
+    description: str
+    extra_metadata_json: str = field(repr=False)
+    _extra_metadata: Optional[Dict] = field(default=None, init=False, repr=False, compare=False)
+    
+    @property
+    def extra_metadata(self) -> Dict:
+        if self._extra_metadata is None:
+            object.__setattr__(self, '_extra_metadata', json.loads(self.extra_metadata_json))
+        return self._extra_metadata
+
+@dataclass(frozen=True, slots=True)
+class SentenceRecord:
+    """A processed sentence held for the dashboard, with its YuKuai IDs packed in an array"""
+    id: int
+    text: str
+    yu_kuai_ids: array  # array('I') of YuKuai IDs
+    
+    @classmethod
+    def create(cls, id: int, text: str, yu_kuai_ids: List[int]) -> 'SentenceRecord':
+        return cls(id=id, text=text, yu_kuai_ids=array('I', yu_kuai_ids))
+
+@dataclass
+class IngestJob:
+    """Progress of ingesting one version of a file"""
+    id: int
+    file_path: str
+    resume_offset: int  # Byte offset before which every sentence is done
+    resume_seq: int  # Sequence number of the first sentence after resume_offset
+    status: str  # "running" or "completed"
+
+@dataclass
+class IngestEvent:
+    """Something that happened while ingesting a file or a list of lines"""
+    kind: str  # "started", "sentence", "failed", "progress", "completed" or "error"
+    source: str  # File path, or the job name for annotate_events
+    seq: Optional[int] = None  # Sentence position, for "sentence" and "failed"
+    text: Optional[str] = None
+    yu_kuai: List[YuKuaiRecord] = field(default_factory=list)  # For "sentence", in sentence order
+    error: Optional[str] = None  # For "failed" and "error"
+    stats: Dict = field(default_factory=dict)  # Running counts for "started", "progress" and "completed"
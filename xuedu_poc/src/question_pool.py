@@ -0,0 +1,103 @@
+"""
+Pre-generated quiz question pool for the XueDu Chinese Learning App
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from models import YuKuai
+from database import XueDuDB
+from llm_parser import LLMParser
+from text_stream import batched
+
+# Questions kept ready per YuKuai, and the level that triggers a refill
+POOL_TARGET_SIZE = 3
+POOL_REFILL_THRESHOLD = 1
+
+# YuKuai per generation request, and requests in flight at once
+GENERATION_BATCH_SIZE = 10
+GENERATION_WORKERS = 2
+
+class QuestionPool:
+    """Persisted quiz questions, generated ahead of time in background threads.
+
+    Questions are stored in the quiz_questions table so the quiz reads them
+    with one indexed DELETE ... RETURNING instead of waiting on the LLM.
+    Taking a question that leaves fewer than refill_threshold behind queues
+    a refill; prefill() tops up many YuKuai at once, in batched requests.
+    """
+
+    def __init__(self, db: XueDuDB, llm_parser: LLMParser,
+                 target_size: int = POOL_TARGET_SIZE,
+                 refill_threshold: int = POOL_REFILL_THRESHOLD,
+                 batch_size: int = GENERATION_BATCH_SIZE,
+                 workers: int = GENERATION_WORKERS):
+        self.db = db
+        self.llm_parser = llm_parser
+        self.target_size = target_size
+        self.refill_threshold = refill_threshold
+        self.batch_size = batch_size
+        self.failed_count = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="question-pool")
+        self._futures: List[Future] = []
+        # YuKuai with a refill queued or running, so they are not queued twice
+        self._pending: Dict[int, YuKuai] = {}
+        self._lock = threading.Lock()
+
+    def take(self, yu_kuai: YuKuai) -> Optional[str]:
+        """Return a pooled question for yu_kuai, or None if none is ready"""
+        question = self.db.take_quiz_question(yu_kuai.id)
+        self.prefill([yu_kuai], threshold=self.refill_threshold)
+        return question
+
+    def prefill(self, yu_kuai_list: List[YuKuai], threshold: Optional[int] = None):
+        """Queue generation for every YuKuai with fewer than threshold questions
+
+        threshold defaults to target_size, i.e. top up anything not full.
+        Returns immediately; generation runs on the pool's threads.
+        """
+        if not self.llm_parser.backend or not yu_kuai_list:
+            return
+        threshold = self.target_size if threshold is None else threshold
+
+        counts = self.db.count_quiz_questions(yu_kuai.id for yu_kuai in yu_kuai_list)
+        with self._lock:
+            wanted = []
+            for yu_kuai in yu_kuai_list:
+                if counts.get(yu_kuai.id, 0) < threshold and yu_kuai.id not in self._pending:
+                    self._pending[yu_kuai.id] = yu_kuai
+                    wanted.append(yu_kuai)
+
+            self._futures = [future for future in self._futures if not future.done()]
+            for batch in batched(wanted, self.batch_size):
+                self._futures.append(self._executor.submit(self._refill, batch))
+
+    def _refill(self, batch: List[YuKuai]):
+        """Generate and store enough questions to bring each YuKuai to target_size"""
+        try:
+            counts = self.db.count_quiz_questions(yu_kuai.id for yu_kuai in batch)
+            per_yu_kuai = max(self.target_size - min(counts.values()), 1)
+            questions = self.llm_parser.generate_quiz_questions(batch, per_yu_kuai)
+            self.db.add_quiz_questions([
+                (yu_kuai.id, question)
+                for yu_kuai, generated in zip(batch, questions)
+                for question in generated[:self.target_size - counts[yu_kuai.id]]
+            ])
+        except Exception:
+            # Leave the pool as it is; the quiz falls back to asking the LLM directly
+            self.failed_count += 1
+        finally:
+            with self._lock:
+                for yu_kuai in batch:
+                    self._pending.pop(yu_kuai.id, None)
+
+    def wait(self):
+        """Block until every queued refill has finished"""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """Drop queued refills and wait for running ones"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,126 @@
+"""
+Rate-limit aware scheduling of concurrent LLM calls for the XueDu Chinese Learning App
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar('T')
+
+# Backoff defaults for HTTP 429 responses
+DEFAULT_MAX_RETRIES = 6
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+def find_rate_limit_error(exc: BaseException) -> Optional[BaseException]:
+    """Return exc, or the exception it wraps, if it is an HTTP 429"""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if getattr(exc, 'status_code', None) == 429 or type(exc).__name__ == 'RateLimitError':
+            return exc
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Read a Retry-After header from an API error, if present"""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """Bounds concurrency and token throughput of async API calls.
+
+    Calls are admitted once a concurrency slot is free and the token bucket
+    (refilled continuously at tokens_per_minute) covers the call's estimated
+    cost. A 429 from any call pauses every caller for the backoff period, so
+    the whole pipeline slows down together instead of hammering the API.
+    """
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int,
+                 max_retries: int = DEFAULT_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.tokens_per_minute = tokens_per_minute
+        self.rate_limited_count = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tokens = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._bucket_lock = asyncio.Lock()
+
+    async def _wait_for_budget(self, tokens: int):
+        """Sleep until the shared pause has passed and the bucket covers tokens"""
+        # A single call may never exceed the whole bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(
+                    self.tokens_per_minute,
+                    self._tokens + (now - self._last_refill) * self.tokens_per_minute / 60.0
+                )
+                self._last_refill = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) * 60.0 / self.tokens_per_minute)
+
+    async def run(self, call: Callable[[], Awaitable[T]], estimated_tokens: int) -> T:
+        """Run call under the concurrency and token limits, retrying on 429"""
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                await self._wait_for_budget(estimated_tokens)
+                try:
+                    return await call()
+                except Exception as e:
+                    rate_limit_error = find_rate_limit_error(e)
+                    if rate_limit_error is None or attempt >= self.max_retries:
+                        raise
+                    retry_after = _retry_after(rate_limit_error)
+
+            attempt += 1
+            self.rate_limited_count += 1
+            delay = retry_after or min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt)
+            delay *= 1 + random.random() * 0.25
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+class LimitedRunner:
+    """One event loop and RateLimiter that outlive a single batch of calls.
+
+    asyncio primitives and async HTTP clients are bound to the loop they are
+    used on, so a fresh asyncio.run() per window would also start a fresh
+    token bucket and forget any 429 pause. Running every window of a job
+    through one LimitedRunner keeps both until close().
+    """
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int):
+        self.max_concurrency = max_concurrency
+        self._loop = asyncio.new_event_loop()
+        # Create the limiter on its loop; older Pythons bind locks on creation
+        self.limiter = self.run(self._create_limiter(max_concurrency, tokens_per_minute))
+
+    @staticmethod
+    async def _create_limiter(max_concurrency: int, tokens_per_minute: int) -> RateLimiter:
+        return RateLimiter(max_concurrency=max_concurrency, tokens_per_minute=tokens_per_minute)
+
+    def run(self, coro: Awaitable[T]) -> T:
+        """Run coro to completion on the runner's loop"""
+        return self._loop.run_until_complete(coro)
+
+    def close(self, cleanup: Optional[Callable[[], Awaitable[None]]] = None):
+        """Await cleanup (e.g. closing async clients) on the loop, then close it"""
+        try:
+            if cleanup is not None:
+                self.run(cleanup())
+        finally:
+            self._loop.close()
@@ -0,0 +1,51 @@
+"""
+Full-text search helpers for the XueDu Chinese Learning App
+"""
+
+import re
+import unicodedata
+from typing import Dict, Optional, Tuple
+
+CJK_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+LATIN_WORD = re.compile(r'[a-z0-9]+')
+
+def spaced_cjk(text: str) -> str:
+    """Put spaces between CJK characters so the tokenizer indexes each one.
+
+    unicode61 treats a run of ideographs as a single token; one token per
+    character lets a phrase query match any substring of a Chinese name.
+    """
+    return CJK_RUN.sub(lambda match: f" {' '.join(match.group())} ", text).strip()
+
+def toneless_pinyin(pinyin: str) -> str:
+    """Strip tone marks and tone numbers: "nǐ hǎo" / "ni3 hao3" -> "ni hao" """
+    decomposed = unicodedata.normalize('NFD', pinyin.lower().replace('u:', 'ü'))
+    # Keep ü distinguishable as v, the usual way of typing it
+    decomposed = decomposed.replace('ü', 'v')
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(LATIN_WORD.findall(re.sub(r'\d', ' ', stripped)))
+
+def search_fields(canonical_name: str, description: str, extra_metadata: Dict) -> Tuple[str, str, str]:
+    """Return the (name, description, pinyin) columns indexed for a YuKuai
+
+    The pinyin column holds the toneless syllables followed by their
+    concatenation, so both "ni hao" and "nihao" match.
+    """
+    pinyin = extra_metadata.get('pinyin') if isinstance(extra_metadata, dict) else None
+    syllables = toneless_pinyin(pinyin) if isinstance(pinyin, str) else ''
+    if ' ' in syllables:
+        syllables = f"{syllables} {syllables.replace(' ', '')}"
+    return spaced_cjk(canonical_name), description, syllables
+
+def build_match_query(query: str) -> Optional[str]:
+    """Translate free text into an FTS5 MATCH expression, or None if it has no terms
+
+    Chinese runs become phrases over the name column; latin words are
+    toneless prefix terms over every column. All terms must match.
+    """
+    terms = []
+    for run in CJK_RUN.findall(query):
+        terms.append(f'name : "{" ".join(run)}"')
+    for word in toneless_pinyin(CJK_RUN.sub(' ', query)).split():
+        terms.append(f'"{word}"*')
+    return ' AND '.join(terms) if terms else None
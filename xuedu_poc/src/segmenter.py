@@ -0,0 +1,163 @@
+"""
+Local dictionary-based segmentation for the XueDu Chinese Learning App
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from models import YuKuai, YuKuaiRecord
+from database import XueDuDB
+
+# Traditional Simplified [pin1 yin1] /definition 1/definition 2/
+CEDICT_LINE = re.compile(r'^(\S+)\s+(\S+)\s+\[(.+?)\]\s+/(.*)/\s*$')
+CJK_CHAR = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+# Definitions that make a CC-CEDICT entry useless as a study item
+SKIPPED_DEFINITION_PREFIXES = ("variant of", "old variant of", "see ", "surname ")
+
+# Shortest CC-CEDICT word used for offline resolution; single characters are
+# left to the LLM, which can tell which sense a character takes in context
+MIN_CEDICT_WORD_LENGTH = 2
+
+@dataclass
+class DictionaryEntry:
+    """A CC-CEDICT entry"""
+    simplified: str
+    pinyin: str  # Numbered pinyin, e.g. "ni3 hao3"
+    definitions: List[str]
+
+@dataclass
+class Segmentation:
+    """Result of segmenting a sentence against known vocabulary"""
+    yu_kuai: List[Union[YuKuai, YuKuaiRecord]] = field(default_factory=list)  # Matched vocab, in sentence order
+    unresolved: List[str] = field(default_factory=list)  # Runs of CJK characters with no match
+
+def is_cjk_word(text: str) -> bool:
+    """Return True if text is non-empty and made only of CJK ideographs"""
+    return bool(text) and all(CJK_CHAR.match(ch) for ch in text)
+
+def load_cedict(path: str) -> Iterator[DictionaryEntry]:
+    """Read entries from a CC-CEDICT file, the format parse-dictionary.ts uses"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or line.startswith('%') or not line.strip():
+                continue
+            match = CEDICT_LINE.match(line.strip())
+            if not match:
+                continue
+            _, simplified, pinyin, definitions = match.groups()
+            yield DictionaryEntry(simplified, pinyin, [d for d in definitions.split('/') if d])
+
+def cedict_yu_kuai(entry: DictionaryEntry) -> YuKuai:
+    """Build a vocab YuKuai from a CC-CEDICT entry"""
+    syllables = re.sub(r'[^a-z0-9]', '', entry.pinyin.lower().replace('u:', 'v'))
+    # Codepoints keep homophones such as 是/事 (shi4) apart
+    codepoints = '_'.join(f'{ord(ch):x}' for ch in entry.simplified)
+    return YuKuai(
+        id=None,
+        type="vocab",
+        canonical_name=entry.simplified,
+        slug=f"{syllables}_{codepoints}",
+        description="; ".join(entry.definitions[:3]),
+        extra_metadata={"pinyin": entry.pinyin, "source": "CC-CEDICT"}
+    )
+
+class _TrieNode:
+    __slots__ = ('children', 'value')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.value = None
+
+class Segmenter:
+    """Longest-match segmenter over stored vocab and an optional CC-CEDICT file.
+
+    Vocab already in the yu_kuai table always wins over dictionary entries, so
+    offline resolution reuses existing rows instead of creating near-duplicates.
+    """
+
+    def __init__(self, db: XueDuDB, cedict_path: Optional[str] = None):
+        self._root = _TrieNode()
+        self.size = 0
+        self.last_vocab_id = 0  # Highest stored vocab ID loaded by refresh()
+
+        self.refresh(db)
+
+        if cedict_path:
+            for entry in load_cedict(cedict_path):
+                if (len(entry.simplified) >= MIN_CEDICT_WORD_LENGTH
+                        and is_cjk_word(entry.simplified)
+                        and not all(d.startswith(SKIPPED_DEFINITION_PREFIXES) for d in entry.definitions)):
+                    self._insert(entry.simplified, entry, overwrite=False)
+
+    def refresh(self, db: XueDuDB):
+        """Learn the vocab stored since the last refresh, including rows other processes wrote"""
+        for yu_kuai_id, canonical_name, slug, description in db.get_vocab_index(after_id=self.last_vocab_id):
+            self.add(YuKuaiRecord(yu_kuai_id, "vocab", canonical_name, slug, description, "{}"))
+            self.last_vocab_id = yu_kuai_id
+
+    def add(self, yu_kuai: Union[YuKuai, YuKuaiRecord]):
+        """Learn a vocab YuKuai so later sentences can resolve it offline"""
+        if yu_kuai.type != "vocab":
+            return
+        # Drop disambiguation such as "闻 (古义)"
+        word = yu_kuai.canonical_name.split('(')[0].split('（')[0].strip()
+        if is_cjk_word(word):
+            self._insert(word, yu_kuai, overwrite=True)
+
+    def _insert(self, word: str, value, overwrite: bool):
+        node = self._root
+        for ch in word:
+            node = node.children.setdefault(ch, _TrieNode())
+        if node.value is None:
+            self.size += 1
+        elif not overwrite or not isinstance(node.value, DictionaryEntry):
+            # Keep the first stored sense of a word
+            return
+        node.value = value
+
+    def _longest_match(self, text: str, start: int) -> Tuple[int, object]:
+        """Return (length, value) of the longest known word starting at start"""
+        node = self._root
+        best_length, best_value = 0, None
+        for i in range(start, len(text)):
+            node = node.children.get(text[i])
+            if node is None:
+                break
+            if node.value is not None:
+                best_length, best_value = i - start + 1, node.value
+        return best_length, best_value
+
+    def segment(self, sentence: str) -> Segmentation:
+        """Split a sentence into known vocab and unresolved CJK spans"""
+        result = Segmentation()
+        seen_slugs = set()
+        span_start = None
+        i = 0
+        while i < len(sentence):
+            if not CJK_CHAR.match(sentence[i]):
+                if span_start is not None:
+                    result.unresolved.append(sentence[span_start:i])
+                    span_start = None
+                i += 1
+                continue
+
+            length, value = self._longest_match(sentence, i)
+            if not length:
+                if span_start is None:
+                    span_start = i
+                i += 1
+                continue
+
+            if span_start is not None:
+                result.unresolved.append(sentence[span_start:i])
+                span_start = None
+            yu_kuai = cedict_yu_kuai(value) if isinstance(value, DictionaryEntry) else value
+            if yu_kuai.slug not in seen_slugs:
+                seen_slugs.add(yu_kuai.slug)
+                result.yu_kuai.append(yu_kuai)
+            i += length
+
+        if span_start is not None:
+            result.unresolved.append(sentence[span_start:])
+        return result
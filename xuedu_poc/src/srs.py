@@ -0,0 +1,56 @@
+"""
+Spaced-repetition scheduling (SM-2) for the XueDu Chinese Learning App
+"""
+
+from dataclasses import dataclass
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# SM-2 parameters
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+FIRST_INTERVAL_DAYS = 1.0
+SECOND_INTERVAL_DAYS = 6.0
+# A lapsed item comes back in the same session instead of a day later
+RELEARN_INTERVAL_DAYS = 10 / (24 * 60)
+
+# Review quality on SM-2's 0-5 scale; 3 and above counts as recalled
+QUALITY_FORGOT = 1
+QUALITY_UNSURE = 2
+QUALITY_GOOD = 4
+QUALITY_PERFECT = 5
+PASSING_QUALITY = 3
+
+@dataclass
+class ReviewState:
+    """Scheduling state of one YuKuai for one user"""
+    ease: float = DEFAULT_EASE
+    interval_days: float = 0.0
+    repetitions: int = 0
+    due_at: float = 0.0  # Unix timestamp; 0 means due immediately
+
+def review(state: ReviewState, quality: int, now: float) -> ReviewState:
+    """Apply one SM-2 review of the given quality and return the new state"""
+    if not 0 <= quality <= 5:
+        raise ValueError(f"Review quality must be between 0 and 5, got {quality}")
+
+    ease = max(MIN_EASE, state.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+
+    if quality < PASSING_QUALITY:
+        repetitions = 0
+        interval_days = RELEARN_INTERVAL_DAYS
+    else:
+        repetitions = state.repetitions + 1
+        if repetitions == 1:
+            interval_days = FIRST_INTERVAL_DAYS
+        elif repetitions == 2:
+            interval_days = SECOND_INTERVAL_DAYS
+        else:
+            interval_days = state.interval_days * ease
+
+    return ReviewState(
+        ease=ease,
+        interval_days=interval_days,
+        repetitions=repetitions,
+        due_at=now + interval_days * SECONDS_PER_DAY
+    )
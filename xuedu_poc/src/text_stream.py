@@ -0,0 +1,100 @@
+"""
+Incremental sentence splitting of text files for the XueDu Chinese Learning App
+"""
+
+import codecs
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar('T')
+
+SENTENCE_DELIMITER = re.compile(r'[。！？!?\n]')
+READ_CHUNK_SIZE = 64 * 1024
+# Text with no delimiter for this long is split anyway, so one sentence
+# never holds a whole unpunctuated file
+MAX_SENTENCE_CHARS = 1000
+
+@dataclass
+class SentenceSpan:
+    """A sentence read from a file"""
+    seq: int  # Position of the sentence within the file, counting from 0
+    text: str
+    end_offset: int  # Byte offset just past the sentence and its delimiter
+
+def iter_sentences(file_path: str, start_offset: int = 0, start_seq: int = 0,
+                   chunk_size: int = READ_CHUNK_SIZE,
+                   max_sentence_chars: int = MAX_SENTENCE_CHARS) -> Iterator[SentenceSpan]:
+    """Yield the sentences of a UTF-8 file without reading it all into memory.
+
+    Splits on the same punctuation as before (。！？!?) and on line breaks,
+    and cuts text with no delimiter every max_sentence_chars characters.
+    Handles sentences and multi-byte characters that straddle chunk
+    boundaries. Reading can resume from a byte offset previously reported
+    in end_offset.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ""
+    offset = start_offset
+    seq = start_seq
+
+    with open(file_path, 'rb') as f:
+        f.seek(start_offset)
+        while True:
+            chunk = f.read(chunk_size)
+            # The carried-over buffer has no delimiter, so only new text is searched
+            scan_from = len(buffer)
+            buffer += decoder.decode(chunk, final=not chunk)
+
+            position = 0
+            for match in SENTENCE_DELIMITER.finditer(buffer, scan_from):
+                offset += len(buffer[position:match.end()].encode('utf-8'))
+                text = buffer[position:match.start()].strip()
+                position = match.end()
+                if text:
+                    yield SentenceSpan(seq=seq, text=text, end_offset=offset)
+                    seq += 1
+            while len(buffer) - position >= max_sentence_chars:
+                end = position + max_sentence_chars
+                offset += len(buffer[position:end].encode('utf-8'))
+                text = buffer[position:end].strip()
+                position = end
+                if text:
+                    yield SentenceSpan(seq=seq, text=text, end_offset=offset)
+                    seq += 1
+            buffer = buffer[position:]
+
+            if not chunk:
+                break
+
+    text = buffer.strip()
+    if text:
+        yield SentenceSpan(seq=seq, text=text, end_offset=offset + len(buffer.encode('utf-8')))
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Group an iterable into lists of at most size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def growing_batches(items: Iterable[T], first_size: int, max_size: int) -> Iterator[List[T]]:
+    """Group an iterable into lists that double in size from first_size up to max_size
+
+    The first items come out almost immediately, while later batches are
+    as large as batched() would make them.
+    """
+    size = first_size
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+            size = min(size * 2, max_size)
+    if batch:
+        yield batch
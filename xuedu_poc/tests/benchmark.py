@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Ingestion benchmark for the Chinese Learning App
+Runs process_file on synthetic corpora against the fake LLM backend
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Add src directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from app import XueDuApp
+from llm_backend import FakeBackend
+
+DEFAULT_SIZES = [200, 1000, 5000]
+
+# Synthetic corpora draw words from a Zipf-distributed vocabulary, so common
+# words repeat across sentences the way they do in real text
+CORPUS_VOCAB_SIZE = 3000
+CORPUS_WORDS_PER_SENTENCE = (3, 8)
+CJK_RANGE = (0x4e00, 0x9fa5)
+
+def make_corpus(path: str, sentence_count: int, seed: int = 0) -> int:
+    """Write a deterministic corpus of sentence_count sentences, returns its size in bytes"""
+    rng = random.Random(seed)
+    vocab = [''.join(chr(rng.randint(*CJK_RANGE)) for _ in range(rng.choice((1, 2, 2, 3))))
+             for _ in range(CORPUS_VOCAB_SIZE)]
+    weights = [1 / rank for rank in range(1, len(vocab) + 1)]
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(sentence_count):
+            words = rng.choices(vocab, weights, k=rng.randint(*CORPUS_WORDS_PER_SENTENCE))
+            f.write(''.join(words) + ('。\n' if i % 5 == 4 else '。'))
+    return os.path.getsize(path)
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of values, 0 if there are none"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+def instrument(app: XueDuApp, timings: dict, db_ops: list):
+    """Time each ingestion stage and count SQL statements run against the database
+
+    Stages are individual calls: "segment" resolves a batch offline, "llm"
+    parses a batch, "store_yu_kuai", "store_sentence" and "checkpoint" are
+    the writes of one sentence or commit, and "commit" is one whole
+    transaction of parsed results.
+    """
+    def timed(stage, fn):
+        samples = timings.setdefault(stage, [])
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - started)
+        return wrapper
+
+    def timed_async(stage, fn):
+        samples = timings.setdefault(stage, [])
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - started)
+        return wrapper
+
+    app._resolve_offline = timed('segment', app._resolve_offline)
+    app.llm_parser.parse_sentences = timed('llm', app.llm_parser.parse_sentences)
+    app.llm_parser.parse_sentences_async = timed_async('llm', app.llm_parser.parse_sentences_async)
+    app.db.get_or_create_many = timed('store_yu_kuai', app.db.get_or_create_many)
+    app.db.record_sentence = timed('store_sentence', app.db.record_sentence)
+    app.db.advance_ingest_job = timed('checkpoint', app.db.advance_ingest_job)
+    app.store_window = timed('commit', app.store_window)
+
+    def count_statement(statement):
+        db_ops[0] += 1
+
+    open_connection = app.db._open_connection
+
+    def open_traced_connection(*args, **kwargs):
+        conn = open_connection(*args, **kwargs)
+        conn.set_trace_callback(count_statement)
+        return conn
+
+    app.db._open_connection = open_traced_connection
+    for conn in app.db._connections:
+        conn.set_trace_callback(count_statement)
+
+def run_once(corpus_path: str, work_dir: str, args, trace_memory: bool) -> dict:
+    """Ingest corpus_path into fresh databases and return the measurements"""
+    for name in ("bench.db", "bench_cache.db"):
+        for suffix in ("", "-wal", "-shm"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(work_dir, name + suffix))
+
+    backend = FakeBackend(latency=args.latency, error_rate=args.error_rate,
+                          yu_kuai_per_sentence=args.yu_kuai_per_sentence, seed=args.seed)
+    app = XueDuApp(db_path=os.path.join(work_dir, "bench.db"),
+                   llm_cache_path=os.path.join(work_dir, "bench_cache.db"),
+                   retain_sentences=False, llm_backend=backend)
+    app.tokens_per_minute = 10 ** 12  # The fake backend has no rate limit
+    # Measure ingestion only, not the quiz questions generated after it
+    app.question_pool.prefill = lambda *args, **kwargs: None
+
+    timings = {}
+    db_ops = [0]
+    instrument(app, timings, db_ops)
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.process_file(corpus_path, concurrency=args.concurrency)
+    elapsed = time.perf_counter() - started
+    peak_bytes = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    results = app.results[-1]
+    app.close()
+    return {
+        'elapsed': elapsed,
+        'sentences': results['sentence_count'],
+        'failed': results['failed_count'],
+        'offline': results['offline_count'],
+        'llm_requests': backend.request_count,
+        'db_ops': db_ops[0],
+        'peak_bytes': peak_bytes,
+        'stages': {
+            stage: {'calls': len(samples),
+                    'p50_ms': percentile(samples, 50) * 1000,
+                    'p99_ms': percentile(samples, 99) * 1000}
+            for stage, samples in timings.items() if samples
+        },
+    }
+
+def run_benchmark(args) -> list:
+    """Benchmark every corpus size in args.sizes, printing a report for each"""
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="xuedu_bench_") as work_dir:
+        for size in args.sizes:
+            corpus_path = os.path.join(work_dir, f"corpus_{size}.txt")
+            corpus_bytes = make_corpus(corpus_path, size, seed=args.seed)
+
+            # Timings come from a run without tracemalloc, which slows allocation
+            report = run_once(corpus_path, work_dir, args, trace_memory=False)
+            if not args.no_memory:
+                report['peak_bytes'] = run_once(corpus_path, work_dir, args, trace_memory=True)['peak_bytes']
+            report.update(corpus_sentences=size, corpus_bytes=corpus_bytes)
+            reports.append(report)
+            print_report(report)
+    return reports
+
+def print_report(report: dict):
+    """Print the measurements for one corpus"""
+    elapsed = max(report['elapsed'], 1e-9)
+    processed = report['sentences'] + report['failed']
+    print(f"\n📏 {report['corpus_sentences']:,} sentences ({report['corpus_bytes']:,} bytes)")
+    print(f"   ⏱️  {elapsed:.2f}s | {processed / elapsed:,.1f} sentences/s | "
+          f"{report['db_ops'] / elapsed:,.0f} DB ops/s")
+    print(f"   🤖 {report['llm_requests']} LLM requests | {report['offline']} sentences resolved offline | "
+          f"{report['failed']} failed")
+    if report['peak_bytes'] is not None:
+        print(f"   🧠 Peak memory: {report['peak_bytes'] / 2 ** 20:.1f} MiB")
+    print(f"   {'stage':<16}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for stage, stats in report['stages'].items():
+        print(f"   {stage:<16}{stats['calls']:>8}{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+
+def main():
+    """Benchmark entry point"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark process_file on synthetic corpora with a fake LLM backend",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python tests/benchmark.py                                  # 200, 1000 and 5000 sentences
+  python tests/benchmark.py --sizes 20000 --no-memory        # One large corpus, timings only
+  python tests/benchmark.py --latency 0.2 --concurrency 8    # Simulate a slow API in parallel
+  python tests/benchmark.py --json results.json              # Save results to compare later
+        """
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Corpus sizes in sentences (default: 200 1000 5000)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Fake LLM seconds per request (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of fake LLM requests that fail (default: 0)')
+    parser.add_argument('--yu-kuai-per-sentence', type=int, default=3,
+                        help='YuKuai the fake LLM returns per sentence (default: 3)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Sentences parsed concurrently (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the corpora and fake LLM (default: 0)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc pass for peak memory')
+    parser.add_argument('--json', metavar='PATH', help='Also write the results to a JSON file')
+    args = parser.parse_args()
+
+    print("=== Chinese Learning App - Ingestion Benchmark ===")
+    reports = run_benchmark(args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'results': reports}, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -74,47 +74,26 @@ def run_demo():
         "这个汉字'闻'在古代有'听到消息'的意思。"
     ]
     
-    for i, sentence_text in enumerate(sample_sentences, 1):
+    # Parse the sentences as one stored job; the app keeps them for the dashboard
+    annotated = app.annotate_lines("demo", sample_sentences)
+    for i, (sentence_text, yu_kuai_list) in enumerate(annotated, 1):
         print(f"\nProcessing sentence {i}: {sentence_text}")
-        
-        # Use fallback parsing (since no API key)
-        yu_kuai_list = app.llm_parser.parse_sentence(sentence_text)
-        
-        # Store YuKuai and get IDs
-        yu_kuai_ids = []
+        if yu_kuai_list is None:
+            print("  (not parsed; set OPENAI_API_KEY to parse with the LLM)")
+            continue
         for yu_kuai in yu_kuai_list:
-            yu_kuai_id = app.db.get_or_create_yu_kuai(yu_kuai)
-            yu_kuai_ids.append(yu_kuai_id)
             print(f"  - {yu_kuai.canonical_name} ({yu_kuai.type})")
-        
-        # Store sentence
-        app.sentence_counter += 1
-        from models import Sentence
-        sentence = Sentence(
-            id=app.sentence_counter,
-            text=sentence_text,
-            yu_kuai_ids=yu_kuai_ids
-        )
-        app.sentences.append(sentence)
     
     # Demo 4: Show analytics
     print("\nDemo 4: Learning analytics...")
     
     # Overall text score
-    total_text_score = 0
-    for sentence in app.sentences:
-        for yu_kuai_id in sentence.yu_kuai_ids:
-            with app.db.db_path as conn:
-                import sqlite3
-                conn = sqlite3.connect(app.db.db_path)
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT score FROM user_scores 
-                    WHERE user_id = ? AND yu_kuai_id = ?
-                """, (1, yu_kuai_id))
-                score = cursor.fetchone()[0]
-                total_text_score += score
-                conn.close()
+    scores = app.db.get_yu_kuai_with_scores_by_ids(
+        (yu_kuai_id for sentence in app.sentences for yu_kuai_id in sentence.yu_kuai_ids),
+        user_id=app.user_id
+    )
+    total_text_score = sum(scores[yu_kuai_id][1]
+                           for sentence in app.sentences for yu_kuai_id in sentence.yu_kuai_ids)
     
     print(f"  Total text score: {total_text_score}")
     
@@ -13,8 +13,26 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from database import XueDuDB
-from models import YuKuai
-from app import XueDuApp
+from models import YuKuai, Sentence, SentenceRecord
+from app import XueDuApp, QUIZ_PREFILL_COUNT
+from llm_backend import FakeBackend, LLMBackend
+from llm_cache import LLMCache
+from llm_parser import LLMParser, MODEL, PARSE_PROMPT_VERSION
+from metrics import METRICS, Metrics
+from question_pool import QuestionPool
+from rate_limiter import RateLimiter
+import srs
+from segmenter import Segmenter
+from text_stream import iter_sentences
+
+class FunctionBackend(LLMBackend):
+    """A backend whose replies come from a test's function"""
+    
+    def __init__(self, reply):
+        self.reply = reply
+    
+    def complete(self, request):
+        return self.reply(request)
 
 def test_database():
     """Test basic database operations"""
@@ -39,31 +57,1111 @@ def test_database():
     
     # Retrieve and verify
     retrieved = db.get_yu_kuai_by_id(yu_kuai_id)
-    if retrieved:
-        print(f"Retrieved: {retrieved.canonical_name} ({retrieved.type})")
-        print(f"Description: {retrieved.description}")
-        print(f"Metadata: {retrieved.extra_metadata}")
-    else:
-        print("Failed to retrieve YuKuai")
+    print(f"Retrieved: {retrieved.canonical_name} ({retrieved.type}), metadata {retrieved.extra_metadata}")
+    assert (retrieved.canonical_name, retrieved.slug, retrieved.type) == ("你好", "nihao", "vocab")
+    assert retrieved.extra_metadata == {"pinyin": "nǐ hǎo", "HSK": 1}
+    assert db.get_yu_kuai_by_id(yu_kuai_id + 1) is None
     
     # Test duplicate handling
     duplicate_id = db.get_or_create_yu_kuai(test_yu_kuai)
     print(f"Duplicate YuKuai returned ID: {duplicate_id}")
-    print(f"Should be same as original: {duplicate_id == yu_kuai_id}")
+    assert duplicate_id == yu_kuai_id
     
-    # Test scoring
+    # Scores start at 0 and never go negative
     db.update_score(yu_kuai_id, 2)
-    print("Updated score +2")
-    
-    # Get scores
-    scores = db.get_all_yu_kuai_with_scores()
-    print(f"Total YuKuai with scores: {len(scores)}")
+    db.update_score(yu_kuai_id, -5)
+    db.update_score(yu_kuai_id, 1)
+    scores = [(yu_kuai.id, score) for yu_kuai, score in db.get_all_yu_kuai_with_scores()]
+    print(f"Scores: {scores}")
+    assert scores == [(yu_kuai_id, 1)]
     
     # Cleanup
     import os
+    db.close()
     os.remove("test.db")
     print("Test database cleaned up")
 
+def test_transaction():
+    """Test that transaction() commits once and rolls back on error"""
+    print("\nTesting transaction scope...")
+    
+    db = XueDuDB("test_tx.db")
+    
+    with db.transaction():
+        for i in range(3):
+            db.get_or_create_yu_kuai(YuKuai(
+                id=None, type="vocab", canonical_name=f"词{i}", slug=f"ci_{i}",
+                description="test", extra_metadata={}
+            ))
+    print(f"Committed YuKuai: {len(db.get_all_yu_kuai_with_scores())}")
+    assert len(db.get_all_yu_kuai_with_scores()) == 3
+    
+    try:
+        with db.transaction():
+            db.get_or_create_yu_kuai(YuKuai(
+                id=None, type="vocab", canonical_name="错", slug="cuo",
+                description="test", extra_metadata={}
+            ))
+            raise ValueError("abort")
+    except ValueError:
+        pass
+    print(f"After rollback: {len(db.get_all_yu_kuai_with_scores())}")
+    assert len(db.get_all_yu_kuai_with_scores()) == 3
+    
+    # The write lock is held for exactly the outermost transaction
+    def other_can_write():
+        other = sqlite3.connect("test_tx.db", timeout=0, isolation_level=None)
+        try:
+            other.execute("BEGIN IMMEDIATE")
+            other.execute("ROLLBACK")
+            return True
+        except sqlite3.OperationalError:
+            return False
+        finally:
+            other.close()
+    
+    with db.transaction():
+        with db.transaction():
+            assert not other_can_write()
+        assert not other_can_write()  # Leaving the nested scope does not commit
+    assert other_can_write()
+    try:
+        with db.transaction():
+            with db.transaction():
+                raise ValueError("abort")
+    except ValueError:
+        pass
+    assert other_can_write()
+    
+    db.close()
+    os.remove("test_tx.db")
+
+def test_bulk_upsert():
+    """Test batch get-or-create with duplicate slugs"""
+    print("\nTesting bulk upsert...")
+    
+    db = XueDuDB("test_bulk.db")
+    
+    existing_id = db.get_or_create_yu_kuai(YuKuai(
+        id=None, type="vocab", canonical_name="你好", slug="nihao",
+        description="hello", extra_metadata={}
+    ))
+    batch = [
+        YuKuai(id=None, type="vocab", canonical_name="我", slug="wo",
+               description="I", extra_metadata={}),
+        YuKuai(id=None, type="vocab", canonical_name="你好", slug="nihao",
+               description="hello", extra_metadata={}),
+        YuKuai(id=None, type="vocab", canonical_name="我", slug="wo",
+               description="I", extra_metadata={}),
+    ]
+    ids = db.get_or_create_many(batch)
+    print(f"Batch returned IDs: {ids}")
+    assert ids[1] == existing_id
+    assert ids[0] == ids[2] != existing_id
+    assert len(db.get_all_yu_kuai_with_scores()) == 2
+    
+    # Bulk fetch with scores in one query
+    db.update_score(existing_id, 2)
+    fetched = db.get_yu_kuai_with_scores_by_ids(ids)
+    print(f"Bulk fetched: {[(y.canonical_name, score) for y, score in fetched.values()]}")
+    assert set(fetched) == set(ids)
+    assert fetched[existing_id][1] == 2
+    
+    db.close()
+    os.remove("test_bulk.db")
+
+def test_llm_cache():
+    """Test that cached LLM responses are served without an API call"""
+    print("\nTesting LLM response cache...")
+    
+    cache = LLMCache("test_cache.db")
+    parser = LLMParser(cache=cache)
+    parser.backend = None  # Any API call would raise
+    
+    key = LLMCache.make_key(MODEL, PARSE_PROMPT_VERSION, "你好")
+    cache.put(key, json.dumps([{
+        "type": "vocab", "canonical_name": "你好", "slug": "nihao",
+        "description": "hello", "extra_metadata": {"pinyin": "nǐ hǎo"}
+    }]))
+    
+    yu_kuai_list = parser.parse_sentence("你好")
+    print(f"Cached parse: {[y.canonical_name for y in yu_kuai_list]}")
+    assert [y.slug for y in yu_kuai_list] == ["nihao"]
+    
+    try:
+        parser.parse_sentence("再见")
+        assert False, "uncached sentence should need the LLM"
+    except RuntimeError:
+        pass
+    
+    stats = cache.stats()
+    print(f"Cache stats: {stats}")
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    
+    cache.close()
+    os.remove("test_cache.db")
+
+def test_rate_limiter():
+    """Test bounded concurrency and retry after a 429"""
+    print("\nTesting rate limiter...")
+    import asyncio
+    
+    class FakeRateLimitError(Exception):
+        status_code = 429
+        class response:
+            headers = {'retry-after': '0.01'}
+    
+    limiter = RateLimiter(max_concurrency=2, tokens_per_minute=1_000_000)
+    running = 0
+    peak = 0
+    failures = {3: 1}
+    
+    async def call(i):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if failures.get(i):
+            failures[i] -= 1
+            raise FakeRateLimitError()
+        return i
+    
+    async def run_all():
+        return await asyncio.gather(*(limiter.run(lambda i=i: call(i), 10) for i in range(6)))
+    
+    results = asyncio.run(run_all())
+    print(f"Results: {results}, peak concurrency: {peak}, backoffs: {limiter.rate_limited_count}")
+    assert results == list(range(6))
+    assert peak <= 2
+    assert limiter.rate_limited_count == 1
+
+def test_batch_parsing():
+    """Test multi-sentence batches, including splitting on malformed output"""
+    print("\nTesting batched sentence parsing...")
+    
+    requests_seen = []
+    
+    def complete(request):
+        prompt = request["messages"][0]["content"]
+        requests_seen.append(prompt)
+        if len(requests_seen) == 1:
+            content = "not json"
+        elif "Sentences:" in prompt:
+            lines = prompt.split("Sentences:\n")[1].split("\n\n")[0].split("\n")
+            content = json.dumps({
+                line.split(": ", 1)[0]: [{"type": "vocab", "canonical_name": line.split(": ", 1)[1],
+                                          "slug": f"s{line.split(': ', 1)[0]}", "description": "a line",
+                                          "extra_metadata": {}}]
+                for line in lines
+            })
+        else:
+            content = json.dumps([{"type": "vocab", "canonical_name": "single", "slug": "single",
+                                   "description": "a single line", "extra_metadata": {}}])
+        return content
+    
+    parser = LLMParser(backend=FunctionBackend(complete))
+    
+    outcomes = parser.parse_sentences(["一", "二", "三"])
+    print(f"Requests: {len(requests_seen)}, outcomes: {[[y.canonical_name for y in o] for o in outcomes]}")
+    assert [[y.canonical_name for y in o] for o in outcomes] == [["single"], ["二"], ["三"]]
+    assert len(requests_seen) == 3
+    
+    # A reply with no content is malformed too, not a crash
+    empty = LLMParser(backend=FunctionBackend(lambda request: None))
+    assert all(isinstance(o, RuntimeError) for o in empty.parse_sentences(["一", "二"]))
+    
+    batches = LLMParser.plan_batches(["句子"] * 100)
+    print(f"Planned batch sizes: {[len(b) for b in batches]}")
+    assert sum(len(b) for b in batches) == 100 and len(batches) < 100
+
+def test_segmenter():
+    """Test longest-match segmentation over stored vocab and CC-CEDICT"""
+    print("\nTesting offline segmentation...")
+    
+    db = XueDuDB("test_seg.db")
+    db.get_or_create_many([
+        YuKuai(id=None, type="vocab", canonical_name="你好", slug="nihao",
+               description="hello", extra_metadata={}),
+        YuKuai(id=None, type="vocab", canonical_name="我", slug="wo",
+               description="I", extra_metadata={}),
+    ])
+    with open("test_cedict.txt", "w", encoding="utf-8") as f:
+        f.write("# comment\n")
+        f.write("學生 学生 [xue2 sheng5] /student/schoolchild/\n")
+        f.write("你好 你好 [ni3 hao3] /hello/hi/\n")
+    
+    segmenter = Segmenter(db, cedict_path="test_cedict.txt")
+    result = segmenter.segment("你好，我是学生")
+    print(f"Known: {[y.canonical_name for y in result.yu_kuai]}, unresolved: {result.unresolved}")
+    assert [y.canonical_name for y in result.yu_kuai] == ["你好", "我", "学生"]
+    assert result.yu_kuai[0].slug == "nihao"  # Stored vocab wins over the dictionary
+    assert result.unresolved == ["是"]
+    
+    # Vocab stored through another connection is picked up on refresh
+    other = XueDuDB("test_seg.db")
+    other.get_or_create_many([YuKuai(id=None, type="vocab", canonical_name="是", slug="shi",
+                                     description="to be", extra_metadata={})])
+    other.close()
+    assert segmenter.segment("我是").unresolved == ["是"]
+    segmenter.refresh(db)
+    assert [y.slug for y in segmenter.segment("我是").yu_kuai] == ["wo", "shi"]
+    
+    db.close()
+    os.remove("test_seg.db")
+    os.remove("test_cedict.txt")
+
+def test_streaming_sentences():
+    """Test incremental sentence splitting across chunk boundaries"""
+    print("\nTesting streaming sentence splitting...")
+    import re
+    
+    sample_path = os.path.join(os.path.dirname(__file__), '..', 'sample_text.txt')
+    with open(sample_path, 'r', encoding='utf-8') as f:
+        expected = [s.strip() for s in re.split(r'[。！？!?]', f.read()) if s.strip()]
+    
+    # Tiny chunks split multi-byte characters and sentences
+    spans = list(iter_sentences(sample_path, chunk_size=5))
+    print(f"Streamed {len(spans)} sentences, expected {len(expected)}")
+    assert [span.text for span in spans] == expected
+    assert [span.seq for span in spans] == list(range(len(expected)))
+    
+    # Resuming from a reported offset continues with the next sentence
+    resumed = list(iter_sentences(sample_path, start_offset=spans[1].end_offset, start_seq=2))
+    assert [span.text for span in resumed] == expected[2:]
+    assert resumed[0].seq == 2
+    
+    # Text with no punctuation splits on line breaks, then at a maximum length
+    with open("test_unpunctuated.txt", "w", encoding="utf-8") as f:
+        f.write("第一行没有标点\n第二行也没有\n" + "字" * 2500)
+    spans = list(iter_sentences("test_unpunctuated.txt", chunk_size=7, max_sentence_chars=1000))
+    print(f"Unpunctuated sentence lengths: {[len(span.text) for span in spans]}")
+    assert [len(span.text) for span in spans] == [7, 6, 1000, 1000, 500]
+    assert spans[-1].end_offset == os.path.getsize("test_unpunctuated.txt")
+    resumed = list(iter_sentences("test_unpunctuated.txt", start_offset=spans[2].end_offset, start_seq=3))
+    assert [span.text for span in resumed] == [span.text for span in spans[3:]]
+    os.remove("test_unpunctuated.txt")
+
+def test_resumable_ingestion():
+    """Test that a rerun skips done sentences and retries failed ones"""
+    print("\nTesting resumable ingestion...")
+    import app as app_module
+    
+    sample_path = os.path.join(os.path.dirname(__file__), '..', 'sample_text.txt')
+    original_paths = app_module.DATABASE_PATH, app_module.LLM_CACHE_PATH
+    app_module.DATABASE_PATH, app_module.LLM_CACHE_PATH = "test_resume.db", "test_resume_cache.db"
+    try:
+        app = XueDuApp()
+        parsed = []
+        
+        def parse_sentences(sentences):
+            parsed.extend(sentences)
+            return [RuntimeError("outage") if "天气" in s and fail else
+                    [YuKuai(id=None, type="grammar", canonical_name=s[:3], slug=f"g{len(parsed)}_{i}",
+                            description="", extra_metadata={})]
+                    for i, s in enumerate(sentences)]
+        
+        app.llm_parser.parse_sentences = parse_sentences
+        fail = True
+        app.process_file(sample_path)
+        first_run = len(parsed)
+        
+        parsed.clear()
+        fail = False
+        app.process_file(sample_path)
+        print(f"First run parsed {first_run} sentences, rerun parsed {parsed}")
+        assert len(parsed) == 1 and "天气" in parsed[0]
+        
+        parsed.clear()
+        app.process_file(sample_path)
+        assert parsed == []
+        
+        app.close()
+    finally:
+        app_module.DATABASE_PATH, app_module.LLM_CACHE_PATH = original_paths
+        for path in ("test_resume.db", "test_resume_cache.db"):
+            os.remove(path)
+
+def test_keyset_pagination():
+    """Test score-ordered pages and migrating a pre-versioning database"""
+    print("\nTesting schema migrations and keyset pagination...")
+    
+    # A database created before schema versioning existed
+    conn = sqlite3.connect("test_pages.db")
+    conn.execute("""
+        CREATE TABLE yu_kuai (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT NOT NULL,
+                              canonical_name TEXT NOT NULL, slug TEXT UNIQUE NOT NULL,
+                              description TEXT NOT NULL, extra_metadata TEXT NOT NULL)
+    """)
+    conn.commit()
+    conn.close()
+    
+    db = XueDuDB("test_pages.db")
+    version = db._get_connection().execute("PRAGMA user_version").fetchone()[0]
+    print(f"Schema version after migration: {version}")
+    assert version >= 3
+    
+    ids = db.get_or_create_many([
+        YuKuai(id=None, type="vocab", canonical_name=f"词{i}", slug=f"ci_{i}",
+               description="", extra_metadata={})
+        for i in range(7)
+    ])
+    for i, yu_kuai_id in enumerate(ids):
+        db.update_score(yu_kuai_id, i % 3)
+    
+    seen = []
+    after = None
+    while True:
+        page = db.get_least_learned_yu_kuai_page(limit=3, after=after)
+        if not page:
+            break
+        seen.extend((score, yu_kuai.id) for yu_kuai, score in page)
+        after = (page[-1][1], page[-1][0].id)
+    print(f"Ascending pages: {seen}")
+    assert seen == sorted(seen) and len(seen) == 7
+    
+    first = db.get_all_yu_kuai_with_scores_page(limit=4)
+    rest = db.get_all_yu_kuai_with_scores_page(limit=4, after=(first[-1][1], first[-1][0].id))
+    descending = [(score, yu_kuai.id) for yu_kuai, score in first + rest]
+    assert descending == sorted(seen, reverse=True)
+    
+    # Never-reviewed items (no score row) interleave with reviewed score-0
+    # items by ID, and every page size visits each item exactly once
+    unseen = db.get_or_create_many([
+        YuKuai(id=None, type="vocab", canonical_name=f"新{i}", slug=f"xin_{i}",
+               description="", extra_metadata={})
+        for i in range(3)
+    ])
+    db.update_score(ids[0], 0)
+    expected = sorted([(i % 3, yu_kuai_id) for i, yu_kuai_id in enumerate(ids)] +
+                      [(0, yu_kuai_id) for yu_kuai_id in unseen])
+    for limit in (1, 2, 3, len(expected), len(expected) + 1):
+        for get_page, order in ((db.get_least_learned_yu_kuai_page, expected),
+                                (db.get_all_yu_kuai_with_scores_page, expected[::-1])):
+            pages = []
+            after = None
+            while True:
+                page = [(score, yu_kuai.id) for yu_kuai, score in get_page(limit=limit, after=after)]
+                assert len(page) <= limit
+                if not page:
+                    break
+                pages.append(page)
+                after = page[-1]
+            assert [item for page in pages for item in page] == order
+            assert all(len(page) == limit for page in pages[:-1])
+    # Past the last item there is nothing left in either direction
+    assert db.get_least_learned_yu_kuai_page(limit=5, after=expected[-1]) == []
+    assert db.get_all_yu_kuai_with_scores_page(limit=5, after=expected[0]) == []
+    
+    db.close()
+    os.remove("test_pages.db")
+
+def test_spaced_repetition():
+    """Test SM-2 scheduling and the due queue"""
+    print("\nTesting spaced repetition...")
+    
+    db = XueDuDB("test_srs.db")
+    ids = db.get_or_create_many([
+        YuKuai(id=None, type="vocab", canonical_name=f"字{i}", slug=f"zi_{i}",
+               description="", extra_metadata={})
+        for i in range(3)
+    ])
+    now = 1_000_000.0
+    
+    # New items are due straight away
+    assert len(db.get_due_yu_kuai(limit=10, now=now)) == 3
+    
+    state = db.review_yu_kuai(ids[0], srs.QUALITY_GOOD, now=now)
+    assert state.interval_days == srs.FIRST_INTERVAL_DAYS
+    state = db.review_yu_kuai(ids[0], srs.QUALITY_GOOD, now=now)
+    assert state.interval_days == srs.SECOND_INTERVAL_DAYS
+    db.review_yu_kuai(ids[1], srs.QUALITY_FORGOT, now=now)
+    print(f"Intervals: good twice -> {state.interval_days} days, ease {state.ease:.2f}")
+    
+    due = [yu_kuai.id for yu_kuai, _ in db.get_due_yu_kuai(limit=10, now=now)]
+    assert due == [ids[2]]
+    later = now + srs.SECONDS_PER_DAY
+    due = [yu_kuai.id for yu_kuai, _ in db.get_due_yu_kuai(limit=10, now=later)]
+    assert due == [ids[1], ids[2]]
+    assert db.get_yu_kuai_score(ids[0]) == 2
+    
+    # A missed item comes back before new ones, even with a short queue
+    more = db.get_or_create_many([
+        YuKuai(id=None, type="vocab", canonical_name=f"新{i}", slug=f"xin_{i}",
+               description="", extra_metadata={})
+        for i in range(5)
+    ])
+    db.review_yu_kuai(ids[2], srs.QUALITY_UNSURE, now=later)
+    hour_later = later + 60 * 60
+    due = [yu_kuai.id for yu_kuai, _ in db.get_due_yu_kuai(limit=2, now=hour_later)]
+    print(f"Due after a miss: {due}")
+    assert due == [ids[1], ids[2]]
+    due = [yu_kuai.id for yu_kuai, _ in db.get_due_yu_kuai(limit=4, now=hour_later)]
+    assert due == [ids[1], ids[2], more[0], more[1]]
+    
+    plan = db._get_connection().execute(
+        "EXPLAIN QUERY PLAN SELECT yu_kuai_id FROM user_scores WHERE user_id = 1 AND due_at <= 0 ORDER BY due_at, yu_kuai_id"
+    ).fetchall()
+    print(f"Due queue plan: {plan[0][-1]}")
+    assert "idx_user_scores_due" in plan[0][-1]
+    
+    db.close()
+    os.remove("test_srs.db")
+
+def test_multi_user():
+    """Test per-user scores, lazy score rows and per-user score databases"""
+    print("\nTesting multi-user scores...")
+    
+    for user_db_dir in (None, "test_users"):
+        db = XueDuDB("test_users.db", user_db_dir=user_db_dir)
+        ids = db.get_or_create_many([
+            YuKuai(id=None, type="vocab", canonical_name=f"人{i}", slug=f"ren_{i}",
+                   description="", extra_metadata={})
+            for i in range(4)
+        ])
+        
+        # No score rows until a learner reviews something
+        rows = db._get_connection(2).execute("SELECT COUNT(*) FROM user_scores").fetchone()[0]
+        assert rows == 0
+        
+        db.update_score(ids[0], 2, user_id=2)
+        db.review_yu_kuai(ids[1], 4, user_id=3)
+        assert db.get_yu_kuai_score(ids[0], user_id=2) == 2
+        assert db.get_yu_kuai_score(ids[0], user_id=3) == 0
+        
+        least = [yu_kuai.id for yu_kuai, _ in db.get_least_learned_yu_kuai(limit=10, user_id=2)]
+        assert least == [ids[1], ids[2], ids[3], ids[0]]
+        top = db.get_all_yu_kuai_with_scores_page(limit=2, user_id=3)
+        assert [(yu_kuai.id, score) for yu_kuai, score in top] == [(ids[1], 1), (ids[3], 0)]
+        
+        # Pages of one learner's scores do not skip or repeat across the
+        # boundary between reviewed and never-reviewed items
+        pages = [db.get_least_learned_yu_kuai_page(limit=2, user_id=2)]
+        while pages[-1]:
+            pages.append(db.get_least_learned_yu_kuai_page(
+                limit=2, after=(pages[-1][-1][1], pages[-1][-1][0].id), user_id=2))
+        assert [[yu_kuai.id for yu_kuai, _ in page] for page in pages] == [[ids[1], ids[2]], [ids[3], ids[0]], []]
+        
+        if user_db_dir:
+            def can_lock(path):
+                other = sqlite3.connect(path, timeout=0, isolation_level=None)
+                try:
+                    other.execute("BEGIN IMMEDIATE")
+                    other.execute("ROLLBACK")
+                    return True
+                except sqlite3.OperationalError:
+                    return False
+                finally:
+                    other.close()
+            
+            # A learner's review does not wait on a writer holding the shared database
+            user_path = os.path.join(user_db_dir, "user_2.db")
+            blocker = sqlite3.connect("test_users.db", timeout=0, isolation_level=None)
+            blocker.execute("BEGIN IMMEDIATE")
+            db._get_connection(2).execute("PRAGMA busy_timeout = 0")
+            db.update_score(ids[2], 1, user_id=2)
+            blocker.execute("ROLLBACK")
+            blocker.close()
+            assert db.get_yu_kuai_score(ids[2], user_id=2) == 1
+            # ...and holds only that learner's lock, released on commit
+            with db.transaction(user_id=2):
+                db.update_score(ids[3], 1, user_id=2)
+                assert not can_lock(user_path)
+                assert can_lock("test_users.db")
+                assert can_lock(os.path.join(user_db_dir, "user_3.db"))
+            assert can_lock(user_path)
+            
+            # Per-thread user connections are capped, closing the least
+            # recently used ones but never one inside a transaction
+            from database import MAX_USER_CONNECTIONS_PER_THREAD
+            with db.transaction(user_id=2):
+                for user_id in range(100, 100 + MAX_USER_CONNECTIONS_PER_THREAD + 2):
+                    db.get_yu_kuai_score(ids[0], user_id=user_id)
+                user_conns = db._local.user_conns
+                print(f"Per-user connections kept: {list(user_conns)}")
+                assert len(user_conns) == MAX_USER_CONNECTIONS_PER_THREAD
+                assert 2 in user_conns and 3 not in user_conns
+                assert list(user_conns)[-1] == 100 + MAX_USER_CONNECTIONS_PER_THREAD + 1
+                db.update_score(ids[0], 1, user_id=2)
+            open_user_conns = [conn for conn in db._connections if conn in user_conns.values()]
+            assert len(open_user_conns) == MAX_USER_CONNECTIONS_PER_THREAD
+            # An evicted learner reconnects with their scores intact
+            assert db.get_yu_kuai_score(ids[1], user_id=3) == 1
+        
+        db.close()
+        os.remove("test_users.db")
+    
+    for name in os.listdir("test_users"):
+        os.remove(os.path.join("test_users", name))
+    os.rmdir("test_users")
+
+def test_question_pool():
+    """Test batched background question generation and taking from the pool"""
+    print("\nTesting quiz question pool...")
+    import time
+    
+    requests_seen = []
+    
+    def complete(request):
+        prompt = request["messages"][0]["content"]
+        requests_seen.append(prompt)
+        numbers = [line.split(":", 1)[0] for line in prompt.split("\n\n")[1].split("\n")]
+        return json.dumps({n: [f"问题{n}-{k}" for k in range(3)] for n in numbers})
+    
+    db = XueDuDB("test_pool.db")
+    parser = LLMParser(backend=FunctionBackend(complete))
+    pool = QuestionPool(db, parser, target_size=3, refill_threshold=1, batch_size=4)
+    
+    ids = db.get_or_create_many([
+        YuKuai(id=None, type="vocab", canonical_name=f"题{i}", slug=f"ti_{i}",
+               description="", extra_metadata={})
+        for i in range(6)
+    ])
+    yu_kuai_list = [db.get_yu_kuai_by_id(yu_kuai_id) for yu_kuai_id in ids]
+    
+    pool.prefill(yu_kuai_list)
+    pool.wait()
+    print(f"Requests for {len(yu_kuai_list)} YuKuai: {len(requests_seen)}")
+    assert len(requests_seen) == 2
+    assert db.count_quiz_questions(ids) == {yu_kuai_id: 3 for yu_kuai_id in ids}
+    
+    started = time.perf_counter()
+    questions = [pool.take(yu_kuai_list[0]) for _ in range(3)]
+    print(f"Took {questions} in {(time.perf_counter() - started) * 1000 / 3:.3f} ms each")
+    assert questions == ["问题0-0", "问题0-1", "问题0-2"]
+    
+    # Dropping below the threshold queued a refill back to the target size
+    pool.wait()
+    assert db.count_quiz_questions([ids[0]])[ids[0]] == 3
+    assert len(requests_seen) == 3
+    
+    pool.close()
+    db.close()
+    os.remove("test_pool.db")
+
+def test_process_file_prefills_questions():
+    """Test that processing a file ends by generating questions for the quiz"""
+    print("\nTesting question prefill after processing a file...")
+    
+    sample_path = os.path.join(os.path.dirname(__file__), '..', 'sample_text.txt')
+    app = XueDuApp(db_path="test_prefill.db", llm_cache_path="test_prefill_cache.db",
+                   llm_backend=FakeBackend())
+    app.process_file(sample_path)
+    app.question_pool.wait()
+    
+    upcoming = [yu_kuai.id for yu_kuai, _ in app.db.get_due_yu_kuai(limit=QUIZ_PREFILL_COUNT)]
+    counts = app.db.count_quiz_questions(upcoming)
+    print(f"Questions for {len(upcoming)} upcoming YuKuai: {sorted(set(counts.values()))}")
+    assert upcoming
+    assert all(counts[yu_kuai_id] == app.question_pool.target_size for yu_kuai_id in upcoming)
+    question = app.question_pool.take(app.db.get_yu_kuai_by_id(upcoming[0]))
+    assert app.db.get_yu_kuai_by_id(upcoming[0]).canonical_name in question
+    
+    app.close()
+    for path in ("test_prefill.db", "test_prefill_cache.db"):
+        os.remove(path)
+
+def test_compact_models():
+    """Test slotted records with lazily decoded metadata"""
+    print("\nTesting compact YuKuai and sentence records...")
+    import dataclasses
+    import tracemalloc
+    
+    db = XueDuDB("test_compact.db")
+    yu_kuai_id = db.get_or_create_yu_kuai(YuKuai(
+        id=None, type="vocab", canonical_name="学习", slug="xuexi",
+        description="to study", extra_metadata={"pinyin": "xué xí", "HSK": 1}
+    ))
+    record = db.get_yu_kuai_by_id(yu_kuai_id)
+    assert record._extra_metadata is None  # Not decoded yet
+    assert record.extra_metadata == {"pinyin": "xué xí", "HSK": 1}
+    assert not hasattr(record, "__dict__")
+    try:
+        record.slug = "other"
+        assert False, "records should be immutable"
+    except dataclasses.FrozenInstanceError:
+        pass
+    
+    def sentences_size(make):
+        tracemalloc.start()
+        sentences = [make(i) for i in range(2000)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+    
+    plain = sentences_size(lambda i: Sentence(id=i, text="我们一起学习中文", yu_kuai_ids=list(range(i, i + 8))))
+    compact = sentences_size(lambda i: SentenceRecord.create(id=i, text="我们一起学习中文", yu_kuai_ids=range(i, i + 8)))
+    print(f"2000 sentences: {plain:,} bytes as Sentence, {compact:,} bytes as SentenceRecord")
+    assert compact < plain
+    
+    db.close()
+    os.remove("test_compact.db")
+
+def test_lookup_cache():
+    """Test the LRU caches in front of YuKuai, slug and score lookups"""
+    print("\nTesting lookup caches...")
+    
+    db = XueDuDB("test_lru.db")
+    common = [
+        YuKuai(id=None, type="vocab", canonical_name=name, slug=slug, description="", extra_metadata={})
+        for name, slug in (("的", "de"), ("了", "le"), ("是", "shi"))
+    ]
+    first = db.get_or_create_many(common)
+    for _ in range(10):
+        assert db.get_or_create_many(common) == first
+    slug_stats = db.cache_stats()['slug']
+    print(f"Slug cache: {slug_stats}")
+    assert slug_stats['hits'] == 30 and slug_stats['misses'] == 3
+    
+    assert db.get_yu_kuai_by_id(first[0]) is db.get_yu_kuai_by_id(first[0])
+    assert db.cache_stats()['yu_kuai']['hits'] == 1
+    
+    # Scores are written through on update
+    assert db.get_yu_kuai_score(first[1]) == 0
+    db.update_score(first[1], 2)
+    assert db.get_yu_kuai_score(first[1]) == 2
+    
+    # A rolled-back insert must not leave its ID behind in the cache
+    try:
+        with db.transaction():
+            db.get_or_create_many([YuKuai(id=None, type="vocab", canonical_name="吗", slug="ma",
+                                          description="", extra_metadata={})])
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+    assert db.cache_stats()['slug']['entries'] == 0
+    assert db.get_or_create_yu_kuai(common[0]) == first[0]
+    
+    db.close()
+    os.remove("test_lru.db")
+    
+    # The least recently used entry is the one evicted at capacity
+    from lru_cache import LRUCache
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    cache.put("a", 4)  # Replacing a value does not evict
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'hit_rate': 0.75, 'entries': 2}
+    assert cache.get("a") == 4
+
+def test_search():
+    """Test full-text and pinyin search, including backfilling an older database"""
+    print("\nTesting YuKuai search...")
+    
+    db = XueDuDB("test_search.db")
+    db.get_or_create_many([
+        YuKuai(id=None, type="vocab", canonical_name="学习", slug="xuexi",
+               description="to study; to learn", extra_metadata={"pinyin": "xué xí"}),
+        YuKuai(id=None, type="vocab", canonical_name="你好", slug="nihao",
+               description="hello", extra_metadata={"pinyin": "ni3 hao3"}),
+    ])
+    
+    # Rows stored before the index existed are indexed by the migration
+    conn = db._get_connection()
+    conn.execute("DROP TABLE yu_kuai_fts")
+    conn.execute("PRAGMA user_version = 5")
+    db.close()
+    db = XueDuDB("test_search.db")
+    db.get_or_create_yu_kuai(YuKuai(id=None, type="grammar", canonical_name="虽然…但是", slug="suiran_danshi",
+                                    description="although ... but", extra_metadata={}))
+    
+    for query, expected in (("学", ["学习"]), ("xue", ["学习"]), ("xue2 xi2", ["学习"]),
+                            ("nihao", ["你好"]), ("hǎo", ["你好"]), ("learn", ["学习"]),
+                            ("虽然 although", ["虽然…但是"]), ("nothing", []), ("!?", [])):
+        found = [yu_kuai.canonical_name for yu_kuai, _ in db.search(query)]
+        print(f"  {query!r}: {found}")
+        assert found == expected
+    
+    db.close()
+    os.remove("test_search.db")
+
+def test_expand_inputs():
+    """Test that directories and globs expand to sorted, unique text files"""
+    print("\nTesting input expansion...")
+    import shutil
+    from batch import expand_inputs
+    
+    for path, text in (("test_inputs/a.txt", "一。"), ("test_inputs/sub/b.txt", "二。"),
+                       ("test_inputs/sub/notes.md", "三。")):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    try:
+        from_dir = expand_inputs(["test_inputs"])
+        from_glob = expand_inputs(["test_inputs/**/*.txt"])
+        print(f"Directory: {from_dir}, glob: {from_glob}")
+        assert from_dir == [os.path.join("test_inputs", "a.txt"), os.path.join("test_inputs", "sub", "b.txt")]
+        assert from_glob == from_dir
+        # A file named twice, or matched by both a directory and a glob, is kept once
+        assert expand_inputs(["test_inputs/sub/b.txt", "test_inputs/sub", "test_inputs/sub/*"]) == \
+            [os.path.join("test_inputs", "sub", "b.txt"), "test_inputs/sub/notes.md"]
+        # Missing plain paths are kept so the caller can report them
+        assert expand_inputs(["missing.txt", "test_inputs/*.none"]) == ["missing.txt"]
+    finally:
+        shutil.rmtree("test_inputs")
+
+def test_batch_ingestion():
+    """Test that worker processes parse while the parent alone writes every file"""
+    print("\nTesting batch ingestion with 2 workers...")
+    import shutil
+    from batch import BatchIngestor, expand_inputs
+    
+    texts = {"test_batch/a.txt": "我爱学习中文。学习中文很有意思！",
+             "test_batch/b.txt": "我爱吃中国菜。中国菜很好吃。",
+             "test_batch/c.txt": "学习中文。"}
+    os.makedirs("test_batch", exist_ok=True)
+    for path, text in texts.items():
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    
+    backend = FakeBackend(yu_kuai_per_sentence=2)
+    app = XueDuApp(db_path="test_batch.db", llm_cache_path="test_batch_cache.db", llm_backend=backend)
+    try:
+        paths = expand_inputs(["test_batch"])
+        BatchIngestor(app, workers=2, llm_backend=backend).run(paths)
+        
+        assert sorted(result['file'] for result in app.results) == sorted(paths)
+        assert sum(result['failed_count'] for result in app.results) == 0
+        for path in paths:
+            stat = os.stat(path)
+            job = app.db.get_or_create_ingest_job(os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+            stored = app.db.get_job_sentences(job.id)
+            expected = [span.text for span in iter_sentences(path)]
+            print(f"{path}: {len(stored)} sentences, resume_seq {job.resume_seq}")
+            assert [text for _, text, _ in stored] == expected
+            assert all(yu_kuai_ids for _, _, yu_kuai_ids in stored)
+            assert job.status == "completed" and job.resume_seq == len(expected)
+        
+        # Vocab found by different workers is merged into one row each
+        names = [record.canonical_name for record, _ in app.db.get_all_yu_kuai_with_scores()]
+        assert len(names) == len(set(names)) and "我爱" in names
+    finally:
+        app.close()
+        shutil.rmtree("test_batch")
+        for path in ("test_batch.db", "test_batch_cache.db"):
+            os.remove(path)
+
+def test_one_runner_per_job():
+    """Test that concurrent windows of a job share one event loop and rate limiter"""
+    print("\nTesting one event loop per job...")
+    import asyncio
+    
+    class LoopRecordingBackend(FakeBackend):
+        def __init__(self):
+            super().__init__()
+            self.loops = set()
+            self.limiters = set()
+            self.close_count = 0
+        
+        async def complete_async(self, request):
+            self.loops.add(asyncio.get_running_loop())
+            self.limiters.add(app._runner.limiter)
+            return await super().complete_async(request)
+        
+        async def aclose(self):
+            self.close_count += 1
+    
+    backend = LoopRecordingBackend()
+    app = XueDuApp(db_path="test_runner.db", llm_cache_path="test_runner_cache.db", llm_backend=backend)
+    events = list(app.ingest_events("sample_text.txt", concurrency=4))
+    windows = sum(event.kind == 'progress' for event in events)
+    print(f"{windows} windows, {len(backend.loops)} loops, {backend.close_count} closes")
+    assert windows > 1 and backend.request_count > 1
+    assert len(backend.loops) == 1 and len(backend.limiters) == 1
+    assert backend.close_count == 1 and app._runner is None
+    
+    # Stopping a job early still closes the client and loop
+    events = app.annotate_events("runner:2", ["今天天气很好", "我们去公园吧"], concurrency=2)
+    next(events)
+    next(events)
+    events.close()
+    assert backend.close_count == 2 and app._runner is None
+    
+    app.close()
+    for path in ("test_runner.db", "test_runner_cache.db"):
+        os.remove(path)
+
+def test_grammar_for_known_vocab():
+    """Test that sentences made of known vocab still get their grammar from the LLM"""
+    print("\nTesting grammar detection for known vocab...")
+    
+    prompts = []
+    
+    def complete(request):
+        prompts.append(request["messages"][0]["content"])
+        return json.dumps({"0": [
+            {"type": "grammar", "canonical_name": "是…的", "slug": "shi_de",
+             "description": "emphasizes a detail of a past event", "extra_metadata": {}},
+            {"type": "vocab", "canonical_name": "我", "slug": "wo_again", "description": "", "extra_metadata": {}},
+        ]})
+    
+    app = XueDuApp(db_path="test_grammar.db", llm_cache_path="test_grammar_cache.db",
+                   llm_backend=FunctionBackend(complete))
+    for yu_kuai_id in app.db.get_or_create_many([
+        YuKuai(id=None, type="vocab", canonical_name=name, slug=slug, description="", extra_metadata={})
+        for name, slug in (("我", "wo"), ("是", "shi"), ("昨天", "zuotian"), ("来", "lai"), ("的", "de"))
+    ]):
+        app.segmenter.add(app.db.get_yu_kuai_by_id(yu_kuai_id))
+    
+    annotated = app.annotate_lines("grammar:1", ["我是昨天来的"])
+    names = [yu_kuai.canonical_name for yu_kuai in annotated[0][1]]
+    print(f"YuKuai: {names}, requests: {len(prompts)}")
+    assert names == ["我", "是", "昨天", "来", "的", "是…的"]
+    assert len(prompts) == 1 and "do not list vocabulary" in prompts[0]
+    
+    # The grammar is cached, so the same sentence elsewhere needs no request
+    assert app.annotate_lines("grammar:2", ["我是昨天来的"]) == annotated
+    assert len(prompts) == 1
+    
+    app.close()
+    for path in ("test_grammar.db", "test_grammar_cache.db"):
+        os.remove(path)
+
+def test_annotate_lines():
+    """Test annotating lyric lines once and reading them back from the job"""
+    print("\nTesting line annotation...")
+    
+    app = XueDuApp(db_path="test_annotate.db", llm_cache_path="test_annotate_cache.db")
+    parsed = []
+    
+    def parse_sentences(sentences):
+        parsed.extend(sentences)
+        return [RuntimeError("outage") if "雨" in s and fail else
+                [YuKuai(id=None, type="vocab", canonical_name=s[:2], slug=f"line_{s[:2]}",
+                        description="", extra_metadata={})]
+                for s in sentences]
+    
+    app.llm_parser.parse_sentences = parse_sentences
+    lines = ["我爱你", "", "oh baby baby", "下雨天"]
+    fail = True
+    annotated = app.annotate_lines("lrclib:1", lines)
+    print(f"Annotated: {[(text, yu_kuai and [y.canonical_name for y in yu_kuai]) for text, yu_kuai in annotated]}")
+    assert [text for text, _ in annotated] == ["我爱你", "oh baby baby", "下雨天"]
+    assert [y.canonical_name for y in annotated[0][1]] == ["我爱"]
+    assert annotated[1][1] == [] and annotated[2][1] is None
+    assert "oh baby baby" not in parsed
+    
+    # Stored lines are read back; only the failed one is parsed again
+    parsed.clear()
+    fail = False
+    annotated = app.annotate_lines("lrclib:1", lines)
+    assert parsed == ["下雨天"]
+    assert [y.canonical_name for y in annotated[2][1]] == ["下雨"]
+    
+    parsed.clear()
+    assert app.annotate_lines("lrclib:1", lines) == annotated
+    assert parsed == []
+    
+    # Edited text of the same length is a new version and is parsed again
+    edited = ["我恨你", "", "oh baby baby", "下雨天"]
+    annotated = app.annotate_lines("lrclib:1", edited)
+    assert parsed == ["我恨你", "下雨天"]
+    assert [y.canonical_name for y in annotated[0][1]] == ["我恨"]
+    
+    app.close()
+    for path in ("test_annotate.db", "test_annotate_cache.db"):
+        os.remove(path)
+
+def test_ingest_events():
+    """Test that ingestion yields each sentence's YuKuai as soon as it is stored"""
+    print("\nTesting ingestion event stream...")
+    
+    sample_path = os.path.join(os.path.dirname(__file__), '..', 'sample_text.txt')
+    app = XueDuApp(db_path="test_events.db", llm_cache_path="test_events_cache.db")
+    parsed = []
+    
+    def parse_sentences(sentences):
+        parsed.extend(sentences)
+        return [[YuKuai(id=None, type="grammar", canonical_name=s[:3], slug=f"ev_{len(parsed)}_{i}",
+                        description="", extra_metadata={})]
+                for i, s in enumerate(sentences)]
+    
+    app.llm_parser.parse_sentences = parse_sentences
+    events = app.ingest_events(sample_path)
+    assert next(events).kind == "started"
+    first = next(events)
+    print(f"First event: {first.kind} #{first.seq} after parsing {len(parsed)} sentence(s)")
+    assert first.kind == "sentence" and first.seq == 0
+    assert len(parsed) == 1 and first.yu_kuai[0].id is not None
+    events.close()
+    
+    # Stopping early keeps what was yielded; the rest streams on a rerun
+    kinds = [event.kind for event in app.ingest_events(sample_path)]
+    assert kinds[0] == "started" and kinds[-1] == "completed"
+    assert "failed" not in kinds and len(parsed) == kinds.count("sentence") + 1
+    
+    app.close()
+    for path in ("test_events.db", "test_events_cache.db"):
+        os.remove(path)
+
+def test_fake_backend():
+    """Test that the fake LLM backend parses deterministically through LLMParser"""
+    print("\nTesting fake LLM backend...")
+    
+    parser = LLMParser(backend=FakeBackend(yu_kuai_per_sentence=2))
+    outcomes = parser.parse_sentences(["我爱学习中文", "你好"])
+    print(f"Fake outcomes: {[[y.canonical_name for y in o] for o in outcomes]}")
+    assert [[y.canonical_name for y in o] for o in outcomes] == [["我爱", "爱学"], ["你好"]]
+    assert parser.parse_sentences(["我爱学习中文"])[0][1].slug == outcomes[0][1].slug
+    
+    failing = LLMParser(backend=FakeBackend(error_rate=1.0))
+    assert all(isinstance(o, RuntimeError) for o in failing.parse_sentences(["一二", "三四"]))
+    assert failing.backend.error_count == 1
+    
+    # Backends must implement complete()
+    class NoComplete(LLMBackend):
+        pass
+    for backend_class in (LLMBackend, NoComplete):
+        try:
+            backend_class()
+            assert False, "a backend without complete() should not be instantiable"
+        except TypeError:
+            pass
+
+def test_invalid_yu_kuai_not_cached():
+    """Test that a reply with an invalid YuKuai fails its sentence instead of being cached"""
+    print("\nTesting invalid YuKuai in LLM replies...")
+    
+    class InvalidItemBackend(FakeBackend):
+        def _yu_kuai_items(self, sentence):
+            items = super()._yu_kuai_items(sentence)
+            if "天气" in sentence:
+                items += [{"type": "phrase", "canonical_name": "天气", "slug": "tianqi",
+                           "description": "weather", "extra_metadata": {}},
+                          {"type": "vocab", "canonical_name": "公园", "slug": None,
+                           "description": "park", "extra_metadata": []}]
+            return items
+    
+    sample_path = os.path.join(os.path.dirname(__file__), '..', 'sample_text.txt')
+    backend = InvalidItemBackend()
+    app = XueDuApp(db_path="test_invalid.db", llm_cache_path="test_invalid_cache.db",
+                   llm_backend=backend)
+    try:
+        completed = list(app.ingest_events(sample_path))[-1]
+        print(f"Completed: {completed.stats}")
+        assert completed.kind == 'completed' and completed.stats['failed_count'] == 1
+        
+        # Nothing was cached for the failed sentence, so a rerun asks again
+        requests = backend.request_count
+        completed = list(app.ingest_events(sample_path))[-1]
+        assert completed.stats['failed_count'] == 1
+        assert backend.request_count == requests + 1
+        
+        # A valid reply on the retry is stored normally
+        backend._yu_kuai_items = super(InvalidItemBackend, backend)._yu_kuai_items
+        completed = list(app.ingest_events(sample_path))[-1]
+        assert completed.stats['failed_count'] == 0 and completed.stats['sentence_count'] == 1
+    finally:
+        app.close()
+        for path in ("test_invalid.db", "test_invalid_cache.db"):
+            os.remove(path)
+
+def test_metrics():
+    """Test stage timers, counters and their Prometheus export"""
+    print("\nTesting metrics...")
+    
+    metrics = Metrics("test")
+    metrics.inc('requests_total', status='200')
+    metrics.inc('requests_total', 2, status='200')
+    for seconds in (0.1, 0.2, 0.3):
+        metrics.observe('stage_seconds', seconds, stage='parse')
+    with metrics.time('stage_seconds', stage='store'):
+        pass
+    assert list(metrics.time_iter(iter("ab"), 'split_seconds')) == ['a', 'b']
+    
+    text = metrics.render()
+    print(text)
+    assert 'test_requests_total{status="200"} 3' in text
+    assert '# TYPE test_stage_seconds summary' in text
+    assert 'test_stage_seconds_count{stage="parse"} 3' in text
+    assert 'test_stage_seconds{stage="parse",quantile="0.5"} 0.200000' in text
+    assert 'test_split_seconds_count 2' in text
+    assert metrics.format_profile(1.0).splitlines()[1].startswith('stage_seconds [parse]')
+    
+    # Parsing through the app records its stages in the global registry
+    METRICS.reset()
+    parser = LLMParser(backend=FakeBackend(error_rate=1.0))
+    parser.parse_sentences(["一二", "三四"])
+    stats = {(stat['name'], stat['labels'].get('kind')): stat['count'] for stat in METRICS.timer_stats()}
+    assert stats[('llm_request_seconds', 'batch')] == 1
+    assert 'xuedu_llm_errors_total{kind="batch"} 1' in METRICS.render()
+    metrics.reset()
+    assert metrics.render() == ""
+
+def test_interrupted_run_closes_app():
+    """Test that Ctrl-C during ingestion still prints the profile and closes the app"""
+    print("\nTesting an interrupted command-line run...")
+    import contextlib
+    import io
+    import app as app_module
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+    import xuedu
+    
+    closed = []
+    original = (app_module.DATABASE_PATH, app_module.LLM_CACHE_PATH,
+                XueDuApp.process_file, XueDuApp.close, sys.argv)
+    
+    def interrupted(self, file_path, concurrency=1):
+        METRICS.observe('sentence_split_seconds', 0.01)
+        raise KeyboardInterrupt
+    
+    def close(self):
+        closed.append(self)
+        original[3](self)
+    
+    sample_path = os.path.join(os.path.dirname(__file__), '..', 'sample_text.txt')
+    app_module.DATABASE_PATH, app_module.LLM_CACHE_PATH = "test_cli.db", "test_cli_cache.db"
+    XueDuApp.process_file, XueDuApp.close = interrupted, close
+    sys.argv = ["xuedu.py", "--profile", sample_path]
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            xuedu.main()
+    finally:
+        (app_module.DATABASE_PATH, app_module.LLM_CACHE_PATH,
+         XueDuApp.process_file, XueDuApp.close, sys.argv) = original
+    
+    print(output.getvalue())
+    assert len(closed) == 1
+    assert "Goodbye" in output.getvalue() and "sentence_split_seconds" in output.getvalue()
+    for path in ("test_cli.db", "test_cli_cache.db"):
+        os.remove(path)
+
+def test_no_lock_during_llm_calls():
+    """Test that another connection can write while an LLM request is in flight"""
+    print("\nTesting the write lock during LLM calls...")
+    
+    blocked = []
+    
+    class WritingBackend(FakeBackend):
+        def _reply(self, request):
+            # Another process writing while the request is in flight
+            other = sqlite3.connect("test_lock.db", timeout=0, isolation_level=None)
+            try:
+                other.execute("UPDATE ingest_jobs SET updated_at = updated_at")
+            except sqlite3.OperationalError as e:
+                blocked.append(str(e))
+            finally:
+                other.close()
+            return super()._reply(request)
+    
+    sample_path = os.path.join(os.path.dirname(__file__), '..', 'sample_text.txt')
+    app = XueDuApp(db_path="test_lock.db", llm_cache_path="test_lock_cache.db", llm_backend=WritingBackend())
+    for concurrency in (1, 4):
+        kinds = [event.kind for event in app.ingest_events(sample_path, concurrency=concurrency)]
+        assert kinds[-1] == "completed"
+    app.annotate_lines("lrclib:2", ["我爱你", "下雨天"], concurrency=2)
+    print(f"LLM requests: {app.llm_parser.backend.request_count}, writes blocked: {len(blocked)}")
+    assert app.llm_parser.backend.request_count > 0
+    assert blocked == []
+    
+    app.close()
+    for path in ("test_lock.db", "test_lock_cache.db"):
+        os.remove(path)
+
 def test_fallback_parsing():
     """Test fallback parsing without LLM"""
     print("\nTesting fallback parsing...")
@@ -89,6 +1187,33 @@ def main():
     
     try:
         test_database()
+        test_transaction()
+        test_bulk_upsert()
+        test_llm_cache()
+        test_rate_limiter()
+        test_batch_parsing()
+        test_segmenter()
+        test_streaming_sentences()
+        test_resumable_ingestion()
+        test_keyset_pagination()
+        test_spaced_repetition()
+        test_multi_user()
+        test_question_pool()
+        test_process_file_prefills_questions()
+        test_compact_models()
+        test_lookup_cache()
+        test_search()
+        test_expand_inputs()
+        test_batch_ingestion()
+        test_one_runner_per_job()
+        test_grammar_for_known_vocab()
+        test_annotate_lines()
+        test_ingest_events()
+        test_fake_backend()
+        test_invalid_yu_kuai_not_cached()
+        test_metrics()
+        test_interrupted_run_closes_app()
+        test_no_lock_during_llm_calls()
         test_fallback_parsing()
         print("\n✅ All basic tests passed!")
         
@@ -6,14 +6,59 @@ Main entry point for the XueDu Chinese Learning App
 import sys
 import os
 import argparse
+import time
 
 # Add src directory to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from app import XueDuApp
+from app import XueDuApp, DATABASE_PATH
+from batch import BatchIngestor, expand_inputs
+from database import XueDuDB
+from metrics import METRICS
+
+def search_main(argv):
+    """Search stored YuKuai: xuedu.py search QUERY..."""
+    parser = argparse.ArgumentParser(
+        prog="xuedu.py search",
+        description="Search stored YuKuai by Chinese, English or pinyin (tones optional)",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python3 xuedu.py search 学习                        # Names containing 学习
+  python3 xuedu.py search xuexi                       # Pinyin, with or without tones
+  python3 xuedu.py search study --limit 5             # English descriptions
+        """
+    )
+    parser.add_argument('query', nargs='+', help='Search terms; all must match')
+    parser.add_argument('--limit', '-n', type=int, default=20, help='Maximum results (default: 20)')
+    parser.add_argument('--user', '-u', type=int, default=1, help='Learner whose scores to show (default: 1)')
+    parser.add_argument('--user-db-dir', metavar='DIR', help='Directory of per-learner score databases')
+    args = parser.parse_args(argv)
+    
+    db = XueDuDB(DATABASE_PATH, user_db_dir=args.user_db_dir)
+    results = db.search(" ".join(args.query), limit=args.limit, user_id=args.user)
+    if not results:
+        print("No YuKuai found.")
+    for yu_kuai, score in results:
+        pinyin = yu_kuai.extra_metadata.get('pinyin')
+        print(f"• {yu_kuai.canonical_name} ({yu_kuai.type})"
+              f"{f' [{pinyin}]' if pinyin else ''} - {score} points")
+        print(f"  {yu_kuai.description}")
+    db.close()
+
+def print_profile(elapsed: float, batched: bool):
+    """Print the time spent per stage of ingestion"""
+    print(f"\n⏱️  Profile ({elapsed:.2f}s wall clock)")
+    if batched:
+        print("   Parsing ran in worker processes; only the writes are timed here.")
+    print(METRICS.format_profile(elapsed))
 
 def main():
     """Main entry point"""
+    if len(sys.argv) > 1 and sys.argv[1] == 'search':
+        search_main(sys.argv[2:])
+        return
+    
     parser = argparse.ArgumentParser(
         description="XueDu Chinese Learning App - Process Chinese text files into YuKuai",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -21,12 +66,19 @@ def main():
 Examples:
   python3 xuedu.py sample_text.txt                    # Process a single file
   python3 xuedu.py --quiz sample_text.txt             # Process file and run quiz
+  python3 xuedu.py --concurrency 16 novel.txt         # Parse 16 sentences at a time
+  python3 xuedu.py --workers 4 readers/ "extra/**/*.txt"  # Batch-ingest a library
+  python3 xuedu.py --user 2 --quiz sample_text.txt    # Quiz a second learner
+  python3 xuedu.py --profile novel.txt                # Show where ingestion time went
+  python3 xuedu.py search xuexi                       # Search stored YuKuai
         """
     )
     
     parser.add_argument(
-        'file',
-        help='Chinese text file to process'
+        'files',
+        nargs='+',
+        metavar='file',
+        help='Chinese text files, directories or glob patterns to process'
     )
     
     parser.add_argument(
@@ -35,32 +87,98 @@ Examples:
         help='Run quiz mode after processing'
     )
     
+    parser.add_argument(
+        '--concurrency', '-c',
+        type=int,
+        default=8,
+        help='Number of sentences to parse concurrently (default: 8, 1 = sequential)'
+    )
+    
+    parser.add_argument(
+        '--cedict',
+        metavar='PATH',
+        help='CC-CEDICT dictionary file used to resolve known words without the LLM'
+    )
+    
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        default=1,
+        help='Worker processes for parsing several files in parallel (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--user', '-u',
+        type=int,
+        default=1,
+        help='Learner whose scores to show and quiz (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--user-db-dir',
+        metavar='DIR',
+        help='Keep each learner\'s scores in their own database file in DIR'
+    )
+    
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Print time spent per stage (split, LLM, JSON, DB) after processing'
+    )
+    
     args = parser.parse_args()
     
+    app = None
+    started = elapsed = None
     try:
-        app = XueDuApp()
+        app = XueDuApp(cedict_path=args.cedict, retain_sentences=False,
+                       user_id=args.user, user_db_dir=args.user_db_dir)
         
-        # Process the input file
-        file_path = args.file
-        if not os.path.exists(file_path):
-            print(f"❌ File not found: {file_path}")
+        # Process the input files
+        file_paths = expand_inputs(args.files)
+        missing = [path for path in file_paths if not os.path.exists(path)]
+        if missing:
+            print(f"❌ File not found: {missing[0]}")
             sys.exit(1)
-            
-        print(f"\n=== Processing: {file_path} ===")
-        app.process_file(file_path)
+        if not file_paths:
+            print("❌ No text files matched.")
+            sys.exit(1)
+        
+        batched = args.workers > 1 and len(file_paths) > 1
+        METRICS.reset()
+        started = time.perf_counter()
+        if batched:
+            BatchIngestor(app, args.workers, concurrency=args.concurrency,
+                          cedict_path=args.cedict).run(file_paths)
+        else:
+            for file_path in file_paths:
+                print(f"\n=== Processing: {file_path} ===")
+                app.process_file(file_path, concurrency=args.concurrency)
+        
+        elapsed = time.perf_counter() - started
         
         # Display summary
         app.display_summary()
         
+        if args.profile:
+            print_profile(elapsed, batched)
+        
         # Run quiz mode if requested
         if args.quiz:
             app.quiz_mode()
         
     except KeyboardInterrupt:
         print("\n\nGoodbye! 再见!")
+        # An interrupted ingestion still reports where its time went
+        if args.profile and started is not None and elapsed is None:
+            print_profile(time.perf_counter() - started, batched)
     except Exception as e:
         print(f"An error occurred: {e}")
         sys.exit(1)
+    finally:
+        # Stop question generation and checkpoint the databases, even on Ctrl-C
+        if app is not None:
+            app.close()
 
 if __name__ == "__main__":
     main()